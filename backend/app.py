@@ -1,32 +1,144 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, g, request, jsonify, make_response, send_file, Response, stream_with_context
 from flask_pymongo import PyMongo
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 from flask_cors import CORS
+from flask_compress import Compress
 import os
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
 from bson.objectid import ObjectId
 from bson import json_util
-import pandas as pd
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import r2_score
 import numpy as np
-import bcrypt
-from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required, JWTManager
-from functools import wraps
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity, jwt_required, verify_jwt_in_request, JWTManager
+from functools import wraps, lru_cache
 import io
+import csv
+import cProfile
+import pstats
+import base64
+import bisect
+import math
+import click
+import tempfile
+import threading
+import shutil
+import contextvars
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from forecasting import MODELS, make_model, period_index, quarterly_matrix, rolling_origin_backtest
+from forecasting import r2_score as forecast_r2_score
+from cache import ReferenceCache, TTLCache
+from passwords import PasswordHasherBusy, passwords
+from metrics import MongoCommandMetrics, begin_request, end_request, metrics, span
+from indexes import ensure_indexes, explain_hot_queries
+from serialization import API_VERSIONS, DEFAULT_API_VERSION, dumps
 
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app)
 
+# Number of reverse proxies in front of the app, whose X-Forwarded-For gives the client
+# address used by the login rate limits
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+# gzip/brotli/zstd negotiated from Accept-Encoding, including the streamed list formats
+app.config["COMPRESS_MIMETYPES"] = ['application/json', 'application/x-ndjson', 'text/csv']
+Compress(app)
+
 # Setup the Flask-JWT-Extended extension
 app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "super-secret")  # Change this!
 jwt = JWTManager(app)
 
 app.config["MONGO_URI"] = os.getenv("MONGO_URI")
-mongo = PyMongo(app)
+
+# Connection pool and timeouts of the MongoClient, each worker process has its own pool.
+# Unset variables keep the pymongo defaults.
+MONGO_CLIENT_OPTIONS = {
+    'maxPoolSize': 'MONGO_MAX_POOL_SIZE',
+    'minPoolSize': 'MONGO_MIN_POOL_SIZE',
+    'maxIdleTimeMS': 'MONGO_MAX_IDLE_TIME_MS',
+    'waitQueueTimeoutMS': 'MONGO_WAIT_QUEUE_TIMEOUT_MS',
+    'connectTimeoutMS': 'MONGO_CONNECT_TIMEOUT_MS',
+    'serverSelectionTimeoutMS': 'MONGO_SERVER_SELECTION_TIMEOUT_MS',
+    'socketTimeoutMS': 'MONGO_SOCKET_TIMEOUT_MS',
+}
+
+def mongo_client_options():
+    return {option: int(os.environ[name]) for option, name in MONGO_CLIENT_OPTIONS.items() if os.getenv(name)}
+
+# connect=False: the client connects on first use, in the worker that uses it, which
+# keeps the app safe to import before gunicorn forks its workers
+mongo = PyMongo(app, connect=False, event_listeners=[MongoCommandMetrics()], **mongo_client_options())
+
+# Request metrics, see metrics.py. With ?profile=1 an admin gets the cProfile summary
+# of the request instead of its response. Streamed bodies are produced after the
+# request is recorded, so their time only shows in ?profile=1.
+PROFILE_LINES = 40
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+def is_admin_request():
+    try:
+        verify_jwt_in_request()
+    except Exception:
+        return False
+    return has_role('admin')
+
+@app.before_request
+def start_request_metrics():
+    begin_request()
+    if request.args.get('profile') in ('1', 'true') and is_admin_request():
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_request_metrics(response):
+    profiler = g.pop('profiler', None)
+    if profiler:
+        # Consume streamed bodies while profiling, they are part of the work
+        response.get_data()
+        profiler.disable()
+
+    stats = end_request()
+    if stats is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe('pme_http_request_duration_seconds', stats.elapsed(), method=request.method, route=route, status=response.status_code)
+    metrics.observe('pme_http_request_mongo_seconds', stats.mongo_seconds, route=route)
+    if stats.mongo_documents:
+        metrics.inc('pme_mongo_documents_returned_total', stats.mongo_documents, route=route)
+
+    if profiler:
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        return jsonify({"status": response.status_code, **stats.summary(), "profile": output.getvalue()})
+    response.headers['Server-Timing'] = stats.server_timing()
+    return response
+
+# Live role lookups, cached for USER_ROLE_CACHE_TTL seconds and invalidated by the user routes
+USER_ROLE_CACHE_TTL = float(os.getenv("USER_ROLE_CACHE_TTL", 30))
+user_role_cache = TTLCache(ttl=USER_ROLE_CACHE_TTL, maxsize=4096)
+
+def get_user_role(username):
+    def load():
+        user = mongo.db.users.find_one({'username': username}, {'role': 1})
+        return user.get('role') if user else None
+    return user_role_cache.get_or_load(username, load)
+
+# The role is a signed claim of the access token; tokens issued before the claim existed
+# fall back to the live role. A matching claim is confirmed against the (cached) live role
+# so a deleted or demoted user loses the role without waiting for the token to expire.
+def has_role(role):
+    claimed = get_jwt().get('role')
+    if claimed is not None and claimed != role:
+        return False
+    return get_user_role(get_jwt_identity()) == role
 
 # Role-based decorator
 def role_required(role):
@@ -34,9 +146,7 @@ def role_required(role):
         @wraps(fn)
         @jwt_required()
         def decorator(*args, **kwargs):
-            current_user = get_jwt_identity()
-            user = mongo.db.users.find_one({'username': current_user})
-            if user and user.get('role') == role:
+            if has_role(role):
                 return fn(*args, **kwargs)
             else:
                 return jsonify({"error": "Admins only!"}), 403
@@ -50,7 +160,7 @@ def create_initial_admin():
     if admin_username and admin_password:
         admin_user = mongo.db.users.find_one({"username": admin_username})
         if not admin_user:
-            hashed_password = bcrypt.hashpw(admin_password.encode('utf-8'), bcrypt.gensalt())
+            hashed_password = passwords.hash(admin_password)
             mongo.db.users.insert_one({
                 "username": admin_username,
                 "password": hashed_password,
@@ -58,9 +168,122 @@ def create_initial_admin():
             })
             print(f"Admin user '{admin_username}' created.")
 
-# Call this function at startup
-with app.app_context():
+def create_indexes():
+    for error in ensure_indexes(mongo.db):
+        print(f"Could not create index {error}")
+
+# Per-collection version counters, bumped by every write route. They give a cheap
+# fingerprint of the data for caches that must notice any change.
+def bump_data_version(name):
+    mongo.db.data_versions.update_one({'_id': name}, {'$inc': {'version': 1}}, upsert=True)
+    reference_cache.invalidate(name)
+
+def data_versions(*names):
+    versions = {v['_id']: v['version'] for v in mongo.db.data_versions.find({'_id': {'$in': list(names)}})}
+    versions = {name: versions.get(name, 0) for name in names}
+    # The reference cache is then at least as recent as what the caller saw, e.g. an ETag
+    reference_cache.update_versions(versions)
+    return versions
+
+# Serialization of the read routes, see serialization.py. Clients opt in to the compact
+# format with the X-API-Version header (or the api_version query parameter) set to 2.
+def api_version():
+    return request.headers.get('X-API-Version') or request.args.get('api_version') or DEFAULT_API_VERSION
+
+@app.before_request
+def check_api_version():
+    if api_version() not in API_VERSIONS:
+        return jsonify({"error": f"Unsupported API version, expected one of {', '.join(API_VERSIONS)}"}), 400
+
+def json_response(data):
+    return Response(dumps(data, api_version()), mimetype='application/json')
+
+# Conditional GET for read routes: the weak ETag is built from the versions of the
+# collections the route reads, so a client holding an unchanged result gets a 304
+# without the route running its queries. Goes below jwt_required.
+def versioned(*collections):
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            key = [
+                request.full_path,
+                request.headers.get('Accept', ''),
+                api_version(),
+                # Some results depend on the current date (e.g. the analytics trend)
+                datetime.now().date().isoformat(),
+                data_versions(*collections),
+                snapshot_etag_key()
+            ]
+            etag = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(fn(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.vary.add('Accept')
+            response.vary.add('X-API-Version')
+            # Clients may keep the result but must revalidate it on every use
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return decorator
+    return wrapper
+
+# Run once per deployment, before the workers start (gunicorn.conf.py does it)
+@app.cli.command('init-db')
+def init_db_command():
     create_initial_admin()
+    create_indexes()
+
+# Password hashes run in the bounded pool of passwords.py; when it is saturated the
+# request is refused rather than queued behind the others
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    return jsonify({"error": "Server busy, try again shortly"}), 503, {'Retry-After': '1'}
+
+# Login rate limits, shared by all workers through fixed windows of LOGIN_RATE_WINDOW
+# seconds in login_attempts: LOGIN_MAX_ATTEMPTS_PER_IP attempts per client address and
+# LOGIN_MAX_FAILURES_PER_USER failures per username (0 disables a limit). Both are
+# checked before the password is hashed.
+LOGIN_RATE_WINDOW = int(os.getenv("LOGIN_RATE_WINDOW", 300))
+LOGIN_MAX_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_IP", 300))
+LOGIN_MAX_FAILURES_PER_USER = int(os.getenv("LOGIN_MAX_FAILURES_PER_USER", 10))
+
+def login_window_key(kind, value):
+    return f"{kind}:{value}:{int(time.time() // LOGIN_RATE_WINDOW)}"
+
+def login_retry_after():
+    return LOGIN_RATE_WINDOW - int(time.time()) % LOGIN_RATE_WINDOW
+
+def count_login_attempt(kind, value):
+    window_end = (int(time.time() // LOGIN_RATE_WINDOW) + 1) * LOGIN_RATE_WINDOW
+    attempts = mongo.db.login_attempts.find_one_and_update(
+        {'_id': login_window_key(kind, value)},
+        {'$inc': {'count': 1}, '$setOnInsert': {'expires_at': datetime.fromtimestamp(window_end, timezone.utc)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return attempts['count']
+
+def login_failures(username):
+    attempts = mongo.db.login_attempts.find_one({'_id': login_window_key('user', username)}, {'count': 1})
+    return attempts['count'] if attempts else 0
+
+def login_rate_limited(username):
+    if LOGIN_MAX_ATTEMPTS_PER_IP and count_login_attempt('ip', request.remote_addr) > LOGIN_MAX_ATTEMPTS_PER_IP:
+        return True
+    return bool(LOGIN_MAX_FAILURES_PER_USER) and login_failures(username) >= LOGIN_MAX_FAILURES_PER_USER
+
+# Replace a hash made with another work factor than BCRYPT_ROUNDS, unless the password
+# changed meanwhile. Skipped when the pool is busy, the next login will do it.
+def rehash_password(user, password):
+    try:
+        hashed_password = passwords.hash(password)
+    except PasswordHasherBusy:
+        return
+    mongo.db.users.update_one({'_id': user['_id'], 'password': user['password']}, {'$set': {'password': hashed_password}})
 
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -71,12 +294,22 @@ def login():
     if not username or not password:
         return jsonify({"error": "Missing username or password"}), 400
 
+    if login_rate_limited(username):
+        return jsonify({"error": "Too many login attempts, try again later"}), 429, {'Retry-After': str(login_retry_after())}
+
     user = mongo.db.users.find_one({'username': username})
 
-    if user and bcrypt.checkpw(password.encode('utf-8'), user['password']):
-        access_token = create_access_token(identity=username)
-        return jsonify(access_token=access_token, role=user.get('role'))
-    
+    if user:
+        with span('auth.check_password'):
+            valid = passwords.check(password, user['password'])
+        if valid:
+            if passwords.needs_rehash(user['password']):
+                rehash_password(user, password)
+            access_token = create_access_token(identity=username, additional_claims={'role': user.get('role')})
+            return jsonify(access_token=access_token, role=user.get('role'))
+
+    if LOGIN_MAX_FAILURES_PER_USER:
+        count_login_attempt('user', username)
     return jsonify({"error": "Invalid credentials"}), 401
 
 # User Management (Admin only)
@@ -94,7 +327,7 @@ def add_user():
     if mongo.db.users.find_one({'username': username}):
         return jsonify({"error": "Username already exists"}), 409
 
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    hashed_password = passwords.hash(password)
     mongo.db.users.insert_one({
         "username": username,
         "password": hashed_password,
@@ -105,8 +338,8 @@ def add_user():
 @app.route('/api/users', methods=['GET'])
 @role_required('admin')
 def get_users():
-    users = mongo.db.users.find({'role': 'assistant'})
-    return json_util.dumps(users)
+    users = mongo.db.users.find({'role': 'assistant'}, {'password': 0})
+    return json_response(users)
 
 @app.route('/api/users/<id>', methods=['PUT'])
 @role_required('admin')
@@ -127,21 +360,58 @@ def update_user(id):
         update_fields['username'] = new_username
 
     if new_password:
-        hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
-        update_fields['password'] = hashed_password
+        update_fields['password'] = passwords.hash(new_password)
     
-    mongo.db.users.update_one(
+    user = mongo.db.users.find_one_and_update(
         {'_id': ObjectId(id)},
-        {'$set': update_fields}
+        {'$set': update_fields},
+        projection={'username': 1}
     )
+    if user:
+        user_role_cache.invalidate(user['username'], new_username)
     return jsonify({"message": "User updated successfully"})
 
 @app.route('/api/users/<id>', methods=['DELETE'])
 @role_required('admin')
 def delete_user(id):
-    mongo.db.users.delete_one({'_id': ObjectId(id)})
+    user = mongo.db.users.find_one_and_delete({'_id': ObjectId(id)}, projection={'username': 1})
+    if user:
+        user_role_cache.invalidate(user['username'])
     return jsonify({"message": "User deleted successfully"})
 
+# Query plans of the hot queries; any COLLSCAN means an index is missing
+@app.route('/api/admin/query-plans', methods=['GET'])
+@role_required('admin')
+def get_query_plans():
+    report = explain_hot_queries(mongo.db)
+    return jsonify({
+        "queries": report,
+        "collscans": [q['query'] for q in report if q['collscan']]
+    })
+
+# Prometheus scrape endpoint, protected by a bearer token when METRICS_TOKEN is set
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Invalid metrics token"}), 401
+    role_stats = user_role_cache.stats()
+    fit_stats = fit_centre_model.cache_info()
+    reference_stats = reference_cache.stats()
+    for cache, hits, misses, size in (
+        ('user_role', role_stats['hits'], role_stats['misses'], role_stats['size']),
+        ('forecast_fit', fit_stats.hits, fit_stats.misses, fit_stats.currsize),
+        ('references', reference_stats['hits'], reference_stats['misses'], reference_stats['documents']),
+    ):
+        metrics.set_gauge('pme_cache_hits', hits, cache=cache)
+        metrics.set_gauge('pme_cache_misses', misses, cache=cache)
+        metrics.set_gauge('pme_cache_size', size, cache=cache)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/metrics', methods=['GET'])
+@role_required('admin')
+def get_admin_metrics():
+    return jsonify({"user_role_cache": user_role_cache.stats(), "reference_cache": reference_cache.stats()})
+
 @app.route('/api/profile', methods=['PUT'])
 @jwt_required()
 def update_profile():
@@ -152,7 +422,7 @@ def update_profile():
     if not new_password:
         return jsonify({"error": "New password is required"}), 400
 
-    hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+    hashed_password = passwords.hash(new_password)
 
     result = mongo.db.users.update_one(
         {'username': current_user_username},
@@ -164,12 +434,129 @@ def update_profile():
 
     return jsonify({"message": "Profile updated successfully"})
 
+# Streaming list responses (?format=ndjson|csv or the matching Accept header) for clients
+# pulling whole collections: the cursor is read and serialized STREAM_BATCH_SIZE
+# documents at a time, so memory does not grow with the collection
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 1000))
+NDJSON_MIMETYPE = 'application/x-ndjson'
+LIST_FORMATS = {'json': 'application/json', 'ndjson': NDJSON_MIMETYPE, 'csv': 'text/csv'}
+
+def list_format():
+    if request.args.get('format'):
+        return request.args['format']
+    best = request.accept_mimetypes.best_match(list(LIST_FORMATS.values()))
+    return next((fmt for fmt, mimetype in LIST_FORMATS.items() if mimetype == best), 'json')
+
+def csv_value(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+# Value of a column of a CSV stream, 'a.b' reads field b of the embedded document a
+def document_field(doc, column):
+    for key in column.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+# cursor is a MongoDB cursor, read STREAM_BATCH_SIZE documents at a time, or a list of
+# cached documents
+def stream_documents(cursor, fmt, columns, transform=None):
+    if not isinstance(cursor, list):
+        cursor = cursor.batch_size(STREAM_BATCH_SIZE)
+    version = api_version()
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(columns)
+        try:
+            for i, doc in enumerate(cursor, start=1):
+                if transform:
+                    doc = transform(doc)
+                if writer:
+                    writer.writerow([csv_value(document_field(doc, c)) for c in columns])
+                else:
+                    buffer.write(dumps(doc, version).decode('utf-8'))
+                    buffer.write('\n')
+                if i % STREAM_BATCH_SIZE == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        finally:
+            if not isinstance(cursor, list):
+                cursor.close()
+
+    return Response(stream_with_context(generate()), mimetype=LIST_FORMATS[fmt])
+
+def invalid_list_format():
+    return jsonify({"error": f"'format' must be one of {', '.join(LIST_FORMATS)}"}), 400
+
+# Process-local cache of the reference collections (centres, responsables, budgets),
+# read whole on almost every page. Entries are tagged with the data_versions of their
+# collections: bump_data_version drops the version locally, other workers see a write
+# within REFERENCE_CACHE_CHECK_INTERVAL seconds, or at once with REFERENCE_CHANGE_STREAM=1
+# (needs a replica set), which pushes the data_versions changes to every worker.
+REFERENCE_COLLECTIONS = ('centres', 'responsables', 'budgets')
+REFERENCE_CACHE_CHECK_INTERVAL = float(os.getenv("REFERENCE_CACHE_CHECK_INTERVAL", 1))
+REFERENCE_CACHE_MAX_DOCUMENTS = int(os.getenv("REFERENCE_CACHE_MAX_DOCUMENTS", 50_000))
+REFERENCE_CHANGE_STREAM = os.getenv("REFERENCE_CHANGE_STREAM") == '1'
+REFERENCE_WATCH_RETRY = 5
+
+reference_cache = ReferenceCache(data_versions, REFERENCE_CACHE_CHECK_INTERVAL, REFERENCE_CACHE_MAX_DOCUMENTS)
+reference_watcher = None
+reference_watcher_lock = threading.Lock()
+
+def watch_data_versions():
+    while True:
+        try:
+            with mongo.db.data_versions.watch(full_document='updateLookup') as stream:
+                # Versions written before the stream opened are read once
+                data_versions(*REFERENCE_COLLECTIONS)
+                reference_cache.pushed = True
+                for change in stream:
+                    name = change['documentKey']['_id']
+                    version = (change.get('fullDocument') or {}).get('version')
+                    if version is None:
+                        reference_cache.invalidate(name)
+                    else:
+                        reference_cache.set_version(name, version)
+        except PyMongoError as e:
+            app.logger.warning("data_versions change stream stopped, polling versions: %s", e)
+        reference_cache.pushed = False
+        time.sleep(REFERENCE_WATCH_RETRY)
+
+# Started by the first read in each worker, after gunicorn forked it
+def start_reference_watcher():
+    global reference_watcher
+    with reference_watcher_lock:
+        if reference_watcher is None:
+            reference_watcher = threading.Thread(target=watch_data_versions, name='data-versions-watch', daemon=True)
+            reference_watcher.start()
+
+# The documents of a reference collection. They are shared: copy before modifying them.
+def cached_collection(name):
+    if REFERENCE_CHANGE_STREAM and reference_watcher is None:
+        start_reference_watcher()
+    return reference_cache.get(name, lambda: list(mongo.db[name].find()))
+
 # Responsable Management
 @app.route('/api/responsables', methods=['GET'])
 @jwt_required()
+@versioned('responsables')
 def get_responsables():
-    responsables = mongo.db.responsables.find()
-    return json_util.dumps(responsables)
+    fmt = list_format()
+    if fmt not in LIST_FORMATS:
+        return invalid_list_format()
+    responsables = cached_collection('responsables')
+    if fmt != 'json':
+        return stream_documents(responsables, fmt, ['_id', 'nom', 'prenom'])
+    return json_response(responsables)
 
 @app.route('/api/responsables', methods=['POST'])
 @role_required('admin')
@@ -185,6 +572,7 @@ def add_responsable():
         "nom": nom,
         "prenom": prenom
     })
+    bump_data_version('responsables')
     return jsonify({"message": "Responsable added successfully"}), 201
 
 @app.route('/api/responsables/<id>', methods=['PUT'])
@@ -204,21 +592,29 @@ def update_responsable(id):
             "prenom": prenom
         }}
     )
+    bump_data_version('responsables')
     return jsonify({"message": "Responsable updated successfully"})
 
 @app.route('/api/responsables/<id>', methods=['DELETE'])
 @role_required('admin')
 def delete_responsable(id):
     mongo.db.responsables.delete_one({'_id': ObjectId(id)})
+    bump_data_version('responsables')
     return jsonify({"message": "Responsable deleted successfully"})
 
 
 # Protected routes
 @app.route('/centres', methods=['GET'])
 @jwt_required()
+@versioned('centres')
 def get_centres():
-    centres = mongo.db.centres.find()
-    return json_util.dumps(centres)
+    fmt = list_format()
+    if fmt not in LIST_FORMATS:
+        return invalid_list_format()
+    centres = cached_collection('centres')
+    if fmt != 'json':
+        return stream_documents(centres, fmt, ['_id', 'nom', 'responsable'])
+    return json_response(centres)
 
 @app.route('/centres', methods=['POST'])
 @role_required('admin')
@@ -234,6 +630,7 @@ def add_centre():
         "nom": nom,
         "responsable": responsable
     })
+    bump_data_version('centres')
     return jsonify({"message": "Centre added successfully"}), 201
 
 @app.route('/centres/<id>', methods=['PUT'])
@@ -253,25 +650,360 @@ def update_centre(id):
             "responsable": responsable
         }}
     )
+    bump_data_version('centres')
     return jsonify({"message": "Centre updated successfully"})
 
 @app.route('/centres/<id>', methods=['DELETE'])
 @role_required('admin')
 def delete_centre(id):
     mongo.db.centres.delete_one({'_id': ObjectId(id)})
+    bump_data_version('centres')
     return jsonify({"message": "Centre deleted successfully"})
 
 @app.route('/centres/<id>', methods=['GET'])
 @jwt_required()
+@versioned('centres')
 def get_centre(id):
-    centre = mongo.db.centres.find_one({'_id': ObjectId(id)})
-    return json_util.dumps(centre)
+    centres, _ = references()
+    return json_response(centres.get(ObjectId(id)))
+
+# Reference data for the ?expand= option of the listings and for the reports. Centres and
+# responsables are small collections: they are loaded whole and cached until one of
+# them is written, see reference_cache.
+EXPANDABLE = ('centre', 'responsable')
+
+def responsable_name(responsable):
+    return f"{responsable.get('prenom', '')} {responsable.get('nom', '')}".strip()
+
+def load_references():
+    centres = {c['_id']: c for c in cached_collection('centres')}
+    responsables = cached_collection('responsables')
+    by_id = {str(r['_id']): r for r in responsables}
+    by_name = {responsable_name(r): r for r in responsables}
+
+    # Centres keep their responsable as free text ("Prénom Nom" from the Centres page),
+    # older ones may hold the id of the responsable
+    centre_responsables = {}
+    for centre_id, centre in centres.items():
+        value = str(centre.get('responsable') or '').strip()
+        centre_responsables[centre_id] = by_id.get(value) or by_name.get(value)
+    return centres, centre_responsables
+
+def references():
+    return reference_cache.get('references', load_references, depends_on=('centres', 'responsables'), size=lambda refs: len(refs[0]))
+
+def centre_name_map():
+    centres, _ = references()
+    return {str(centre_id): c.get('nom') for centre_id, c in centres.items()}
+
+def parse_expand(args):
+    requested = {v.strip() for v in args.get('expand', '').split(',') if v.strip()}
+    unknown = requested - set(EXPANDABLE)
+    if unknown:
+        raise ValueError(f"Unknown expand: {', '.join(sorted(unknown))}")
+    return requested
+
+# Returns a function adding the requested 'centre' and 'responsable' (of the centre)
+# documents to a document with a centre_id, or None when nothing is expanded
+def reference_expander(expand):
+    if not expand:
+        return None
+    centres, centre_responsables = references()
+
+    def expand_references(doc):
+        if 'centre' in expand:
+            doc['centre'] = centres.get(doc.get('centre_id'))
+        if 'responsable' in expand:
+            doc['responsable'] = centre_responsables.get(doc.get('centre_id'))
+        return doc
+    return expand_references
+
+# CSV columns of the expanded documents
+EXPANDED_COLUMNS = {
+    'centre': ['centre.nom', 'centre.responsable'],
+    'responsable': ['responsable.nom', 'responsable.prenom'],
+}
+
+def expanded_columns(expand):
+    return [c for name in EXPANDABLE if name in expand for c in EXPANDED_COLUMNS[name]]
+
+# Depense listing: filters, projection and keyset pagination
+DEPENSE_FIELDS = ['date', 'montant', 'description', 'centre_id', 'created_by', 'version']
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Dates are stored as BSON datetimes (midnight UTC) together with their 'annee' and
+# 'trimester', so period filters and groupings are plain indexed fields
+def parse_depense_date(value):
+    if isinstance(value, datetime):
+        date = value
+    else:
+        try:
+            date = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError(f"Invalid date '{value}', expected YYYY-MM-DD")
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return datetime(date.year, date.month, date.day)
+
+def depense_period(date):
+    date = parse_depense_date(date)
+    return date.year, (date.month - 1) // 3 + 1
+
+def depense_date_fields(date):
+    date = parse_depense_date(date)
+    annee, trimester = depense_period(date)
+    return {"date": date, "annee": annee, "trimester": trimester}
+
+# Dates go back to clients as 'YYYY-MM-DD', the format they send
+def format_depense(depense):
+    if depense and isinstance(depense.get('date'), datetime):
+        depense['date'] = depense['date'].strftime('%Y-%m-%d')
+    return depense
+
+# Translate the listing query string into a Mongo filter (raises ValueError on bad input)
+# centre_id, annee and trimester filters, shared by the depense, variance and status lists
+def build_period_query(args):
+    query = {}
+
+    centre_id = args.get('centre_id')
+    if centre_id:
+        if not ObjectId.is_valid(centre_id):
+            raise ValueError("Invalid 'centre_id'")
+        query['centre_id'] = ObjectId(centre_id)
+
+    annee = args.get('annee')
+    trimester = args.get('trimester')
+    try:
+        annee = int(annee) if annee else None
+        trimester = int(trimester) if trimester else None
+    except ValueError:
+        raise ValueError("Invalid trimester or annee format")
+    if trimester and trimester not in (1, 2, 3, 4):
+        raise ValueError("'trimester' must be between 1 and 4")
+    if annee:
+        query['annee'] = annee
+    if trimester:
+        query['trimester'] = trimester
+    return query
+
+def build_depense_query(args):
+    query = build_period_query(args)
+    date_range = {}
+
+    created_by = args.get('created_by')
+    if created_by:
+        query['created_by'] = created_by
+
+    date_from = args.get('date_from')
+    if date_from:
+        date_range['$gte'] = parse_depense_date(date_from)
+    date_to = args.get('date_to')
+    if date_to:
+        date_range['$lte'] = parse_depense_date(date_to)
+
+    if date_range:
+        query['date'] = date_range
+    return query
+
+def build_depense_projection(args):
+    fields = args.get('fields')
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in requested if f not in DEPENSE_FIELDS and f != '_id']
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    # The sort key is always returned so the next cursor can be built
+    return {f: 1 for f in requested + ['date']}
+
+def encode_cursor(doc):
+    payload = json_util.dumps([doc.get('date'), doc['_id']])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        date, last_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid 'cursor'")
+    return date, last_id
+
+# Quarterly rollups: depense_rollups holds one document per (centre_id, annee, trimester)
+# with the running 'total' and 'count', kept in sync by the depense write routes
+def apply_rollup_delta(centre_id, date, montant, count):
+    annee, trimester = depense_period(date)
+    bucket = {'centre_id': centre_id, 'annee': annee, 'trimester': trimester}
+    mongo.db.depense_rollups.update_one(bucket, {'$inc': {'total': montant, 'count': count}}, upsert=True)
+    bump_data_version(f"depenses:{centre_id}")
+    if count < 0:
+        # Drop buckets emptied by deletes or moves so they don't count as history
+        mongo.db.depense_rollups.delete_one({**bucket, 'count': {'$lte': 0}})
+    evaluate_budget_status([(centre_id, annee, trimester)])
+
+# Batched form of apply_rollup_delta, {(centre_id, annee, trimester): [total, count]}
+def apply_rollup_deltas(deltas):
+    if not deltas:
+        return
+    mongo.db.depense_rollups.bulk_write([
+        UpdateOne(
+            {'centre_id': centre_id, 'annee': annee, 'trimester': trimester},
+            {'$inc': {'total': total, 'count': count}},
+            upsert=True
+        )
+        for (centre_id, annee, trimester), (total, count) in deltas.items()
+    ], ordered=False)
+    centre_ids = list({centre_id for centre_id, _, _ in deltas})
+    mongo.db.depense_rollups.delete_many({'centre_id': {'$in': centre_ids}, 'count': {'$lte': 0}})
+    for centre_id in centre_ids:
+        bump_data_version(f"depenses:{centre_id}")
+    evaluate_budget_status(deltas)
+
+ROLLUP_PIPELINE = [
+    # Depenses whose date could not be migrated have no period and no rollup
+    {'$match': {'annee': {'$exists': True}}},
+    {'$group': {
+        '_id': {'centre_id': '$centre_id', 'annee': '$annee', 'trimester': '$trimester'},
+        'total': {'$sum': '$montant'},
+        'count': {'$sum': 1}
+    }},
+    {'$project': {
+        '_id': 0,
+        'centre_id': '$_id.centre_id',
+        'annee': '$_id.annee',
+        'trimester': '$_id.trimester',
+        'total': 1,
+        'count': 1
+    }}
+]
+
+# Returns the buckets whose stored rollup differs from the raw depenses
+def check_rollups():
+    def key(r):
+        return (r['centre_id'], r['annee'], r['trimester'])
+    expected = {key(r): r for r in mongo.db.depenses.aggregate(ROLLUP_PIPELINE, allowDiskUse=True)}
+    stored = {key(r): r for r in mongo.db.depense_rollups.find({}, {'_id': 0})}
+    mismatches = []
+    for k in expected.keys() | stored.keys():
+        e, st = expected.get(k), stored.get(k)
+        if not e or not st or e['count'] != st['count'] or abs(e['total'] - st['total']) > 1e-6:
+            mismatches.append({'bucket': k, 'expected': e, 'stored': st})
+    return mismatches
+
+# $out swaps the collection in one step and keeps its indexes; depense writes made while
+# the pipeline runs may be missed, so run it during quiet periods
+def rebuild_rollups():
+    mongo.db.depenses.aggregate(ROLLUP_PIPELINE + [{'$out': 'depense_rollups'}], allowDiskUse=True)
+    bump_data_version('depenses')
+    bump_data_version('rollups')
+    return mongo.db.depense_rollups.count_documents({})
+
+@app.cli.command('rebuild-rollups')
+@click.option('--check', is_flag=True, help='Only report buckets that differ from the raw depenses.')
+def rebuild_rollups_command(check):
+    if check:
+        mismatches = check_rollups()
+        for m in mismatches:
+            click.echo(f"Mismatch {m['bucket']}: expected {m['expected']}, stored {m['stored']}")
+        click.echo(f"{len(mismatches)} inconsistent bucket(s).")
+        return
+    click.echo(f"Rebuilt {rebuild_rollups()} rollup bucket(s).")
+    click.echo(f"Evaluated {rebuild_budget_status()} budgeted period(s).")
+
+# Convert the string dates left by older versions into typed date fields. Documents are
+# processed in _id order and small batches so the collection stays available; converted
+# documents no longer match the filter, so an interrupted run can simply be started again.
+def migrate_depense_dates(batch_size, pause=0, echo=print):
+    pending = {'$or': [{'date': {'$type': 'string'}}, {'annee': {'$exists': False}}]}
+    last_id = None
+    converted = 0
+    failed = []
+    while True:
+        query = pending if last_id is None else {'$and': [pending, {'_id': {'$gt': last_id}}]}
+        batch = list(mongo.db.depenses.find(query, {'date': 1}).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+
+        operations = []
+        for depense in batch:
+            try:
+                # Matching on the old date skips documents edited since they were read
+                operations.append(UpdateOne(
+                    {'_id': depense['_id'], 'date': depense['date']},
+                    {'$set': depense_date_fields(depense['date'])}
+                ))
+            except (ValueError, TypeError):
+                failed.append(depense['_id'])
+        if operations:
+            converted += mongo.db.depenses.bulk_write(operations, ordered=False).modified_count
+        last_id = batch[-1]['_id']
+        echo(f"{converted} converted, {len(failed)} unparseable so far")
+        if pause:
+            time.sleep(pause)
+
+    if converted:
+        bump_data_version('depenses')
+    return converted, failed
+
+@app.cli.command('migrate-depense-dates')
+@click.option('--batch-size', default=1000, show_default=True, help='Documents converted per bulk write.')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to wait between batches.')
+def migrate_depense_dates_command(batch_size, pause):
+    converted, failed = migrate_depense_dates(batch_size, pause, echo=click.echo)
+    for depense_id in failed:
+        click.echo(f"Could not parse the date of depense {depense_id}")
+    click.echo(f"Converted {converted} depense(s), {len(failed)} left unchanged.")
 
 @app.route('/depenses', methods=['GET'])
 @jwt_required()
+@versioned('depenses', 'centres', 'responsables')
 def get_depenses():
-    depenses = mongo.db.depenses.find()
-    return json_util.dumps(depenses)
+    fmt = list_format()
+    if fmt not in LIST_FORMATS:
+        return invalid_list_format()
+    try:
+        query = build_depense_query(request.args)
+        projection = build_depense_projection(request.args)
+        expand = parse_expand(request.args)
+        if projection and expand:
+            projection['centre_id'] = 1
+        limit = request.args.get('limit')
+        cursor = request.args.get('cursor')
+        try:
+            limit = min(int(limit), MAX_PAGE_SIZE) if limit else DEFAULT_PAGE_SIZE
+        except ValueError:
+            raise ValueError("Invalid 'limit'")
+        if limit < 1:
+            raise ValueError("'limit' must be positive")
+        if cursor:
+            last_date, last_id = decode_cursor(cursor)
+            query = {'$and': [query, {'$or': [
+                {'date': {'$lt': last_date}},
+                {'date': last_date, '_id': {'$lt': last_id}}
+            ]}]}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    expand_references = reference_expander(expand)
+
+    def present(depense):
+        depense = format_depense(depense)
+        return expand_references(depense) if expand_references else depense
+
+    depenses = mongo.db.depenses.find(query, projection).sort([('date', -1), ('_id', -1)])
+
+    # Streams return every matching depense (after 'cursor' if given), 'limit' only applies to pages
+    if fmt != 'json':
+        columns = ['_id'] + [f for f in DEPENSE_FIELDS if not projection or f in projection]
+        return stream_documents(depenses, fmt, columns + expanded_columns(expand), present)
+
+    # Without 'limit' or 'cursor' the legacy shape (a plain array) is kept for existing clients
+    if not request.args.get('limit') and not cursor:
+        return json_response([present(d) for d in depenses])
+
+    # Fetch one extra document to know whether another page exists
+    items = list(depenses.limit(limit + 1))
+    next_cursor = encode_cursor(items[limit - 1]) if len(items) > limit else None
+    return json_response({"items": [present(d) for d in items[:limit]], "next_cursor": next_cursor})
 
 @app.route('/depenses', methods=['POST'])
 @jwt_required()
@@ -285,30 +1017,72 @@ def add_depense():
 
     if not date or not montant or not description or not centre_id:
         return jsonify({"error": "Missing required fields"}), 400
+    try:
+        date_fields = depense_date_fields(date)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     mongo.db.depenses.insert_one({
-        "date": date,
+        **date_fields,
         "montant": montant,
         "description": description,
         "centre_id": ObjectId(centre_id),
-        "created_by": created_by
+        "created_by": created_by,
+        "version": 1
     })
+    apply_rollup_delta(ObjectId(centre_id), date, montant, 1)
+    bump_data_version('depenses')
     return jsonify({"message": "Depense added successfully"}), 201
 
-@app.route('/depenses/<id>', methods=['PUT'])
-@jwt_required()
-def update_depense(id):
-    depense = mongo.db.depenses.find_one({'_id': ObjectId(id)})
+# Optimistic locking of depenses: every write increments their version, which is the
+# ETag of GET /depenses/<id> and of the PUT response. A PUT or DELETE sent with
+# If-Match only applies to that version, so a concurrent edit gets a 412 instead of
+# being overwritten. Depenses written before versions existed are version 0.
+def depense_etag(depense):
+    return str(depense.get('version') or 0)
+
+# Versions named by the ETags of an If-Match or If-None-Match header. Flask-Compress
+# appends the content coding to the ETag of compressed responses ("3:gzip"), which
+# clients send back as is.
+def etag_versions(etags, include_weak=False):
+    versions = set()
+    for etag in etags.as_set(include_weak=include_weak):
+        version = etag.split(':', 1)[0]
+        if version.isdigit():
+            versions.add(int(version))
+    return versions
+
+def depense_version_filter():
+    if not request.if_match or request.if_match.star_tag:
+        return {}
+    # Weak ETags never match If-Match
+    versions = list(etag_versions(request.if_match))
+    if 0 in versions:
+        versions.append(None)
+    return {'version': {'$in': versions}}
+
+# Non-admins may only write the depenses they created
+def depense_owner_filter(admin):
+    return {} if admin else {'created_by': get_jwt_identity()}
+
+# The write filter matched nothing: tell a missing depense, a permission error and a
+# stale If-Match apart. Only failed writes pay for this read.
+def depense_write_error(id, admin, action):
+    depense = mongo.db.depenses.find_one({'_id': ObjectId(id)}, {'created_by': 1, 'version': 1})
     if not depense:
         return jsonify({"error": "Depense not found"}), 404
+    if not admin and depense.get('created_by') != get_jwt_identity():
+        return jsonify({"error": f"Permission denied: You can only {action} your own expenses."}), 403
+    response = jsonify({"error": "Depense was modified by another request, reload it and try again"})
+    response.status_code = 412
+    response.set_etag(depense_etag(depense))
+    return response
 
-    current_user_username = get_jwt_identity()
-    current_user = mongo.db.users.find_one({'username': current_user_username})
-
-    # Permission check
-    if current_user['role'] != 'admin' and depense.get('created_by') != current_user_username:
-        return jsonify({"error": "Permission denied: You can only edit your own expenses."}), 403
+DEPENSE_ROLLUP_FIELDS = {'centre_id': 1, 'date': 1, 'montant': 1, 'version': 1}
 
+@app.route('/depenses/<id>', methods=['PUT'])
+@jwt_required()
+def update_depense(id):
     data = request.get_json()
     date = data.get('date')
     montant = float(data.get('montant'))
@@ -317,48 +1091,99 @@ def update_depense(id):
 
     if not date or not montant or not description or not centre_id:
         return jsonify({"error": "Missing required fields"}), 400
-
-    mongo.db.depenses.update_one(
-        {'_id': ObjectId(id)},
+    try:
+        date_fields = depense_date_fields(date)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Permission and version checks are part of the filter, so the write is a single
+    # atomic operation
+    admin = has_role('admin')
+    depense = mongo.db.depenses.find_one_and_update(
+        {'_id': ObjectId(id), **depense_owner_filter(admin), **depense_version_filter()},
         {'$set': {
-            "date": date,
+            **date_fields,
             "montant": montant,
             "description": description,
             "centre_id": ObjectId(centre_id)
-        }}
+        }, '$inc': {'version': 1}},
+        projection=DEPENSE_ROLLUP_FIELDS,
+        return_document=ReturnDocument.BEFORE
     )
-    return jsonify({"message": "Depense updated successfully"})
+    if not depense:
+        return depense_write_error(id, admin, 'edit')
+
+    # Move the amount between buckets when the date or centre changed
+    if depense_period(depense['date']) == depense_period(date) and depense['centre_id'] == ObjectId(centre_id):
+        apply_rollup_delta(ObjectId(centre_id), date, montant - depense['montant'], 0)
+    else:
+        apply_rollup_delta(depense['centre_id'], depense['date'], -depense['montant'], -1)
+        apply_rollup_delta(ObjectId(centre_id), date, montant, 1)
+    bump_data_version('depenses')
+    bump_data_version('depenses:rewrites')
+    response = jsonify({"message": "Depense updated successfully"})
+    response.set_etag(depense_etag({'version': (depense.get('version') or 0) + 1}))
+    return response
 
 @app.route('/depenses/<id>', methods=['DELETE'])
 @jwt_required()
 def delete_depense(id):
-    depense = mongo.db.depenses.find_one({'_id': ObjectId(id)})
+    admin = has_role('admin')
+    depense = mongo.db.depenses.find_one_and_delete(
+        {'_id': ObjectId(id), **depense_owner_filter(admin), **depense_version_filter()},
+        projection=DEPENSE_ROLLUP_FIELDS
+    )
     if not depense:
-        return jsonify({"error": "Depense not found"}), 404
-        
-    current_user_username = get_jwt_identity()
-    current_user = mongo.db.users.find_one({'username': current_user_username})
-
-    # Permission check
-    if current_user['role'] != 'admin' and depense.get('created_by') != current_user_username:
-        return jsonify({"error": "Permission denied: You can only delete your own expenses."}), 403
+        return depense_write_error(id, admin, 'delete')
 
-    mongo.db.depenses.delete_one({'_id': ObjectId(id)})
+    apply_rollup_delta(depense['centre_id'], depense['date'], -depense['montant'], -1)
+    bump_data_version('depenses')
+    bump_data_version('depenses:rewrites')
     return jsonify({"message": "Depense deleted successfully"})
 
+# Conditional GET on the version of the depense alone, so edits of other depenses
+# don't invalidate it
 @app.route('/depenses/<id>', methods=['GET'])
 @jwt_required()
 def get_depense(id):
     depense = mongo.db.depenses.find_one({'_id': ObjectId(id)})
-    return json_util.dumps(depense)
+    if not depense:
+        return json_response(None)
+
+    etag = depense_etag(depense)
+    if request.if_none_match.star_tag or int(etag) in etag_versions(request.if_none_match, include_weak=True):
+        response = Response(status=304)
+    else:
+        response = json_response(format_depense(depense))
+    response.set_etag(etag)
+    response.vary.add('X-API-Version')
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 
 # Budget Management
 @app.route('/api/budgets', methods=['GET'])
 @jwt_required()
+@versioned('budgets', 'centres', 'responsables')
 def get_budgets():
-    budgets = mongo.db.budgets.find()
-    return json_util.dumps(budgets)
+    fmt = list_format()
+    if fmt not in LIST_FORMATS:
+        return invalid_list_format()
+    try:
+        expand = parse_expand(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    expand_references = reference_expander(expand)
+
+    budgets = cached_collection('budgets')
+    # Expansion adds fields, to copies of the cached documents
+    if expand_references:
+        budgets = [expand_references(dict(b)) for b in budgets]
+    if fmt != 'json':
+        columns = ['_id', 'centre_id', 'annee', 'trimester', 'montant'] + expanded_columns(expand)
+        return stream_documents(budgets, fmt, columns)
+    return json_response(budgets)
 
 @app.route('/api/budgets', methods=['POST'])
 @role_required('admin')
@@ -378,6 +1203,8 @@ def add_budget():
         "annee": int(annee),
         "montant": float(montant)
     })
+    evaluate_budget_status([(ObjectId(centre_id), int(annee), int(trimester))])
+    bump_data_version('budgets')
     return jsonify({"message": "Budget added successfully"}), 201
 
 @app.route('/api/budgets/<id>', methods=['PUT'])
@@ -392,7 +1219,7 @@ def update_budget(id):
     if not centre_id or not trimester or not annee or not montant:
         return jsonify({"error": "Missing 'centre_id', 'trimester', 'annee', or 'montant'"}), 400
 
-    mongo.db.budgets.update_one(
+    previous = mongo.db.budgets.find_one_and_update(
         {'_id': ObjectId(id)},
         {'$set': {
             "centre_id": ObjectId(centre_id),
@@ -401,16 +1228,778 @@ def update_budget(id):
             "montant": float(montant)
         }}
     )
+    buckets = [(ObjectId(centre_id), int(annee), int(trimester))]
+    if previous:
+        buckets.append((previous['centre_id'], previous['annee'], previous['trimester']))
+    evaluate_budget_status(buckets)
+    bump_data_version('budgets')
+    bump_data_version('budgets:rewrites')
     return jsonify({"message": "Budget updated successfully"})
 
 @app.route('/api/budgets/<id>', methods=['DELETE'])
 @role_required('admin')
 def delete_budget(id):
-    mongo.db.budgets.delete_one({'_id': ObjectId(id)})
+    budget = mongo.db.budgets.find_one_and_delete({'_id': ObjectId(id)})
+    if budget:
+        evaluate_budget_status([(budget['centre_id'], budget['annee'], budget['trimester'])])
+        bump_data_version('budgets:rewrites')
+    bump_data_version('budgets')
     return jsonify({"message": "Budget deleted successfully"})
 
+# Budget vs actual per (centre_id, annee, trimester): the budgets of a period are summed
+# and joined in MongoDB with the depense_rollups bucket of the same period.
+VARIANCE_FIELDS = ['centre_id', 'centre', 'annee', 'trimester', 'budget', 'reel', 'ecart', 'taux_ecart', 'interpretation']
+
+# Écart and taux d'écart, shared with the variance sheets of the XLSX export, where a
+# budget of 0 has a taux of 0
+def variance_fields(budget, reel):
+    ecart = reel - budget
+    taux_ecart = ecart / budget * 100 if budget else 0.0
+    return {
+        'ecart': ecart,
+        'taux_ecart': taux_ecart,
+        'interpretation': 'surcoût' if taux_ecart > 0 else 'économie' if taux_ecart < 0 else 'neutre'
+    }
+
+def variance_pipeline(query, overrun_only=False):
+    pipeline = [
+        {'$match': query},
+        {'$group': {
+            '_id': {'centre_id': '$centre_id', 'annee': '$annee', 'trimester': '$trimester'},
+            'budget': {'$sum': '$montant'}
+        }},
+        # Equality matches of $expr on the three fields use the centre_period index of
+        # the rollups. let and pipeline only, localField with a pipeline needs MongoDB 5.0.
+        {'$lookup': {
+            'from': 'depense_rollups',
+            'let': {'centre_id': '$_id.centre_id', 'annee': '$_id.annee', 'trimester': '$_id.trimester'},
+            'pipeline': [
+                {'$match': {'$expr': {'$and': [
+                    {'$eq': ['$centre_id', '$$centre_id']},
+                    {'$eq': ['$annee', '$$annee']},
+                    {'$eq': ['$trimester', '$$trimester']}
+                ]}}},
+                {'$project': {'_id': 0, 'total': 1}}
+            ],
+            'as': 'reel'
+        }},
+        {'$project': {
+            '_id': 0,
+            'centre_id': '$_id.centre_id',
+            'annee': '$_id.annee',
+            'trimester': '$_id.trimester',
+            'budget': 1,
+            'reel': {'$sum': '$reel.total'}
+        }}
+    ]
+    if overrun_only:
+        pipeline.append({'$match': {'$expr': {'$gt': ['$reel', '$budget']}}})
+    pipeline.append({'$sort': {'annee': -1, 'trimester': -1, 'centre_id': 1}})
+    return pipeline
+
+def variance_row(doc, centre_names):
+    # $sum gives an integer 0 to periods without depenses
+    budget, reel = float(doc['budget']), float(doc['reel'])
+    return {
+        'centre_id': doc['centre_id'],
+        'centre': centre_names.get(str(doc['centre_id']), 'N/A'),
+        'annee': doc['annee'],
+        'trimester': doc['trimester'],
+        'budget': budget,
+        'reel': reel,
+        **variance_fields(budget, reel)
+    }
+
+@app.route('/api/variance', methods=['GET'])
+@jwt_required()
+@versioned('budgets', 'depenses', 'rollups', 'centres')
+def get_variance():
+    fmt = list_format()
+    if fmt not in LIST_FORMATS:
+        return invalid_list_format()
+    try:
+        query = build_period_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    overrun_only = request.args.get('overrun') in ('1', 'true')
+
+    centre_names = centre_name_map()
+    rows = mongo.db.budgets.aggregate(variance_pipeline(query, overrun_only), allowDiskUse=True)
+    if fmt != 'json':
+        return stream_documents(rows, fmt, VARIANCE_FIELDS, lambda doc: variance_row(doc, centre_names))
+    return json_response([variance_row(doc, centre_names) for doc in rows])
+
+# Overrun alerts. Every write that changes the actual or the budget of a period
+# re-evaluates that period only: its consumption (reel / budget, in %) is compared with
+# ALERT_THRESHOLDS and the result kept in budget_status, one document per budgeted
+# period. Reaching a higher threshold than at the last evaluation records an event in
+# budget_alerts.
+ALERT_THRESHOLDS = sorted(float(t) for t in os.getenv("ALERT_THRESHOLDS", "90,100").split(',') if t.strip())
+MAX_ALERTS = 1000
+
+def budget_consumption(budget, reel):
+    if budget:
+        return reel / budget * 100
+    # Any spending on a budget of 0 is an overrun
+    return math.inf if reel > 0 else 0.0
+
+def budget_status_fields(budget, reel):
+    consumption = budget_consumption(budget, reel)
+    level = bisect.bisect_right(ALERT_THRESHOLDS, consumption)
+    return {
+        'budget': budget,
+        'reel': reel,
+        **variance_fields(budget, reel),
+        'consumption': None if math.isinf(consumption) else consumption,
+        'level': level,
+        'threshold': ALERT_THRESHOLDS[level - 1] if level else None
+    }
+
+def bucket_filter(buckets):
+    return {
+        'centre_id': {'$in': list({centre_id for centre_id, _, _ in buckets})},
+        'annee': {'$in': list({annee for _, annee, _ in buckets})},
+        'trimester': {'$in': list({trimester for _, _, trimester in buckets})}
+    }
+
+# Sum of field per bucket for the given buckets, with one indexed query
+def bucket_sums(collection, field, buckets):
+    sums = {}
+    for doc in collection.find(bucket_filter(buckets), {'_id': 0, 'centre_id': 1, 'annee': 1, 'trimester': 1, field: 1}):
+        key = (doc['centre_id'], doc['annee'], doc['trimester'])
+        if key in buckets:
+            sums[key] = sums.get(key, 0.0) + doc.get(field, 0.0)
+    return sums
+
+BUDGET_STATUS_RETRIES = 5
+
+# Write the status of one bucket from the figures read by the caller. The write is
+# conditional on the level read with them, so that concurrent writes to the same period
+# record a crossing once; when another writer changed the status in between, the figures
+# are read again and the write retried. Returns the alert to record, if any.
+def write_budget_status(bucket, budget, reel, previous, now):
+    centre_id, annee, trimester = bucket
+    key = {'centre_id': centre_id, 'annee': annee, 'trimester': trimester}
+    for attempt in range(BUDGET_STATUS_RETRIES):
+        if attempt:
+            budget = bucket_sums(mongo.db.budgets, 'montant', {bucket}).get(bucket)
+            reel = bucket_sums(mongo.db.depense_rollups, 'total', {bucket}).get(bucket, 0.0)
+            previous = mongo.db.budget_status.find_one(key, {'level': 1})
+        if budget is None:
+            if previous:
+                mongo.db.budget_status.delete_one({'_id': previous['_id']})
+            return None
+
+        fields = {**budget_status_fields(budget, reel), 'updated_at': now}
+        if previous:
+            previous_level = previous['level']
+            written = mongo.db.budget_status.update_one(
+                {'_id': previous['_id'], 'level': previous_level}, {'$set': fields}
+            ).matched_count
+        else:
+            previous_level = 0
+            try:
+                written = mongo.db.budget_status.update_one(key, {'$setOnInsert': fields}, upsert=True).upserted_id
+            except DuplicateKeyError:
+                written = None
+        if written:
+            if fields['level'] <= previous_level:
+                return None
+            return {
+                **key,
+                'threshold': fields['threshold'],
+                'budget': fields['budget'],
+                'reel': fields['reel'],
+                'consumption': fields['consumption'],
+                'created_at': now
+            }
+    app.logger.warning("Budget status of %s not written after %d attempts", bucket, BUDGET_STATUS_RETRIES)
+    return None
+
+# Re-evaluate the status of the given (centre_id, annee, trimester) buckets
+def evaluate_budget_status(buckets):
+    buckets = set(buckets)
+    if not buckets:
+        return
+    budgets = bucket_sums(mongo.db.budgets, 'montant', buckets)
+    reels = bucket_sums(mongo.db.depense_rollups, 'total', buckets)
+    statuses = {
+        (s['centre_id'], s['annee'], s['trimester']): s
+        for s in mongo.db.budget_status.find(bucket_filter(buckets), {'centre_id': 1, 'annee': 1, 'trimester': 1, 'level': 1})
+    }
+
+    now = datetime.now(timezone.utc)
+    alerts = []
+    for bucket in buckets:
+        alert = write_budget_status(bucket, budgets.get(bucket), reels.get(bucket, 0.0), statuses.get(bucket), now)
+        if alert:
+            alerts.append(alert)
+    if alerts:
+        mongo.db.budget_alerts.insert_many(alerts)
+
+# Recompute every status from the variance pipeline, without recording alerts. For
+# databases that had budgets before the statuses existed, or after rebuild-rollups.
+def rebuild_budget_status():
+    now = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne(
+            {'centre_id': row['centre_id'], 'annee': row['annee'], 'trimester': row['trimester']},
+            {'$set': {**budget_status_fields(float(row['budget']), float(row['reel'])), 'updated_at': now}},
+            upsert=True
+        )
+        for row in mongo.db.budgets.aggregate(variance_pipeline({}), allowDiskUse=True)
+    ]
+    if operations:
+        mongo.db.budget_status.bulk_write(operations, ordered=False)
+    mongo.db.budget_status.delete_many({'updated_at': {'$lt': now}})
+    return len(operations)
+
+@app.cli.command('rebuild-budget-status')
+def rebuild_budget_status_command():
+    click.echo(f"Evaluated {rebuild_budget_status()} budgeted period(s).")
+
+def status_row(status, centre_names):
+    return {**status, 'centre': centre_names.get(str(status['centre_id']), 'N/A')}
+
+@app.route('/api/variance/status', methods=['GET'])
+@jwt_required()
+@versioned('budgets', 'depenses', 'rollups', 'centres')
+def get_budget_status():
+    try:
+        query = build_period_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.args.get('alerting') in ('1', 'true'):
+        query['level'] = {'$gt': 0}
+
+    centre_names = centre_name_map()
+    statuses = mongo.db.budget_status.find(query).sort([('annee', -1), ('trimester', -1), ('centre_id', 1)])
+    return json_response([status_row(s, centre_names) for s in statuses])
+
+@app.route('/api/variance/alerts', methods=['GET'])
+@jwt_required()
+@versioned('budgets', 'depenses', 'rollups', 'centres')
+def get_budget_alerts():
+    try:
+        query = build_period_query(request.args)
+        limit = request.args.get('limit')
+        try:
+            limit = min(int(limit), MAX_ALERTS) if limit else DEFAULT_PAGE_SIZE
+        except ValueError:
+            raise ValueError("Invalid 'limit'")
+        if limit < 1:
+            raise ValueError("'limit' must be positive")
+        if request.args.get('since'):
+            query['created_at'] = {'$gte': parse_depense_date(request.args['since'])}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    centre_names = centre_name_map()
+    alerts = mongo.db.budget_alerts.find(query).sort('created_at', -1).limit(limit)
+    return json_response([status_row(a, centre_names) for a in alerts])
+
+# Bulk imports of CSV, NDJSON or XLSX files, sent as the request body or as the 'file'
+# field of a multipart form. See imports.py for the parsing and validation.
+#
+# Like POST /depenses, any user can import depenses; with mode=upsert only admins can
+# update depenses created by someone else. Budgets are imported by admins only.
+#
+# pandas (through imports.py) and openpyxl (imports.py, reports.py) are imported by the routes
+# that use them rather than at startup, so workers boot without them.
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 5000))
+IMPORT_SPOOL_SIZE = 16 * 1024 * 1024
+MAX_IMPORT_ERRORS = 1000
+
+def parse_import_mode():
+    mode = request.args.get('mode', 'insert')
+    if mode not in ('insert', 'upsert'):
+        raise ValueError("'mode' must be 'insert' or 'upsert'")
+    return mode == 'upsert'
+
+def import_batches():
+    from imports import IMPORT_FORMATS, detect_format, read_batches
+
+    upload = request.files.get('file')
+    if upload:
+        stream, filename, mimetype = upload.stream, upload.filename, upload.mimetype
+    else:
+        stream, filename, mimetype = request.stream, None, request.mimetype
+    fmt = request.args.get('format') or detect_format(filename, mimetype)
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError("Unsupported file format, expected csv, ndjson or xlsx (set 'format' to force it)")
+    if fmt == 'xlsx':
+        # XLSX files are zip archives and need random access, CSV and NDJSON are read as they arrive
+        spooled = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE)
+        shutil.copyfileobj(stream, spooled)
+        spooled.seek(0)
+        stream = spooled
+    return read_batches(stream, fmt, IMPORT_BATCH_SIZE)
+
+def known_centre_ids():
+    return {str(c['_id']) for c in mongo.db.centres.find({}, {'_id': 1})}
+
+# Validated rows to Mongo documents, in the order of the rows
+def import_documents(rows):
+    import pandas as pd
+
+    documents = []
+    for record in rows.to_dict('records'):
+        document = {k: v for k, v in record.items() if not pd.isna(v)}
+        document['centre_id'] = ObjectId(document['centre_id'])
+        if 'date' in document:
+            document['date'] = document['date'].to_pydatetime()
+        documents.append(document)
+    return documents
+
+# Write a batch with one unordered bulk write. In upsert mode rows replace the record
+# with the same external_id (within owner_filter) or are inserted. Returns the bulk
+# result counts and the write errors by position in the batch.
+# inc: counters incremented by upserts, and their value for inserted documents
+def write_import_batch(collection, documents, upsert, owner_filter=None, on_insert=None, inc=None):
+    owner_filter = owner_filter or {}
+    on_insert = on_insert or {}
+    inc = inc or {}
+    if upsert:
+        update = {'$setOnInsert': on_insert} if on_insert else {}
+        if inc:
+            update['$inc'] = inc
+        operations = [
+            UpdateOne({'external_id': d['external_id'], **owner_filter}, {'$set': d, **update}, upsert=True)
+            for d in documents
+        ]
+    else:
+        operations = [InsertOne({**d, **on_insert, **inc}) for d in documents]
+    try:
+        result = collection.bulk_write(operations, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+    return result, {error['index']: error for error in result['writeErrors']}
+
+def import_error_message(error, upsert):
+    if error.get('code') == 11000:
+        if upsert:
+            return "'external_id' is already used by a record you cannot update"
+        return "'external_id' was already imported, use mode=upsert to update it"
+    return error.get('errmsg', 'Write failed')
+
+# Validate and write every batch, collecting the counts and the per-row error report.
+# write_batch(rows) returns the bulk result and the write errors by position in rows.
+def run_import(batches, validate, write_batch, upsert):
+    summary = {"mode": "upsert" if upsert else "insert", "rows": 0, "inserted": 0, "updated": 0, "error_count": 0, "errors": []}
+    try:
+        for frame in batches:
+            summary['rows'] += len(frame)
+            with span('import.validate'):
+                rows, report = validate(frame)
+            if len(rows):
+                with span('import.write'):
+                    result, failed = write_batch(rows)
+                summary['inserted'] += result['nUpserted'] if upsert else result['nInserted']
+                summary['updated'] += result['nMatched'] if upsert else 0
+                row_numbers = rows.index.to_numpy()
+                report += [
+                    {"row": int(row_numbers[i]), "errors": [import_error_message(error, upsert)]}
+                    for i, error in failed.items()
+                ]
+            summary['error_count'] += len(report)
+            room = MAX_IMPORT_ERRORS - len(summary['errors'])
+            summary['errors'] += sorted(report, key=lambda r: r['row'])[:max(room, 0)]
+    except ValueError as e:
+        # Batches before the unreadable part are already written and stay counted
+        summary['error'] = str(e)
+    summary['errors_truncated'] = summary['error_count'] > len(summary['errors'])
+    return summary
+
+def write_depense_batch(rows, upsert, username, owner_filter):
+    documents = import_documents(rows)
+    previous = []
+    if upsert:
+        previous = list(mongo.db.depenses.find(
+            {'external_id': {'$in': [d['external_id'] for d in documents]}, **owner_filter},
+            {'external_id': 1, 'centre_id': 1, 'date': 1, 'montant': 1}
+        ))
+    result, failed = write_import_batch(mongo.db.depenses, documents, upsert, owner_filter, {'created_by': username}, {'version': 1})
+
+    # Rollups: add the written rows, remove what the replaced depenses contributed
+    deltas = {}
+    def add(centre_id, date, montant, count):
+        delta = deltas.setdefault((centre_id, *depense_period(date)), [0.0, 0])
+        delta[0] += montant
+        delta[1] += count
+    written = [d for i, d in enumerate(documents) if i not in failed]
+    for d in written:
+        add(d['centre_id'], d['date'], d['montant'], 1)
+    written_ids = {d.get('external_id') for d in written}
+    for d in previous:
+        if d['external_id'] in written_ids:
+            add(d['centre_id'], d['date'], -d['montant'], -1)
+    apply_rollup_deltas(deltas)
+    return result, failed
+
+def write_budget_batch(rows, upsert):
+    documents = import_documents(rows)
+    previous = []
+    if upsert:
+        previous = list(mongo.db.budgets.find(
+            {'external_id': {'$in': [d['external_id'] for d in documents]}},
+            {'centre_id': 1, 'annee': 1, 'trimester': 1}
+        ))
+    result, failed = write_import_batch(mongo.db.budgets, documents, upsert)
+    # The periods of the written budgets, and those the replaced budgets were in
+    evaluate_budget_status(
+        [(d['centre_id'], d['annee'], d['trimester']) for i, d in enumerate(documents) if i not in failed] +
+        [(d['centre_id'], d['annee'], d['trimester']) for d in previous]
+    )
+    return result, failed
+
+@app.route('/api/import/depenses', methods=['POST'])
+@jwt_required()
+def import_depenses():
+    from imports import validate_depenses
+
+    try:
+        upsert = parse_import_mode()
+        batches = import_batches()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    username = get_jwt_identity()
+    # Only admins can update depenses created by someone else
+    owner_filter = {} if has_role('admin') else {'created_by': username}
+    centre_ids = known_centre_ids()
+    summary = run_import(
+        batches,
+        lambda frame: validate_depenses(frame, centre_ids, upsert),
+        lambda rows: write_depense_batch(rows, upsert, username, owner_filter),
+        upsert
+    )
+    if summary['inserted'] or summary['updated']:
+        bump_data_version('depenses')
+    if summary['updated']:
+        bump_data_version('depenses:rewrites')
+    return jsonify(summary), 400 if 'error' in summary else 200
+
+@app.route('/api/import/budgets', methods=['POST'])
+@role_required('admin')
+def import_budgets():
+    from imports import validate_budgets
+
+    try:
+        upsert = parse_import_mode()
+        batches = import_batches()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    centre_ids = known_centre_ids()
+    summary = run_import(
+        batches,
+        lambda frame: validate_budgets(frame, centre_ids, upsert),
+        lambda rows: write_budget_batch(rows, upsert),
+        upsert
+    )
+    if summary['inserted'] or summary['updated']:
+        bump_data_version('budgets')
+    if summary['updated']:
+        bump_data_version('budgets:rewrites')
+    return jsonify(summary), 400 if 'error' in summary else 200
+
+# Dashboard analytics
+def centre_name_lookup(local_field):
+    return [
+        {'$lookup': {'from': 'centres', 'localField': local_field, 'foreignField': '_id', 'as': 'centre'}},
+        {'$addFields': {'centre_name': {'$ifNull': [{'$arrayElemAt': ['$centre.nom', 0]}, 'N/A']}}},
+        {'$project': {'centre': 0}}
+    ]
+
+def trend_start(time_range, today):
+    if time_range == 'month':
+        return today.replace(day=1)
+    if time_range == 'quarter':
+        month = today.month - 2
+        year = today.year if month > 0 else today.year - 1
+        return today.replace(year=year, month=month if month > 0 else month + 12, day=1)
+    return today.replace(year=today.year - 1, day=1)
+
+def month_range(start, end):
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year, month + 1) if month < 12 else (year + 1, 1)
+    return months
+
+@app.route('/api/analytics', methods=['GET'])
+@jwt_required()
+@versioned('depenses', 'budgets', 'rollups', 'centres')
+def get_analytics():
+    # 'all' is what the Dashboard selects send when a filter is not set
+    args = {k: v for k, v in request.args.items() if v and v != 'all'}
+    time_range = args.get('time_range', 'year')
+    if time_range not in ('month', 'quarter', 'year'):
+        return jsonify({"error": "'time_range' must be 'month', 'quarter' or 'year'"}), 400
+
+    try:
+        period_query = build_period_query(args)
+        trend_query = build_depense_query({'centre_id': args['trend_centre_id']} if 'trend_centre_id' in args else {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # The totals come from depense_rollups, one document per (centre, annee, trimester)
+    # whatever the number of depenses. Depenses whose date could not be migrated have no
+    # period and are left out.
+    by_period = list(mongo.db.depense_rollups.aggregate([
+        {'$match': period_query},
+        {'$group': {
+            '_id': {'centre_id': '$centre_id', 'annee': '$annee', 'trimester': '$trimester'},
+            'total': {'$sum': '$total'},
+            'count': {'$sum': '$count'}
+        }},
+        *centre_name_lookup('_id.centre_id'),
+        {'$sort': {'_id.annee': 1, '_id.trimester': 1}}
+    ]))
+    total_actual = sum(p['total'] for p in by_period)
+    num_expenses = sum(p['count'] for p in by_period)
+
+    budget_totals = list(mongo.db.budgets.aggregate([
+        {'$match': period_query},
+        {'$group': {'_id': None, 'total': {'$sum': '$montant'}, 'count': {'$sum': 1}}}
+    ]))
+    total_budget = budget_totals[0]['total'] if budget_totals else 0
+    num_budgets = budget_totals[0]['count'] if budget_totals else 0
+
+    # Unfiltered expenses by centre (bar and pie charts)
+    by_centre = list(mongo.db.depense_rollups.aggregate([
+        {'$group': {'_id': '$centre_id', 'total': {'$sum': '$total'}, 'count': {'$sum': '$count'}}},
+        *centre_name_lookup('_id'),
+        {'$sort': {'total': -1}}
+    ]))
+
+    # Unfiltered annual budgets by centre
+    annual_budgets = mongo.db.budgets.aggregate([
+        {'$group': {'_id': {'centre_id': '$centre_id', 'annee': '$annee'}, 'total': {'$sum': '$montant'}}},
+        *centre_name_lookup('_id.centre_id'),
+        {'$sort': {'_id.annee': 1}}
+    ])
+    annual_budget_by_centre = {}
+    for b in annual_budgets:
+        centre_budgets = annual_budget_by_centre.setdefault(b['centre_name'], {})
+        centre_budgets[str(b['_id']['annee'])] = centre_budgets.get(str(b['_id']['annee']), 0) + b['total']
+
+    # Monthly trend, zero-filled over the requested range
+    today = datetime.now().date()
+    start = trend_start(time_range, today)
+    months = month_range(start, today)
+    trend_query.setdefault('date', {})['$gte'] = datetime(start.year, start.month, 1)
+    trend_totals = {t['_id']: t['amount'] for t in mongo.db.depenses.aggregate([
+        {'$match': trend_query},
+        {'$group': {'_id': {'$dateToString': {'format': '%Y-%m', 'date': '$date'}}, 'amount': {'$sum': '$montant'}}}
+    ])}
+    trend = [{'month': m, 'amount': trend_totals.get(m, 0)} for m in months]
+
+    recent = list(mongo.db.depenses.aggregate([
+        {'$sort': {'date': -1, '_id': -1}},
+        {'$limit': 5},
+        *centre_name_lookup('centre_id')
+    ]))
+
+    centres = mongo.db.centres.find({}, {'nom': 1})
+
+    return jsonify({
+        "centres": [{"_id": str(c['_id']), "nom": c.get('nom')} for c in centres],
+        "totals": {
+            "budget": total_budget,
+            "actual": total_actual,
+            "variance": total_actual - total_budget,
+            "num_budgets": num_budgets,
+            "num_expenses": num_expenses,
+            "avg_budget_per_trimester": total_budget / num_budgets if num_budgets else 0
+        },
+        "by_period": [{
+            "centre_id": str(p['_id']['centre_id']),
+            "centre_name": p['centre_name'],
+            "annee": p['_id']['annee'],
+            "trimester": p['_id']['trimester'],
+            "total": p['total'],
+            "count": p['count']
+        } for p in by_period],
+        "by_centre": [{
+            "centre_id": str(c['_id']),
+            "name": c['centre_name'],
+            "total": c['total'],
+            "count": c['count']
+        } for c in by_centre if c['total'] > 0],
+        "annual_budget_by_centre": annual_budget_by_centre,
+        "trend": trend,
+        "recent_depenses": [{
+            "_id": str(d['_id']),
+            "date": format_depense(d).get('date'),
+            "montant": d.get('montant'),
+            "description": d.get('description'),
+            "centre_name": d['centre_name']
+        } for d in recent]
+    })
+
+# Parquet snapshot of depenses and budgets for the analytics, see snapshot.py. It is
+# refreshed by `flask --app app snapshot` (from cron, or with --interval). The prediction
+# and export routes read it with ?source=snapshot when it is at most max_staleness
+# seconds old (SNAPSHOT_MAX_STALENESS) or still matches the data, and MongoDB otherwise;
+# the X-Data-Source header tells which one answered.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "pme_snapshot"))
+SNAPSHOT_MAX_STALENESS = float(os.getenv("SNAPSHOT_MAX_STALENESS", 300))
+SNAPSHOT_LAG = float(os.getenv("SNAPSHOT_LAG", 60))
+SNAPSHOT_COLLECTIONS = ('depenses', 'budgets')
+DATA_SOURCES = ('mongo', 'snapshot')
+
+_ledger_snapshot = None
+
+# Created on first use, pyarrow is only imported by the processes that need it
+def ledger_snapshot():
+    global _ledger_snapshot
+    if _ledger_snapshot is None:
+        from snapshot import ParquetSnapshot
+        _ledger_snapshot = ParquetSnapshot(SNAPSHOT_DIR)
+    return _ledger_snapshot
+
+# Depenses whose date can't be parsed (see migrate-depense-dates) are left out
+def depense_snapshot_row(doc):
+    try:
+        date = parse_depense_date(doc['date'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    annee, trimester = depense_period(date)
+    return {
+        '_id': str(doc['_id']),
+        'centre_id': str(doc['centre_id']),
+        'date': date,
+        'annee': annee,
+        'trimester': trimester,
+        'montant': float(doc['montant']),
+        'description': doc.get('description'),
+        'created_by': doc.get('created_by')
+    }
+
+def budget_snapshot_row(doc):
+    return {
+        '_id': str(doc['_id']),
+        'centre_id': str(doc['centre_id']),
+        'annee': int(doc['annee']),
+        'trimester': int(doc['trimester']),
+        'montant': float(doc['montant'])
+    }
+
+def refresh_snapshot(full=False):
+    # Read before the documents, so writes made during the refresh make it stale
+    versions = data_versions(*SNAPSHOT_COLLECTIONS)
+    rewrites = data_versions(*(f"{name}:rewrites" for name in SNAPSHOT_COLLECTIONS))
+    return ledger_snapshot().refresh({
+        'depenses': (mongo.db.depenses, depense_snapshot_row, rewrites['depenses:rewrites']),
+        'budgets': (mongo.db.budgets, budget_snapshot_row, rewrites['budgets:rewrites'])
+    }, versions, lag=SNAPSHOT_LAG, full=full)
+
+@app.cli.command('snapshot')
+@click.option('--full', is_flag=True, help='Write every collection again instead of appending the new documents.')
+@click.option('--interval', default=0.0, help='Refresh every INTERVAL seconds until interrupted.')
+def snapshot_command(full, interval):
+    while True:
+        start = time.perf_counter()
+        stats = refresh_snapshot(full)
+        for name, s in stats.items():
+            click.echo(f"{name}: {s['read']} document(s) read{' (rebuilt)' if s['rebuilt'] else ''}, {s['documents']} in the snapshot")
+        if not interval:
+            return
+        full = False
+        time.sleep(max(interval - (time.perf_counter() - start), 0))
+
+# source and max_staleness of the analytics routes (raises ValueError on bad input)
+def parse_data_source(args):
+    source = args.get('source') or 'mongo'
+    if source not in DATA_SOURCES:
+        raise ValueError(f"'source' must be one of {', '.join(DATA_SOURCES)}")
+    max_staleness = args.get('max_staleness')
+    try:
+        max_staleness = float(max_staleness) if max_staleness not in (None, '') else SNAPSHOT_MAX_STALENESS
+    except (TypeError, ValueError):
+        raise ValueError("Invalid 'max_staleness'")
+    return source, max_staleness
+
+# The snapshot to read, or None to read MongoDB: there is none yet, or it is older than
+# max_staleness and the data changed since
+def usable_snapshot(source, max_staleness):
+    if source != 'snapshot':
+        return None
+    snapshot = ledger_snapshot().view()
+    if snapshot is None:
+        return None
+    if snapshot.age() <= max_staleness or snapshot.versions == data_versions(*SNAPSHOT_COLLECTIONS):
+        return snapshot
+    return None
+
+# Part of the ETag of the routes that may read the snapshot
+def snapshot_etag_key():
+    if request.args.get('source') != 'snapshot':
+        return None
+    snapshot = ledger_snapshot().view()
+    return snapshot.id if snapshot else None
+
+# Quarterly totals of a centre from the snapshot's depenses, like its depense_rollups
+def snapshot_rollups(snapshot, centre_id):
+    with span('snapshot.read'):
+        table = snapshot.read('depenses', columns=['annee', 'trimester', 'montant'], filters=[('centre_id', '==', str(centre_id))])
+    totals = table.group_by(['annee', 'trimester']).aggregate([('montant', 'sum')])
+    return [{'annee': r['annee'], 'trimester': r['trimester'], 'total': r['montant_sum']} for r in totals.to_pylist()]
+
+# Forecasting of the quarterly totals of a centre, see forecasting.py for the models
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", 256))
+DEFAULT_MODEL = 'linear'
+
+# Cache key for the fit of each centre: the rollups rebuild epoch and the centre's own
+# version, bumped by apply_rollup_delta whenever one of its depenses changes
+def centre_fit_versions(centre_ids):
+    names = {centre_id: f"depenses:{centre_id}" for centre_id in centre_ids}
+    versions = data_versions('rollups', *names.values())
+    return {centre_id: (versions['rollups'], versions[name]) for centre_id, name in names.items()}
+
+# Fit a model on the centre's rollups (or on the totals of the snapshot when given),
+# returns (n_periods, fitted model or None, r2). Entries for outdated versions are
+# never looked up again and age out of the LRU.
+@lru_cache(maxsize=PREDICTION_CACHE_SIZE)
+def fit_centre_model(centre_id, model_name, version, snapshot=None):
+    if snapshot is not None:
+        rollups = snapshot_rollups(snapshot, centre_id)
+    else:
+        rollups = list(mongo.db.depense_rollups.find(
+            {"centre_id": ObjectId(centre_id)},
+            {"_id": 0, "annee": 1, "trimester": 1, "total": 1}
+        ))
+    model = make_model(model_name)
+    if len(rollups) < model.min_periods:
+        return len(rollups), None, 0.0
+
+    periods = period_index([r['annee'] for r in rollups], [r['trimester'] for r in rollups])
+    y = np.array([r['total'] for r in rollups], dtype=float)
+    with span('forecast.fit'):
+        model.fit(periods, y)
+    return len(rollups), model, forecast_r2_score(y, model.fitted_)
+
+def prediction_result(fit, model_name, annee, trimester):
+    n_periods, model, r2 = fit
+    if n_periods == 0:
+        return {"prediction": 0, "r2_score": 0, "message": "No historical data for prediction"}
+    if model is None:
+        min_periods = MODELS[model_name].min_periods
+        return {"prediction": 0, "r2_score": 0, "message": f"Not enough aggregated data (less than {min_periods} trimesters) for meaningful prediction"}
+    prediction = model.predict(period_index([annee], [trimester]))[0]
+    return {"prediction": float(prediction), "r2_score": r2, "model": model_name}
+
+def parse_model_name(value):
+    model_name = value or DEFAULT_MODEL
+    if model_name not in MODELS:
+        raise ValueError(f"Unknown model '{model_name}', expected one of: {', '.join(MODELS)}")
+    return model_name
+
 @app.route('/api/predictions', methods=['GET'])
 @jwt_required()
+@versioned('depenses', 'rollups')
 def get_prediction():
     centre_id = request.args.get('centre_id')
     trimester_str = request.args.get('trimester')
@@ -425,205 +2014,586 @@ def get_prediction():
     except ValueError:
         return jsonify({"error": "Invalid trimester or annee format"}), 400
 
-    # Get historical data for the center
-    depenses = mongo.db.depenses.find({"centre_id": ObjectId(centre_id)})
-    df = pd.DataFrame(list(depenses))
-
-    if df.empty:
-        return jsonify({"prediction": 0, "r2_score": 0, "message": "No historical data for prediction"})
-
-    df['date'] = pd.to_datetime(df['date'])
-    df['annee'] = df['date'].dt.year
-    df['trimester'] = (df['date'].dt.month - 1) // 3 + 1 # Calculate trimester (1-4)
-    df['montant'] = df['montant'].astype(float)
-
-    # Aggregate historical expenses by trimester and year
-    aggregated_df = df.groupby(['annee', 'trimester'])['montant'].sum().reset_index()
-    aggregated_df.rename(columns={'montant': 'total_montant'}, inplace=True)
-
-    if len(aggregated_df) < 2:
-        return jsonify({"prediction": 0, "r2_score": 0, "message": "Not enough aggregated data (less than 2 trimesters) for meaningful prediction"})
-    
-    # Prepare training data
-    # X will be a single feature representing time (e.g., year + trimester as a decimal)
-    aggregated_df['time_feature'] = aggregated_df['annee'] + (aggregated_df['trimester'] / 4.0)
-    
-    X_train = aggregated_df[['time_feature']]
-    y_train = aggregated_df['total_montant']
-
-    model = LinearRegression()
-    model.fit(X_train, y_train)
+    if not ObjectId.is_valid(centre_id):
+        return jsonify({"error": "Invalid 'centre_id'"}), 400
+    try:
+        model_name = parse_model_name(request.args.get('model'))
+        source, max_staleness = parse_data_source(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    snapshot = usable_snapshot(source, max_staleness)
+    if snapshot is not None:
+        fit = fit_centre_model(centre_id, model_name, snapshot.id, snapshot)
+    else:
+        versions = centre_fit_versions([centre_id])
+        fit = fit_centre_model(centre_id, model_name, versions[centre_id])
+    response = jsonify(prediction_result(fit, model_name, target_annee, target_trimester))
+    response.headers['X-Data-Source'] = 'mongo' if snapshot is None else 'snapshot'
+    return response
+
+MAX_BATCH_TARGETS = 1000
+
+@app.route('/api/predictions/batch', methods=['POST'])
+@jwt_required()
+def get_predictions_batch():
+    data = request.get_json() or {}
+    targets = data.get('targets')
+
+    if not isinstance(targets, list) or not targets:
+        return jsonify({"error": "'targets' must be a non-empty list"}), 400
+    if len(targets) > MAX_BATCH_TARGETS:
+        return jsonify({"error": f"At most {MAX_BATCH_TARGETS} targets per request"}), 400
+    try:
+        model_name = parse_model_name(data.get('model'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    parsed = []
+    for target in targets:
+        centre_id = target.get('centre_id') if isinstance(target, dict) else None
+        if not centre_id or not ObjectId.is_valid(centre_id):
+            return jsonify({"error": "Each target needs a valid 'centre_id'"}), 400
+        try:
+            parsed.append((centre_id, int(target.get('trimester')), int(target.get('annee'))))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid trimester or annee format"}), 400
+
+    # One fit per centre, however many quarters are requested for it
+    versions = centre_fit_versions({centre_id for centre_id, _, _ in parsed})
+    fits = {centre_id: fit_centre_model(centre_id, model_name, version) for centre_id, version in versions.items()}
+
+    return jsonify({"predictions": [
+        {"centre_id": centre_id, "trimester": trimester, "annee": annee,
+         **prediction_result(fits[centre_id], model_name, annee, trimester)}
+        for centre_id, trimester, annee in parsed
+    ]})
+
+# Rolling-origin backtest of the forecasting models over all centres (or one centre):
+# every quarter with enough history is forecast from the quarters before it
+@app.route('/api/predictions/backtest', methods=['GET'])
+@role_required('admin')
+def backtest_predictions():
+    models = request.args.get('models')
+    model_names = [m.strip() for m in models.split(',') if m.strip()] if models else list(MODELS)
+    unknown = [m for m in model_names if m not in MODELS]
+    if unknown:
+        return jsonify({"error": f"Unknown model(s): {', '.join(unknown)}"}), 400
+
+    query = {}
+    centre_id = request.args.get('centre_id')
+    if centre_id:
+        if not ObjectId.is_valid(centre_id):
+            return jsonify({"error": "Invalid 'centre_id'"}), 400
+        query['centre_id'] = ObjectId(centre_id)
+    per_centre = request.args.get('per_centre') in ('1', 'true')
+
+    rollups = list(mongo.db.depense_rollups.find(query, {"_id": 0, "centre_id": 1, "annee": 1, "trimester": 1, "total": 1}))
+    centre_ids, periods, Y, observed = quarterly_matrix(rollups)
+
+    results = {}
+    for name in model_names:
+        with span('forecast.backtest'):
+            result = rolling_origin_backtest(make_model(name), periods, Y, observed)
+        results[name] = {
+            "mae": result['mae'],
+            "mape": result['mape'],
+            "forecasts": result['forecasts'],
+            "fit_time_ms": result['fit_time_ms']
+        }
+        if per_centre:
+            results[name]["centres"] = [{
+                "centre_id": c,
+                "mae": None if np.isnan(mae) else float(mae),
+                "mape": None if np.isnan(mape) else float(mape),
+                "forecasts": int(n)
+            } for c, mae, mape, n in zip(centre_ids, result['per_centre_mae'], result['per_centre_mape'], result['per_centre_forecasts'])]
+
+    return jsonify({"centres": len(centre_ids), "periods": len(periods), "models": results})
+
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 5000))
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Sheets of the budget export, selected with ?sheets=:
+#   variance      budget vs réel per centre and trimester
+#   consolidated  budget vs réel per centre and year
+#   detail        the depense lines of the selected centres (Finance and IT by default)
+#   centres       one sheet of depense lines per selected centre (every centre by default)
+# ?centres= (comma separated ids) and ?annee_from= / ?annee_to= restrict every sheet.
+# With ?source=snapshot the sheets are computed from the Parquet snapshot.
+EXPORT_SHEETS = ('variance', 'consolidated', 'detail', 'centres')
+DEFAULT_EXPORT_SHEETS = ('variance', 'detail')
+DEFAULT_DETAIL_CENTRES = ('Finance', 'IT')
+
+# The aggregate sheets (variance, consolidated) are computed by this pool while a single
+# thread writes the workbook, in the order of the sheets. Depense lines are streamed
+# from their cursor by the writer instead, so memory doesn't grow with the depenses.
+EXPORT_SHEET_WORKERS = int(os.getenv("EXPORT_SHEET_WORKERS", 4))
+export_sheet_executor = ThreadPoolExecutor(max_workers=EXPORT_SHEET_WORKERS)
+
+# Export options from the query string or a JSON body (raises ValueError on bad input).
+# The result is JSON serializable, it is stored with the export jobs and hashed into
+# their fingerprint.
+def parse_export_options(args):
+    centres = args.get('centres') or []
+    if isinstance(centres, str):
+        centres = [c.strip() for c in centres.split(',') if c.strip()]
+    known_centres, _ = references()
+    for centre_id in centres:
+        if not ObjectId.is_valid(centre_id) or ObjectId(centre_id) not in known_centres:
+            raise ValueError(f"Unknown centre '{centre_id}'")
+
+    years = {}
+    for key in ('annee_from', 'annee_to'):
+        value = args.get(key)
+        try:
+            years[key] = int(value) if value not in (None, '') else None
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid '{key}'")
+    if years['annee_from'] and years['annee_to'] and years['annee_from'] > years['annee_to']:
+        raise ValueError("'annee_from' must not be after 'annee_to'")
+
+    sheets = args.get('sheets') or list(DEFAULT_EXPORT_SHEETS)
+    if isinstance(sheets, str):
+        sheets = [s.strip() for s in sheets.split(',') if s.strip()]
+    unknown = [s for s in sheets if s not in EXPORT_SHEETS]
+    if unknown or not sheets:
+        raise ValueError(f"'sheets' must be a list of {', '.join(EXPORT_SHEETS)}")
+    source, max_staleness = parse_data_source(args)
+
+    return {
+        'centres': sorted(set(centres)),
+        'annee_from': years['annee_from'],
+        'annee_to': years['annee_to'],
+        # Sheets keep the order of EXPORT_SHEETS in the workbook
+        'sheets': [s for s in EXPORT_SHEETS if s in sheets],
+        'source': source,
+        'max_staleness': max_staleness
+    }
+
+def export_centre_ids(options):
+    return [ObjectId(c) for c in options['centres']]
+
+# Filter on centre_id and annee, for the budgets and the rollups
+def export_period_query(options):
+    query = {}
+    if options['centres']:
+        query['centre_id'] = {'$in': export_centre_ids(options)}
+    annee = {}
+    if options['annee_from']:
+        annee['$gte'] = options['annee_from']
+    if options['annee_to']:
+        annee['$lte'] = options['annee_to']
+    if annee:
+        query['annee'] = annee
+    return query
+
+# Depenses are filtered on their date, which older documents without annee also have
+def export_depense_query(centre_ids, options):
+    query = {'centre_id': {'$in': centre_ids}}
+    date_range = {}
+    if options['annee_from']:
+        date_range['$gte'] = datetime(options['annee_from'], 1, 1)
+    if options['annee_to']:
+        date_range['$lt'] = datetime(options['annee_to'] + 1, 1, 1)
+    if date_range:
+        query['date'] = date_range
+    return query
+
+# Filters of the snapshot reads, like export_period_query
+def export_snapshot_filters(options, centre_ids=None):
+    filters = []
+    centre_ids = options['centres'] if centre_ids is None else centre_ids
+    if centre_ids:
+        filters.append(('centre_id', 'in', [str(c) for c in centre_ids]))
+    if options['annee_from']:
+        filters.append(('annee', '>=', options['annee_from']))
+    if options['annee_to']:
+        filters.append(('annee', '<=', options['annee_to']))
+    return filters
+
+# {group key values: summed montant} of budgets or depenses from the snapshot
+def snapshot_totals(snapshot, name, keys, options):
+    with span('snapshot.read'):
+        table = snapshot.read(name, columns=list(keys) + ['montant'], filters=export_snapshot_filters(options))
+    return {
+        tuple(r[k] for k in keys): r['montant_sum']
+        for r in table.group_by(list(keys)).aggregate([('montant', 'sum')]).to_pylist()
+    }
+
+# Budget and réel summed per group of keys by MongoDB (or from the snapshot), merged into
+# one row per group with a budget, like /api/variance: [(key values, budget, réel)]
+def export_totals(options, keys, snapshot=None):
+    if snapshot is not None:
+        budgets = snapshot_totals(snapshot, 'budgets', keys, options)
+        reels = snapshot_totals(snapshot, 'depenses', keys, options)
+    else:
+        query = export_period_query(options)
+        group_id = {key: f'${key}' for key in keys}
+        budgets, reels = (
+            {tuple(doc['_id'][k] for k in keys): float(doc['total']) for doc in collection.aggregate([
+                {'$match': query},
+                {'$group': {'_id': group_id, 'total': {'$sum': field}}}
+            ])}
+            for collection, field in ((mongo.db.budgets, '$montant'), (mongo.db.depense_rollups, '$total'))
+        )
+    return [(key, budget, reels.get(key, 0.0)) for key, budget in budgets.items()]
+
+def variance_sheet_rows(options, centre_names, snapshot=None):
+    rows = []
+    for (centre_id, annee, trimester), budget, reel in export_totals(options, ('centre_id', 'annee', 'trimester'), snapshot):
+        fields = variance_fields(budget, reel)
+        rows.append((centre_names.get(str(centre_id), 'N/A'), trimester, annee, budget, reel,
+                     fields['ecart'], fields['taux_ecart'], fields['interpretation']))
+    rows.sort(key=lambda r: (r[0], r[2], r[1]))
+    return rows
+
+def consolidated_sheet_rows(options, centre_names, snapshot=None):
+    rows = []
+    for (centre_id, annee), budget, reel in export_totals(options, ('centre_id', 'annee'), snapshot):
+        fields = variance_fields(budget, reel)
+        rows.append((centre_names.get(str(centre_id), 'N/A'), annee, budget, reel,
+                     fields['ecart'], fields['taux_ecart'], fields['interpretation']))
+    rows.sort(key=lambda r: (r[0], r[1]))
+    return rows
+
+# The columns are kept in Arrow and turned into Python rows one batch at a time
+def snapshot_detail_rows(snapshot, centre_ids, options, centre_names):
+    with span('snapshot.read'):
+        table = snapshot.read(
+            'depenses', columns=['date', 'trimester', 'montant', 'description', 'centre_id'],
+            filters=export_snapshot_filters(options, centre_ids)
+        )
+    table = table.sort_by([('centre_id', 'descending'), ('date', 'ascending')])
+    for batch in table.to_batches(max_chunksize=EXPORT_BATCH_SIZE):
+        for r in batch.to_pylist():
+            yield (r['trimester'], centre_names.get(r['centre_id']), r['description'], r['date'].strftime('%Y-%m-%d'), r['montant'])
+
+# Generator of the rows, read from the cursor in batches of EXPORT_BATCH_SIZE. Sorted by
+# walking the centre_date index backwards, so MongoDB doesn't sort in memory.
+def detail_sheet_rows(centre_ids, options, centre_names, snapshot=None):
+    if snapshot is not None:
+        yield from snapshot_detail_rows(snapshot, centre_ids, options, centre_names)
+        return
+    cursor = mongo.db.depenses.find(
+        export_depense_query(centre_ids, options),
+        {'_id': 0, 'date': 1, 'trimester': 1, 'montant': 1, 'description': 1, 'centre_id': 1}
+    ).sort([('centre_id', -1), ('date', 1)]).batch_size(EXPORT_BATCH_SIZE)
+    for doc in cursor:
+        date = parse_depense_date(doc['date'])
+        trimester = doc.get('trimester') or depense_period(date)[1]
+        yield (trimester, centre_names.get(str(doc['centre_id'])), doc.get('description'),
+               date.strftime('%Y-%m-%d'), doc.get('montant'))
+
+# Worksheet titles are at most 31 characters, without []:*?/\ and unique in a workbook
+def sheet_title(name, used):
+    title = ''.join('_' if c in '[]:*?/\\' else c for c in name)[:31] or 'Centre'
+    candidate, n = title, 2
+    while candidate.lower() in used:
+        suffix = f" ({n})"
+        candidate, n = title[:31 - len(suffix)] + suffix, n + 1
+    used.add(candidate.lower())
+    return candidate
+
+# (title, columns, compute, streamed) of each sheet of the workbook. compute returns the
+# rows: a list for the aggregate sheets, a generator for the streamed depense lines.
+def export_sheet_specs(options, snapshot=None):
+    from reports import CONSOLIDATED_COLUMNS, DEPENSES_SUMMARY_COLUMNS, VARIANCE_COLUMNS
+
+    centre_names = centre_name_map()
+    used = set()
+    specs = []
+    for sheet in options['sheets']:
+        if sheet == 'variance':
+            specs.append((sheet_title("Analyse des écarts", used), VARIANCE_COLUMNS,
+                          lambda: variance_sheet_rows(options, centre_names, snapshot), False))
+        elif sheet == 'consolidated':
+            specs.append((sheet_title("Consolidé annuel", used), CONSOLIDATED_COLUMNS,
+                          lambda: consolidated_sheet_rows(options, centre_names, snapshot), False))
+        elif sheet == 'detail':
+            if options['centres']:
+                title, centre_ids = "Dépenses des centres", export_centre_ids(options)
+            else:
+                title = "Dépenses Trimestrielles FI"
+                centre_ids = [ObjectId(c) for c, nom in centre_names.items() if nom in DEFAULT_DETAIL_CENTRES]
+            specs.append((sheet_title(title, used), DEPENSES_SUMMARY_COLUMNS,
+                          lambda centre_ids=centre_ids: detail_sheet_rows(centre_ids, options, centre_names, snapshot), True))
+        elif sheet == 'centres':
+            centre_ids = options['centres'] or sorted(centre_names, key=lambda c: centre_names[c] or '')
+            for centre_id in centre_ids:
+                specs.append((sheet_title(centre_names[str(centre_id)] or str(centre_id), used), DEPENSES_SUMMARY_COLUMNS,
+                              lambda centre_id=centre_id: detail_sheet_rows([ObjectId(centre_id)], options, centre_names, snapshot), True))
+    return specs
+
+def compute_sheet(compute):
+    with span('export.sheet'):
+        return compute()
+
+# Yield (title, columns, rows) in order. The aggregate sheets, a few thousand rows at
+# most, are all submitted to the pool up front; streamed sheets are only read when the
+# writer gets to them.
+def computed_sheets(specs):
+    futures = {
+        i: export_sheet_executor.submit(contextvars.copy_context().run, compute_sheet, compute)
+        for i, (_, _, compute, streamed) in enumerate(specs) if not streamed
+    }
+    try:
+        for i, (title, columns, compute, streamed) in enumerate(specs):
+            yield title, columns, compute() if streamed else futures[i].result()
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+# Yield a file in chunks and remove it once sent (or when the client disconnects)
+def stream_and_remove(path, chunk_size=EXPORT_CHUNK_SIZE):
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+# Build the report into a write-only workbook saved at target (a path or a file object).
+# Aggregations run in MongoDB (or on the snapshot) and the aggregate sheets are computed
+# in parallel while the depense lines are streamed; progress is reported as the fraction of sheets written. Returns the data
+# source that was read.
+def build_export_file(target, options, progress=None):
+    from openpyxl import Workbook
+    from reports import write_rows
+
+    progress = progress or (lambda fraction: None)
+    snapshot = usable_snapshot(options['source'], options['max_staleness'])
+    specs = export_sheet_specs(options, snapshot)
+
+    wb = Workbook(write_only=True)
+    for done, (title, columns, rows) in enumerate(computed_sheets(specs), start=1):
+        with span('export.write'):
+            write_rows(wb.create_sheet(title=title), columns, rows)
+        progress(done / len(specs))
+
+    with span('export.save'):
+        wb.save(target)
+    progress(1.0)
+    return 'mongo' if snapshot is None else 'snapshot'
+
+# Streaming variant of export_budgets: the workbook is built in a temporary file
+# which is then sent in chunks
+def export_budgets_streaming(options):
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        source = build_export_file(path, options)
+    except Exception:
+        os.remove(path)
+        raise
+
+    return Response(
+        stream_with_context(stream_and_remove(path)),
+        mimetype=XLSX_MIMETYPE,
+        headers={
+            'Content-Disposition': 'attachment; filename=Analyse_Budgets_Depenses.xlsx',
+            'Content-Length': str(os.path.getsize(path)),
+            'X-Data-Source': source
+        }
+    )
 
-    # Prepare data for prediction
-    target_time_feature = target_annee + (target_trimester / 4.0)
-    
-    # Predict total expenses for the target trimester
-    total_prediction = model.predict([[target_time_feature]])[0]
-    
-    # Calculate R2 score for the aggregated model
-    y_pred_train = model.predict(X_train)
-    r2 = r2_score(y_train, y_pred_train)
-    
-    return jsonify({"prediction": total_prediction, "r2_score": r2})
+# Asynchronous export jobs. Jobs are documents in export_jobs so any worker can answer
+# status polls; finished files are cached on disk under the data fingerprint, so
+# repeat exports of unchanged data are served without rebuilding.
+#
+# A job beats (its heartbeat field) every EXPORT_JOB_HEARTBEAT seconds while queued or
+# running. One whose worker died or was recycled (gunicorn's max_requests) stops beating
+# and is failed after EXPORT_JOB_TIMEOUT seconds, so the next request starts it again.
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pme_exports"))
+EXPORT_CACHE_KEEP = int(os.getenv("EXPORT_CACHE_KEEP", 5))
+export_executor = ThreadPoolExecutor(max_workers=int(os.getenv("EXPORT_WORKERS", 2)))
+EXPORT_JOB_HEARTBEAT = float(os.getenv("EXPORT_JOB_HEARTBEAT", 15))
+EXPORT_JOB_TIMEOUT = float(os.getenv("EXPORT_JOB_TIMEOUT", 120))
+PENDING_EXPORT_STATUSES = ['queued', 'running']
+
+def export_fingerprint(options):
+    versions = data_versions('budgets', 'centres', 'depenses', 'rollups')
+    snapshot = usable_snapshot(options['source'], options['max_staleness'])
+    key = [versions, options, snapshot.id if snapshot else None]
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+def export_cache_path(fingerprint):
+    return os.path.join(EXPORT_CACHE_DIR, f"budgets-{fingerprint}.xlsx")
+
+# Keep only the most recent cached files; older fingerprints can't be requested again anyway
+def prune_export_cache():
+    files = [os.path.join(EXPORT_CACHE_DIR, f) for f in os.listdir(EXPORT_CACHE_DIR) if f.endswith('.xlsx')]
+    files.sort(key=os.path.getmtime, reverse=True)
+    for path in files[EXPORT_CACHE_KEEP:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# Fail the pending jobs matching query that stopped beating
+def fail_stale_export_jobs(query):
+    now = datetime.utcnow()
+    mongo.db.export_jobs.update_many(
+        {**query, 'status': {'$in': PENDING_EXPORT_STATUSES},
+         'heartbeat': {'$not': {'$gte': now - timedelta(seconds=EXPORT_JOB_TIMEOUT)}}},
+        {'$set': {'status': 'failed', 'error': 'The export was interrupted, request it again', 'finished_at': now}}
+    )
 
+# Beat for job_id from a background thread until the block exits
+class ExportJobHeartbeat:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='export-job-heartbeat', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(EXPORT_JOB_HEARTBEAT):
+            mongo.db.export_jobs.update_one({'_id': self.job_id}, {'$set': {'heartbeat': datetime.utcnow()}})
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def run_export_job(job_id, fingerprint, options):
+    with app.app_context():
+        now = datetime.utcnow()
+        # A job failed as stale while it waited in the queue was already started again
+        started = mongo.db.export_jobs.update_one(
+            {'_id': job_id, 'status': 'queued'},
+            {'$set': {'status': 'running', 'started_at': now, 'heartbeat': now}}
+        )
+        if not started.modified_count:
+            return
+        path = export_cache_path(fingerprint)
+        tmp_path = f"{path}.{job_id}.tmp"
+        try:
+            def progress(fraction):
+                mongo.db.export_jobs.update_one({'_id': job_id}, {'$set': {'progress': round(fraction, 3), 'heartbeat': datetime.utcnow()}})
+            with ExportJobHeartbeat(job_id):
+                build_export_file(tmp_path, options, progress)
+            os.replace(tmp_path, path)
+            prune_export_cache()
+            mongo.db.export_jobs.update_one(
+                {'_id': job_id},
+                {'$set': {'status': 'done', 'progress': 1.0, 'finished_at': datetime.utcnow()}}
+            )
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            mongo.db.export_jobs.update_one(
+                {'_id': job_id},
+                {'$set': {'status': 'failed', 'error': str(e), 'finished_at': datetime.utcnow()}}
+            )
+
+def export_job_json(job):
+    return {
+        "job_id": str(job['_id']),
+        "status": job['status'],
+        "progress": job.get('progress', 0),
+        "cached": job.get('cached', False),
+        "error": job.get('error')
+    }
+
+@app.route('/api/export/budgets/jobs', methods=['POST'])
+@jwt_required()
+def create_export_job():
+    try:
+        options = parse_export_options(request.get_json(silent=True) or request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    fingerprint = export_fingerprint(options)
+    now = datetime.utcnow()
+    job = {
+        'fingerprint': fingerprint,
+        'options': options,
+        'created_by': get_jwt_identity(),
+        'created_at': now,
+        'heartbeat': now,
+        'progress': 0
+    }
+
+    if os.path.exists(export_cache_path(fingerprint)):
+        job.update(status='done', progress=1.0, cached=True)
+        job['_id'] = mongo.db.export_jobs.insert_one(job).inserted_id
+        return jsonify(export_job_json(job)), 201
+
+    # Concurrent clicks on unchanged data share the job already building it, unless it stopped
+    fail_stale_export_jobs({'fingerprint': fingerprint})
+    pending = mongo.db.export_jobs.find_one({'fingerprint': fingerprint, 'status': {'$in': PENDING_EXPORT_STATUSES}})
+    if pending:
+        return jsonify(export_job_json(pending)), 202
+
+    job['status'] = 'queued'
+    job['_id'] = mongo.db.export_jobs.insert_one(job).inserted_id
+    export_executor.submit(run_export_job, job['_id'], fingerprint, options)
+    return jsonify(export_job_json(job)), 202
+
+@app.route('/api/export/budgets/jobs/<id>', methods=['GET'])
+@jwt_required()
+def get_export_job(id):
+    fail_stale_export_jobs({'_id': ObjectId(id)})
+    job = mongo.db.export_jobs.find_one({'_id': ObjectId(id)})
+    if not job:
+        return jsonify({"error": "Export job not found"}), 404
+    return jsonify(export_job_json(job))
+
+@app.route('/api/export/budgets/jobs/<id>/file', methods=['GET'])
+@jwt_required()
+def download_export_job(id):
+    job = mongo.db.export_jobs.find_one({'_id': ObjectId(id)})
+    if not job:
+        return jsonify({"error": "Export job not found"}), 404
+    if job['status'] != 'done':
+        return jsonify({"error": "Export is not ready"}), 409
+
+    path = export_cache_path(job['fingerprint'])
+    if not os.path.exists(path):
+        return jsonify({"error": "Export file expired, start a new export"}), 410
+    return send_file(
+        path,
+        mimetype=XLSX_MIMETYPE,
+        download_name='Analyse_Budgets_Depenses.xlsx',
+        as_attachment=True
+    )
 
 @app.route('/api/export/budgets', methods=['GET'])
 @jwt_required()
 def export_budgets():
-    # Fetch all data
-    budgets_raw = list(mongo.db.budgets.find())
-    centres_raw = list(mongo.db.centres.find())
-    depenses_raw = list(mongo.db.depenses.find())
-
-    # Convert ObjectIds to strings and prepare for DataFrame
-    for b in budgets_raw:
-        b['_id'] = str(b['_id'])
-        b['centre_id'] = str(b['centre_id'])
-    for c in centres_raw:
-        c['_id'] = str(c['_id'])
-    for d in depenses_raw:
-        d['_id'] = str(d['_id'])
-        d['centre_id'] = str(d['centre_id'])
-        d['date'] = pd.to_datetime(d['date']) # Ensure date is datetime object
-
-    budgets_df = pd.DataFrame(budgets_raw)
-    centres_df = pd.DataFrame(centres_raw)
-    depenses_df = pd.DataFrame(depenses_raw)
-
-    # --- Sheet 1: Analyse des écarts ---
-    analyse_ecarts_data = []
-    centre_name_map = {str(c['_id']): c['nom'] for c in centres_raw}
-
-    for idx, budget in budgets_df.iterrows():
-        centre_name = centre_name_map.get(budget['centre_id'], 'N/A')
-        
-        # Calculate Réel
-        filtered_depenses = depenses_df[
-            (depenses_df['centre_id'] == budget['centre_id']) &
-            (depenses_df['date'].dt.year == budget['annee']) &
-            (((depenses_df['date'].dt.month - 1) // 3 + 1) == budget['trimester'])
-        ]
-        reel_value = filtered_depenses['montant'].sum()
-
-        montant_budget = float(budget['montant'])
-        ecart = reel_value - montant_budget
-        taux_ecart = (ecart / montant_budget) * 100 if montant_budget != 0 else 0
-
-        interpretation = ''
-        if taux_ecart > 0:
-            interpretation = 'surcoût'
-        elif taux_ecart < 0:
-            interpretation = 'économie'
-        else:
-            interpretation = 'neutre'
-
-        analyse_ecarts_data.append({
-            'Centre': centre_name,
-            'Trimestre': budget['trimester'],
-            'Année': budget['annee'],
-            'Montant Budget': montant_budget,
-            'Réel': reel_value,
-            'Écart': ecart,
-            "Taux d'écart": taux_ecart,
-            'Interprétation': interpretation
-        })
-    
-    analyse_ecarts_df = pd.DataFrame(analyse_ecarts_data)
-
-    # --- Sheet 2: Tableau des dépenses trimestriel par centre de coûts (Finance et IT) ---
-    finance_it_centres_ids = [str(c['_id']) for c in centres_raw if c['nom'] in ['Finance', 'IT']]
-    
-    depenses_finance_it_df = depenses_df[depenses_df['centre_id'].isin(finance_it_centres_ids)].copy()
-    
-    depenses_summary_data = []
-    if not depenses_finance_it_df.empty:
-        depenses_finance_it_df['annee'] = depenses_finance_it_df['date'].dt.year
-        depenses_finance_it_df['trimester'] = (depenses_finance_it_df['date'].dt.month - 1) // 3 + 1
-        depenses_finance_it_df['centre_name'] = depenses_finance_it_df['centre_id'].map(centre_name_map)
-
-        for idx, depense in depenses_finance_it_df.iterrows():
-            # Find the budget for this specific centre, trimester, and year
-            corresponding_budget = budgets_df[
-                (budgets_df['centre_id'] == depense['centre_id']) &
-                (budgets_df['trimester'] == depense['trimester']) &
-                (budgets_df['annee'] == depense['annee'])
-            ]
-
-            depenses_summary_data.append({
-                'Trimestre': depense['trimester'],
-                'Centre': depense['centre_name'],
-                'Nature de dépense': depense['description'],
-                'Date dépense': depense['date'].strftime('%Y-%m-%d'),
-                'Réelle (MAD)': depense['montant']
-            })
-    
-    depenses_summary_df = pd.DataFrame(depenses_summary_data)
+    try:
+        options = parse_export_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Create a new Excel workbook and add sheets
-    wb = Workbook()
+    if request.args.get('stream') in ('1', 'true'):
+        return export_budgets_streaming(options)
 
-    # Sheet 1: Analyse des écarts
-    ws1 = wb.active
-    ws1.title = "Analyse des écarts"
-    
-    # Headers
-    ws1.append(list(analyse_ecarts_df.columns))
-    # Data
-    for r_idx, row in analyse_ecarts_df.iterrows():
-        ws1.append(list(row.values))
-
-    # Apply formatting
-    for cell in ws1["1:1"]:
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center')
-    for col in ws1.columns:
-        max_length = 0
-        column = col[0].column_letter # Get the column name
-        for cell in col:
-            try: # Necessary to avoid error on empty cells
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = (max_length + 2)
-        ws1.column_dimensions[column].width = adjusted_width
-
-    # Sheet 2: Tableau des dépenses trimestriel par centre de coûts (Finance et IT)
-    ws2 = wb.create_sheet(title="Dépenses Trimestrielles FI")
-    
-    # Headers
-    ws2.append(list(depenses_summary_df.columns))
-    # Data
-    for r_idx, row in depenses_summary_df.iterrows():
-        ws2.append(list(row.values))
-    
-    # Apply formatting
-    for cell in ws2["1:1"]:
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center')
-    for col in ws2.columns:
-        max_length = 0
-        column = col[0].column_letter # Get the column name
-        for cell in col:
-            try: # Necessary to avoid error on empty cells
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = (max_length + 2)
-        ws2.column_dimensions[column].width = adjusted_width
-
-    # Save the workbook to a BytesIO object
     excel_file = io.BytesIO()
-    wb.save(excel_file)
+    source = build_export_file(excel_file, options)
     excel_file.seek(0) # Go to the beginning of the stream
 
-    return send_file(
+    response = send_file(
         excel_file,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        mimetype=XLSX_MIMETYPE,
         download_name='Analyse_Budgets_Depenses.xlsx',
         as_attachment=True
     )
+    response.headers['X-Data-Source'] = source
+    return response
 
+# Development server. In production the app is served by gunicorn, see wsgi.py
 if __name__ == "__main__":
+    with app.app_context():
+        create_initial_admin()
+        create_indexes()
     app.run(debug=True, port=8000)
\ No newline at end of file
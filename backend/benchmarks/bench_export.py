@@ -0,0 +1,102 @@
+"""Scaling benchmark of the XLSX budget export (build_export_file of app.py).
+
+Seeds a database with benchmarks/seed.py for each size (a local MongoDB, or an
+in-memory mongomock with --mongomock), then builds the workbook of each sheet
+selection in memory, as export_budgets does. The defaults (500 centres, 5 years of
+quarterly budgets) give 10,000 budgets. The variance selection only times the
+aggregation path: budgets and depense_rollups summed per period by MongoDB and merged.
+
+    python benchmarks/bench_export.py --mongomock --depenses 10000 50000 --centres 50
+    python benchmarks/bench_export.py --mongo-uri mongodb://localhost:27017/pme_bench \\
+        --depenses 100000 1000000 --snapshot
+
+With --snapshot, the default sheets are also built from a Parquet snapshot of the
+seeded data (?source=snapshot). Timings should grow linearly with the number of
+depenses. Only use it on a dedicated database: each size drops it first.
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import seed as seeding  # noqa: E402
+from loadtest import use_mongomock  # noqa: E402
+
+# Query arguments of the export for each selection
+SELECTIONS = {
+    'variance': {'sheets': 'variance'},
+    'consolidated': {'sheets': 'variance,consolidated'},
+    'default': {},
+    'centres': {'sheets': 'centres'},
+}
+
+
+def best_of(repeat, fn):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument('--mongo-uri', default=os.getenv('BENCH_MONGO_URI', 'mongodb://localhost:27017/pme_bench'))
+    backend.add_argument('--mongomock', action='store_true', help='Use an in-memory mongomock database.')
+    parser.add_argument('--depenses', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--centres', type=int, default=500, help='Centres, with 4 budgets per year each.')
+    parser.add_argument('--years', type=int, default=5, help=f'Years of budgets and depenses from {seeding.FIRST_YEAR}.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--selections', nargs='+', choices=list(SELECTIONS), default=list(SELECTIONS))
+    parser.add_argument('--repeat', type=int, default=3, help='Builds per selection, the best one is reported.')
+    parser.add_argument('--snapshot', action='store_true', help='Also time the export from a Parquet snapshot.')
+    args = parser.parse_args()
+
+    if args.mongomock:
+        use_mongomock()
+    else:
+        os.environ['MONGO_URI'] = args.mongo_uri
+    # The seeded documents are new, the snapshot must not wait for them to settle
+    os.environ.setdefault('SNAPSHOT_LAG', '0')
+    os.environ.setdefault('SNAPSHOT_DIR', tempfile.mkdtemp(prefix='bench_export_'))
+    import app as api
+
+    selections = {name: SELECTIONS[name] for name in args.selections}
+    if args.snapshot:
+        selections['snapshot'] = {'source': 'snapshot', 'max_staleness': '1e9'}
+
+    db = api.mongo.db
+    print(f"{'depenses':>10} {'budgets':>8} {'selection':<14} {'source':<9} {'seconds':>8} {'MB':>6} {'µs/depense':>11}")
+    for n in args.depenses:
+        if args.mongomock:
+            for name in db.list_collection_names():
+                db.drop_collection(name)
+        else:
+            api.mongo.cx.drop_database(db.name)
+        # Passwords aren't used here, the cheapest cost keeps the seeding short
+        seeded = seeding.seed(db, args.centres, n, args.years, args.seed, bcrypt_rounds=4, indexes=not args.mongomock)
+        # The versions start over with the new database
+        api.reference_cache.clear()
+
+        with api.app.app_context():
+            if args.snapshot:
+                api.refresh_snapshot(full=True)
+            for name, query in selections.items():
+                options = api.parse_export_options(query)
+
+                def build():
+                    target = io.BytesIO()
+                    return api.build_export_file(target, options), target.tell()
+
+                (source, size), seconds = best_of(args.repeat, build)
+                print(f"{n:>10} {seeded['budgets']:>8} {name:<14} {source:<9} {seconds:>8.3f} {size / 1e6:>6.1f} {seconds / n * 1e6:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Throughput of the response serializations of serialization.py.
+
+Serializes synthetic depense documents (ObjectIds, datetimes, floats and strings, as
+read from MongoDB) with the Extended JSON of API version 1 and the compact JSON of
+version 2:
+
+    python benchmarks/bench_serialization.py
+    python benchmarks/bench_serialization.py --documents 10000 100000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from serialization import dumps_compact, dumps_extended  # noqa: E402
+
+
+def make_documents(n, n_centres=500):
+    centre_ids = [ObjectId() for _ in range(n_centres)]
+    start = datetime(2020, 1, 1)
+    documents = []
+    for i in range(n):
+        date = start + timedelta(days=i % 1825)
+        documents.append({
+            '_id': ObjectId(),
+            'date': date,
+            'annee': date.year,
+            'trimester': (date.month - 1) // 3 + 1,
+            'montant': round(10 + (i * 37.3) % 5000, 2),
+            'description': 'Fournitures de bureau',
+            'centre_id': centre_ids[i % n_centres],
+            'created_by': 'admin',
+        })
+    return documents
+
+
+def best_of(repeat, fn, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, nargs='+', default=[100_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'documents':>10} {'format':>9} {'time':>8} {'docs/s':>11} {'MB':>7} {'speedup':>8}")
+    for n in args.documents:
+        documents = make_documents(n)
+        extended, t_extended = best_of(args.repeat, dumps_extended, documents)
+        compact, t_compact = best_of(args.repeat, dumps_compact, documents)
+        for name, body, elapsed in (('extended', extended, t_extended), ('compact', compact, t_compact)):
+            print(f"{n:>10} {name:>9} {elapsed:>7.3f}s {n / elapsed:>11,.0f} {len(body) / 1e6:>7.1f} "
+                  f"{t_extended / elapsed:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
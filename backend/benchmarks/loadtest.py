@@ -0,0 +1,264 @@
+"""Load test of the main API routes on synthetic data.
+
+Seeds a database with benchmarks/seed.py (a local MongoDB, or an in-memory mongomock
+with --mongomock), then sends each scenario's requests through the Flask test client
+from concurrent threads. Reports p50/p95/p99 latency, throughput and the peak RSS of
+each scenario (sampled while it runs, Linux only), then the peak of the whole process:
+
+    python benchmarks/loadtest.py --mongomock --depenses 10000
+    python benchmarks/loadtest.py --mongo-uri mongodb://localhost:27017/pme_loadtest --reset \\
+        --depenses 1000000 --concurrency 8 --output results.json
+    python benchmarks/loadtest.py ... --baseline results.json --tolerance 0.25
+
+With --baseline, the run fails (exit code 1) when the p95 of a scenario is more than
+--tolerance above the baseline's, e.g. to gate a deploy on export_budgets or
+get_prediction regressions. mongomock is much slower than MongoDB and not
+thread-safe under heavy load: compare runs on the same backend only.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import seed as seeding  # noqa: E402
+
+DEFAULT_MONGO_URI = 'mongodb://localhost:27017/pme_loadtest'
+
+
+# Each scenario returns (method, url, request kwargs) from a random generator and the
+# seeded context: {'centre_ids': [...], 'years': n}
+def login_request(rng, context):
+    username, password, _ = seeding.ASSISTANT_USER
+    return 'POST', '/api/login', {'json': {'username': username, 'password': password}}
+
+def list_request(rng, context):
+    return 'GET', '/depenses?limit=100', {}
+
+def list_centre_request(rng, context):
+    return 'GET', f"/depenses?limit=100&centre_id={rng.choice(context['centre_ids'])}", {}
+
+def analytics_request(rng, context):
+    return 'GET', '/api/analytics', {}
+
+def prediction_request(rng, context):
+    annee = seeding.FIRST_YEAR + context['years']
+    return 'GET', f"/api/predictions?centre_id={rng.choice(context['centre_ids'])}&annee={annee}&trimester={rng.randint(1, 4)}", {}
+
+def export_request(rng, context):
+    return 'GET', '/api/export/budgets', {}
+
+def export_stream_request(rng, context):
+    return 'GET', '/api/export/budgets?stream=1', {}
+
+def export_consolidated_request(rng, context):
+    return 'GET', '/api/export/budgets?sheets=variance,consolidated,centres', {}
+
+SCENARIOS = {
+    'login': login_request,
+    'list_depenses': list_request,
+    'list_depenses_centre': list_centre_request,
+    'analytics': analytics_request,
+    'prediction': prediction_request,
+    'export': export_request,
+    'export_stream': export_stream_request,
+    'export_consolidated': export_consolidated_request,
+}
+# Scenarios slow enough to run with --slow-requests instead of --requests
+SLOW_SCENARIOS = {'export', 'export_stream', 'export_consolidated'}
+
+
+def use_mongomock():
+    import flask_pymongo
+    import mongomock
+
+    client = mongomock.MongoClient()
+
+    def init_app(self, app, uri=None, *args, **kwargs):
+        self.cx = client
+        self.db = client.get_database('pme_loadtest')
+    flask_pymongo.PyMongo.init_app = init_app
+
+
+# Highest RSS since the process started, seeding and earlier scenarios included
+def process_peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+# Current RSS, from /proc (None where it doesn't exist)
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+class RSSSampler:
+    # Highest current_rss_mb() seen between __enter__ and __exit__, sampled every
+    # interval seconds from a background thread
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def run_scenario(app, make_request, context, headers, n_requests, concurrency, seed):
+    local = threading.local()
+
+    def send(i):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        method, url, kwargs = make_request(random.Random(seed + i), context)
+        start = time.perf_counter()
+        response = local.client.open(url, method=method, headers=headers, **kwargs)
+        response.get_data()
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with RSSSampler() as rss, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, range(n_requests)))
+    wall = time.perf_counter() - start
+
+    latencies = np.array([r[0] for r in results]) * 1000
+    return {
+        'requests': n_requests,
+        'errors': sum(1 for _, status in results if status >= 400),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_ms': float(latencies.mean()),
+        'throughput_rps': n_requests / wall,
+        'peak_rss_mb': rss.peak,
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous and result['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']:.1f} ms, baseline {previous['p95_ms']:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument('--mongo-uri', default=os.getenv('LOADTEST_MONGO_URI', DEFAULT_MONGO_URI))
+    backend.add_argument('--mongomock', action='store_true', help='Use an in-memory mongomock database.')
+    parser.add_argument('--reset', action='store_true', help='Drop the MongoDB database before seeding.')
+    parser.add_argument('--no-seed', action='store_true', help='Reuse the data of a previous run.')
+    seeding.add_arguments(parser)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+    parser.add_argument('--slow-requests', type=int, default=10, help=f"Requests for {', '.join(sorted(SLOW_SCENARIOS))}.")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--output', help='Write the results as JSON to this file ("-" for stdout).')
+    parser.add_argument('--baseline', help='Results of a previous run to compare the p95 latencies with.')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.mongomock:
+        use_mongomock()
+    else:
+        os.environ['MONGO_URI'] = args.mongo_uri
+    # Every request comes from the same address, measure the logins rather than their limit
+    os.environ.setdefault('LOGIN_MAX_ATTEMPTS_PER_IP', '0')
+    # Otherwise the first logins would rehash the seeded passwords to the app's cost
+    os.environ.setdefault('BCRYPT_ROUNDS', str(args.bcrypt_rounds))
+    import app as api
+
+    db = api.mongo.db
+    seeded = None
+    if not args.no_seed:
+        if args.reset and not args.mongomock:
+            api.mongo.cx.drop_database(db.name)
+        elif db.depenses.estimated_document_count():
+            parser.error(f"Database '{db.name}' is not empty, use --reset or --no-seed")
+        if args.mongomock:
+            # mongomock checks unique indexes by scanning, which makes inserts quadratic
+            for name in db.list_collection_names():
+                db[name].drop_indexes()
+        seeded = seeding.seed(db, args.centres, args.depenses, args.years, args.seed,
+                              bcrypt_rounds=args.bcrypt_rounds, indexes=not args.mongomock)
+        print(f"Seeded {seeded}", file=sys.stderr)
+
+    context = {
+        'centre_ids': [str(c['_id']) for c in db.centres.find({}, {'_id': 1})],
+        'years': args.years,
+    }
+    client = api.app.test_client()
+    username, password, _ = seeding.ADMIN_USER
+    token = client.post('/api/login', json={'username': username, 'password': password}).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    results = {}
+    print(f"{'scenario':<22} {'requests':>8} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'RSS MB':>8}", file=sys.stderr)
+    for name in args.scenarios:
+        n_requests = args.slow_requests if name in SLOW_SCENARIOS else args.requests
+        result = run_scenario(api.app, SCENARIOS[name], context, headers, n_requests, args.concurrency, args.seed)
+        results[name] = result
+        print(f"{name:<22} {result['requests']:>8} {result['errors']:>6} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+              f"{result['p99_ms']:>9.1f} {result['throughput_rps']:>8.1f} "
+              f"{'-' if result['peak_rss_mb'] is None else format(result['peak_rss_mb'], '.0f'):>8}", file=sys.stderr)
+    process_peak = process_peak_rss_mb()
+    print(f"Process peak RSS: {process_peak:.0f} MB", file=sys.stderr)
+
+    report = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'seed': seeded,
+        'scenarios': results,
+        'process_peak_rss_mb': process_peak,
+    }
+    if args.mongomock:
+        report['config']['mongo_uri'] = None
+    if args.output == '-':
+        print(json.dumps(report, indent=2))
+    elif args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Synthetic data for the load tests.
+
+Fills a database with centres, their quarterly budgets, depenses spread over the
+years, the matching depense_rollups and two users. The same --seed gives the same data:
+
+    python benchmarks/seed.py --mongo-uri mongodb://localhost:27017/pme_loadtest --reset --depenses 1000000
+
+Only use it on a dedicated database: --reset drops it first.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import bcrypt
+import numpy as np
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from indexes import ensure_indexes  # noqa: E402
+
+FIRST_YEAR = 2020
+DESCRIPTIONS = ['Fournitures', 'Déplacement', 'Maintenance', 'Licences', 'Formation', 'Sous-traitance']
+
+ADMIN_USER = ('loadtest-admin', 'loadtest', 'admin')
+ASSISTANT_USER = ('loadtest-user', 'loadtest', 'assistant')
+
+
+def make_centres(n_centres):
+    # Finance and IT are the centres detailed by the export
+    names = ['Finance', 'IT'] + [f'Centre {i}' for i in range(2, n_centres)]
+    return [{'_id': ObjectId(), 'nom': name, 'responsable': f'Responsable {i}'}
+            for i, name in enumerate(names[:n_centres])]
+
+
+def make_budgets(centre_ids, years, rng):
+    return [
+        {'centre_id': centre_id, 'annee': FIRST_YEAR + y, 'trimester': t, 'montant': float(round(rng.uniform(10_000, 500_000), 2))}
+        for centre_id in centre_ids for y in range(years) for t in range(1, 5)
+    ]
+
+
+# Yield the depenses in chunks, each with the period keys used by the rollups
+def make_depenses(centre_ids, n_depenses, years, rng, chunk_size):
+    start = datetime(FIRST_YEAR, 1, 1)
+    n_days = (datetime(FIRST_YEAR + years, 1, 1) - start).days
+    for offset in range(0, n_depenses, chunk_size):
+        n = min(chunk_size, n_depenses - offset)
+        centres = rng.integers(0, len(centre_ids), n)
+        days = rng.integers(0, n_days, n)
+        montants = rng.lognormal(7, 1, n).round(2)
+        descriptions = rng.integers(0, len(DESCRIPTIONS), n)
+        documents = []
+        for c, d, montant, k in zip(centres, days, montants, descriptions):
+            date = start + timedelta(days=int(d))
+            documents.append({
+                'date': date,
+                'annee': date.year,
+                'trimester': (date.month - 1) // 3 + 1,
+                'montant': float(montant),
+                'description': DESCRIPTIONS[k],
+                'centre_id': centre_ids[c],
+                'created_by': ASSISTANT_USER[0],
+            })
+        yield documents
+
+
+def seed(db, n_centres=50, n_depenses=100_000, years=5, seed=0, chunk_size=10_000, bcrypt_rounds=12, indexes=True):
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    if indexes:
+        ensure_indexes(db)
+
+    for username, password, role in (ADMIN_USER, ASSISTANT_USER):
+        db.users.update_one(
+            {'username': username},
+            {'$set': {'password': bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(bcrypt_rounds)), 'role': role}},
+            upsert=True
+        )
+
+    centres = make_centres(n_centres)
+    db.centres.insert_many(centres)
+    centre_ids = [c['_id'] for c in centres]
+    budgets = make_budgets(centre_ids, years, rng)
+    db.budgets.insert_many(budgets)
+
+    rollups = {}
+    for documents in make_depenses(centre_ids, n_depenses, years, rng, chunk_size):
+        db.depenses.insert_many(documents, ordered=False)
+        for d in documents:
+            bucket = rollups.setdefault((d['centre_id'], d['annee'], d['trimester']), [0.0, 0])
+            bucket[0] += d['montant']
+            bucket[1] += 1
+    if rollups:
+        db.depense_rollups.insert_many([
+            {'centre_id': c, 'annee': a, 'trimester': t, 'total': total, 'count': count}
+            for (c, a, t), (total, count) in rollups.items()
+        ])
+
+    for name in ('centres', 'budgets', 'depenses', 'rollups'):
+        db.data_versions.update_one({'_id': name}, {'$inc': {'version': 1}}, upsert=True)
+
+    return {
+        'centres': len(centres),
+        'budgets': len(budgets),
+        'depenses': n_depenses,
+        'rollups': len(rollups),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument('--centres', type=int, default=50)
+    parser.add_argument('--depenses', type=int, default=100_000)
+    parser.add_argument('--years', type=int, default=5, help=f'Years of budgets and depenses from {FIRST_YEAR}.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bcrypt-rounds', type=int, default=12, help='Cost of the seeded passwords (12 is the bcrypt default used by the API).')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('LOADTEST_MONGO_URI', 'mongodb://localhost:27017/pme_loadtest'))
+    parser.add_argument('--reset', action='store_true', help='Drop the database before seeding.')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_uri)
+    db = client.get_default_database()
+    if args.reset:
+        client.drop_database(db.name)
+    elif db.depenses.estimated_document_count():
+        parser.error(f"Database '{db.name}' is not empty, use --reset to replace its data")
+    counts = seed(db, args.centres, args.depenses, args.years, args.seed, bcrypt_rounds=args.bcrypt_rounds)
+    print(counts)
+
+
+if __name__ == '__main__':
+    main()
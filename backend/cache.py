@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Small in-process caches. Each worker process has its own copy, so entries must either
+# expire (TTLCache) or be validated against a shared version.
+
+_MISSING = object()
+
+
+class TTLCache:
+    # Bounded LRU mapping whose entries expire ttl seconds after they were stored.
+    # Keeps hit/miss counters for the metrics endpoints.
+
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[1] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    # Return the cached value, or compute, store and return it
+    def get_or_load(self, key, load):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = load()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl
+        }
+
+
+class ReferenceCache:
+    # Whole collections (or values computed from them) kept with the data versions they
+    # were read at. A read compares them with the current versions, which are fetched
+    # with load_versions(names) when they were last read more than check_interval seconds
+    # ago, per collection, so a write made by another worker is seen within
+    # check_interval. When a change stream pushes the
+    # versions (set_version), they are trusted without polling.
+    #
+    # Values of more than max_documents documents are not kept, which bounds the memory.
+
+    def __init__(self, load_versions, check_interval=1.0, max_documents=50_000):
+        self.load_versions = load_versions
+        self.check_interval = check_interval
+        self.max_documents = max_documents
+        self.hits = 0
+        self.misses = 0
+        self.pushed = False
+        self._entries = {}
+        self._sizes = {}
+        self._versions = {}
+        # When the version of each collection was last read
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def _current_versions(self, names):
+        with self._lock:
+            now = time.monotonic()
+            fresh = all(
+                name in self._versions and (self.pushed or now - self._checked.get(name, 0.0) < self.check_interval)
+                for name in names
+            )
+            if fresh:
+                return tuple(self._versions[name] for name in names)
+        versions = self.load_versions(*names)
+        self.update_versions(versions)
+        return tuple(versions[name] for name in names)
+
+    # Return the cached value of key, or load, store and return it. depends_on lists the
+    # collections the value is read from (key itself by default).
+    def get(self, key, load, depends_on=None, size=len):
+        version = self._current_versions(depends_on or (key,))
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = load()
+        documents = size(value)
+        with self._lock:
+            if documents <= self.max_documents:
+                self._entries[key] = (version, value)
+                self._sizes[key] = documents
+            else:
+                self._entries.pop(key, None)
+                self._sizes.pop(key, None)
+        return value
+
+    # A collection was written: forget its version so the next read fetches it
+    def invalidate(self, name):
+        with self._lock:
+            self._versions.pop(name, None)
+            self._checked.pop(name, None)
+
+    def set_version(self, name, version):
+        with self._lock:
+            self._versions[name] = version
+            self._checked[name] = time.monotonic()
+
+    # Versions read elsewhere are as good as polled ones
+    def update_versions(self, versions):
+        with self._lock:
+            self._versions.update(versions)
+            now = time.monotonic()
+            for name in versions:
+                self._checked[name] = now
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._versions.clear()
+            self._checked.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "documents": sum(self._sizes.values()),
+            "max_documents": self.max_documents,
+            "check_interval": self.check_interval,
+            "change_stream": self.pushed
+        }
@@ -0,0 +1,253 @@
+import time
+import warnings
+
+import numpy as np
+
+# Quarterly forecasting models for the prediction endpoints.
+# A series is a set of quarterly totals identified by their period index
+# (annee * 4 + trimester - 1). Every model has fit(periods, y) / predict(periods)
+# for a single centre, and backtest_forecasts(periods, Y, observed) which computes the
+# one-step-ahead forecast at every origin for many centres at once:
+#   periods  (T,)   contiguous period indices of the grid
+#   Y        (B, T) totals per centre, 0 where the centre has no depense
+#   observed (B, T) True where the centre has a rollup for that quarter
+# and returns a (B, T) array of forecasts made with the data strictly before each
+# quarter (NaN where the model had too little history).
+
+SEASON_LENGTH = 4
+
+def period_index(annee, trimester):
+    return np.asarray(annee) * 4 + np.asarray(trimester) - 1
+
+# Same time feature as the original model (annee + trimester / 4), shifted to keep
+# the normal equations well conditioned
+def time_feature(periods):
+    return (np.asarray(periods, dtype=float) + 1) / 4.0 - 2000
+
+# R2 of fitted values (same convention as sklearn's r2_score)
+def r2_score(y, fitted):
+    mask = ~np.isnan(fitted)
+    y, fitted = y[mask], fitted[mask]
+    if len(y) == 0:
+        return 0.0
+    ss_res = float(np.sum((y - fitted) ** 2))
+    ss_tot = float(np.sum((y - y.mean()) ** 2))
+    if ss_tot:
+        return 1 - ss_res / ss_tot
+    return 1.0 if np.isclose(ss_res, 0) else 0.0
+
+
+class LeastSquaresModel:
+    # Models that are linear in their features, fitted by ordinary least squares
+    min_periods = 2
+
+    def features(self, periods):
+        raise NotImplementedError
+
+    def fit(self, periods, y):
+        X = self.features(periods)
+        self.coef_ = np.linalg.lstsq(X, y, rcond=None)[0]
+        self.fitted_ = X @ self.coef_
+        return self
+
+    def predict(self, periods):
+        return self.features(periods) @ self.coef_
+
+    # The normal equations of every origin come from cumulative sums over time, so all
+    # origins of all centres are solved in one batched pseudo-inverse
+    def backtest_forecasts(self, periods, Y, observed):
+        Phi = self.features(periods)
+        W = observed.astype(float)
+        G = np.cumsum(W[:, :, None, None] * (Phi[:, :, None] * Phi[:, None, :]), axis=1)
+        c = np.cumsum((W * Y)[:, :, None] * Phi, axis=1)
+        n = np.cumsum(W, axis=1)
+
+        coef = np.einsum('btij,btj->bti', np.linalg.pinv(G[:, :-1], rcond=1e-10), c[:, :-1])
+        forecasts = np.full(Y.shape, np.nan)
+        forecasts[:, 1:] = np.einsum('tk,btk->bt', Phi[1:], coef)
+        forecasts[:, 1:][n[:, :-1] < self.min_periods] = np.nan
+        return forecasts
+
+
+class LinearTrend(LeastSquaresModel):
+    # Straight line through the quarterly totals
+    min_periods = 2
+
+    def features(self, periods):
+        x = time_feature(periods)
+        return np.column_stack([x, np.ones_like(x)])
+
+
+class SeasonalTrend(LeastSquaresModel):
+    # Linear trend plus one dummy per quarter (Q1 is the baseline)
+    min_periods = 5
+
+    def features(self, periods):
+        periods = np.asarray(periods)
+        x = time_feature(periods)
+        quarter = periods % SEASON_LENGTH
+        return np.column_stack([x, np.ones_like(x)] + [(quarter == q).astype(float) for q in (1, 2, 3)])
+
+
+class TheilSen:
+    # Robust trend: median of the pairwise slopes, median residual as intercept
+    min_periods = 3
+
+    def fit(self, periods, y):
+        x = time_feature(periods)
+        i, j = np.triu_indices(len(x), 1)
+        self.slope_ = float(np.median((y[j] - y[i]) / (x[j] - x[i])))
+        self.intercept_ = float(np.median(y - self.slope_ * x))
+        self.fitted_ = self.predict(periods)
+        return self
+
+    def predict(self, periods):
+        return self.slope_ * time_feature(periods) + self.intercept_
+
+    def backtest_forecasts(self, periods, Y, observed):
+        B, T = Y.shape
+        x = time_feature(periods)
+        pairs = observed[:, :, None] & observed[:, None, :] & np.triu(np.ones((T, T), dtype=bool), 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = np.where(pairs, (Y[:, None, :] - Y[:, :, None]) / (x[None, :] - x[:, None]), np.nan)
+        n = np.cumsum(observed, axis=1)
+
+        forecasts = np.full(Y.shape, np.nan)
+        with warnings.catch_warnings():
+            # Centres without history at an origin give all-NaN slices
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for t in range(1, T):
+                slope = np.nanmedian(slopes[:, :t, :t].reshape(B, -1), axis=1)
+                residuals = np.where(observed[:, :t], Y[:, :t] - slope[:, None] * x[:t], np.nan)
+                forecasts[:, t] = slope * x[t] + np.nanmedian(residuals, axis=1)
+        forecasts[:, 1:][n[:, :-1] < self.min_periods] = np.nan
+        return forecasts
+
+
+class HoltWinters:
+    # Additive Holt-Winters with a 4-quarter season. The first season initialises the
+    # level and seasonal terms; quarters without depenses inside the series count as 0.
+    min_periods = SEASON_LENGTH + 1
+
+    def __init__(self, alpha=0.4, beta=0.1, gamma=0.3):
+        self.alpha, self.beta, self.gamma = alpha, beta, gamma
+
+    # Run the smoothing over series aligned at index 0 (NaN after their end), vectorized
+    # over the rows. Returns the one-step-ahead forecasts and the final state.
+    def _smooth(self, A):
+        B, L = A.shape
+        forecasts = np.full(A.shape, np.nan)
+        if L < SEASON_LENGTH:
+            return forecasts, None
+        level = A[:, :SEASON_LENGTH].mean(axis=1)
+        trend = np.zeros(B)
+        season = A[:, :SEASON_LENGTH] - level[:, None]
+
+        for t in range(SEASON_LENGTH, L):
+            s = season[:, t % SEASON_LENGTH]
+            forecasts[:, t] = level + trend + s
+            y = A[:, t]
+            active = ~np.isnan(y)
+            new_level = self.alpha * (y - s) + (1 - self.alpha) * (level + trend)
+            new_trend = self.beta * (new_level - level) + (1 - self.beta) * trend
+            new_season = self.gamma * (y - new_level) + (1 - self.gamma) * s
+            level = np.where(active, new_level, level)
+            trend = np.where(active, new_trend, trend)
+            season[:, t % SEASON_LENGTH] = np.where(active, new_season, s)
+        return forecasts, (level, trend, season)
+
+    def fit(self, periods, y):
+        periods = np.asarray(periods)
+        self.first_period_ = int(periods.min())
+        length = int(periods.max()) - self.first_period_ + 1
+        series = np.zeros(length)
+        series[periods - self.first_period_] = y
+        smoothed, state = self._smooth(series[None, :])
+        self.length_ = length
+        self.state_ = state
+        self.fitted_ = smoothed[0][periods - self.first_period_]
+        self.in_sample_ = smoothed[0]
+        return self
+
+    def predict(self, periods):
+        offsets = np.asarray(periods) - self.first_period_
+        if self.state_ is None:
+            return np.zeros(len(offsets))
+        level, trend, season = (v[0] for v in self.state_)
+        horizon = offsets - (self.length_ - 1)
+        future = level + horizon * trend + season[offsets % SEASON_LENGTH]
+        # Quarters inside the history get the one-step-ahead forecast made at that time
+        past = self.in_sample_[np.clip(offsets, 0, self.length_ - 1)]
+        return np.where(horizon >= 1, future, np.nan_to_num(past, nan=level))
+
+    def backtest_forecasts(self, periods, Y, observed):
+        B, T = Y.shape
+        has_data = observed.any(axis=1)
+        first = np.argmax(observed, axis=1)
+        last = T - 1 - np.argmax(observed[:, ::-1], axis=1)
+
+        # Left-align every series on its first observed quarter
+        index = first[:, None] + np.arange(T)[None, :]
+        valid = (index <= last[:, None]) & has_data[:, None]
+        aligned = np.where(valid, np.take_along_axis(Y, np.clip(index, 0, T - 1), axis=1), np.nan)
+        smoothed, _ = self._smooth(aligned)
+
+        forecasts = np.full(Y.shape, np.nan)
+        rows, cols = np.nonzero(valid)
+        forecasts[rows, index[rows, cols]] = smoothed[rows, cols]
+        return forecasts
+
+
+MODELS = {
+    'linear': LinearTrend,
+    'seasonal': SeasonalTrend,
+    'holt_winters': HoltWinters,
+    'robust': TheilSen,
+}
+
+def make_model(name):
+    return MODELS[name]()
+
+# Lay out rollup documents (centre_id, annee, trimester, total) on a common quarterly grid
+def quarterly_matrix(rollups):
+    if not rollups:
+        return [], np.arange(0), np.zeros((0, 0)), np.zeros((0, 0), dtype=bool)
+    centre_ids = sorted({str(r['centre_id']) for r in rollups})
+    row = {c: i for i, c in enumerate(centre_ids)}
+    p = np.array([period_index(r['annee'], r['trimester']) for r in rollups])
+    periods = np.arange(p.min(), p.max() + 1)
+
+    Y = np.zeros((len(centre_ids), len(periods)))
+    observed = np.zeros(Y.shape, dtype=bool)
+    rows = np.array([row[str(r['centre_id'])] for r in rollups])
+    Y[rows, p - periods[0]] = [r['total'] for r in rollups]
+    observed[rows, p - periods[0]] = True
+    return centre_ids, periods, Y, observed
+
+# Rolling-origin evaluation: every observed quarter with enough history before it is
+# forecast from that history only. Errors are reported overall and per centre.
+def rolling_origin_backtest(model, periods, Y, observed):
+    start = time.perf_counter()
+    forecasts = model.backtest_forecasts(periods, Y, observed)
+    elapsed = time.perf_counter() - start
+
+    mask = observed & ~np.isnan(forecasts)
+    errors = np.where(mask, np.abs(forecasts - Y), np.nan)
+    nonzero = mask & (Y != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_errors = np.where(nonzero, np.abs((forecasts - Y) / Y) * 100, np.nan)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        per_centre_mae = np.nanmean(errors, axis=1)
+        per_centre_mape = np.nanmean(pct_errors, axis=1)
+
+    return {
+        'mae': float(np.nanmean(errors)) if mask.any() else None,
+        'mape': float(np.nanmean(pct_errors)) if nonzero.any() else None,
+        'forecasts': int(mask.sum()),
+        'fit_time_ms': elapsed * 1000,
+        'per_centre_mae': per_centre_mae,
+        'per_centre_mape': per_centre_mape,
+        'per_centre_forecasts': mask.sum(axis=1),
+    }
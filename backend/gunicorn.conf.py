@@ -0,0 +1,40 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+
+# gunicorn settings, read from the environment:
+#
+#   GUNICORN_BIND              address to listen on (0.0.0.0:8000)
+#   WEB_CONCURRENCY            worker processes (2 per CPU + 1)
+#   GUNICORN_THREADS           threads per worker (4). Requests mostly wait on MongoDB,
+#                              keep MONGO_MAX_POOL_SIZE above this
+#   GUNICORN_TIMEOUT           seconds before a silent worker is restarted (120, exports
+#                              of large histories take a while)
+#   GUNICORN_MAX_REQUESTS      requests before a worker is recycled (1000, 0 disables),
+#                              bounds memory kept by pandas and the in-process caches
+#   GUNICORN_PRELOAD           1 to import the app once in the master before forking
+#   GUNICORN_INIT_DB           0 to skip `flask --app app init-db` at startup
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+preload_app = os.getenv('GUNICORN_PRELOAD') == '1'
+accesslog = '-'
+
+
+# Startup side effects run once for the whole server, in a separate process so the
+# master does not hold a MongoDB connection when it forks the workers
+def on_starting(server):
+    if os.getenv('GUNICORN_INIT_DB', '1') == '1':
+        subprocess.run(
+            [sys.executable, '-m', 'flask', '--app', 'app', 'init-db'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True
+        )
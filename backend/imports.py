@@ -0,0 +1,144 @@
+import itertools
+import os
+import zipfile
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+# Parsing and validation of the bulk imports. Files are read as batches of DataFrames
+# and each batch is validated with vectorized checks: valid rows come back typed and
+# ready to be written, invalid ones as a report keyed by their 1-based row in the file.
+
+IMPORT_FORMATS = ('csv', 'ndjson', 'xlsx')
+
+FORMAT_BY_EXTENSION = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.xlsx': 'xlsx'}
+FORMAT_BY_MIMETYPE = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'xlsx',
+}
+
+def detect_format(filename, mimetype):
+    if filename:
+        extension = os.path.splitext(filename)[1].lower()
+        if extension in FORMAT_BY_EXTENSION:
+            return FORMAT_BY_EXTENSION[extension]
+    return FORMAT_BY_MIMETYPE.get(mimetype)
+
+def _xlsx_batches(stream, batch_size):
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = [str(c).strip() if c is not None else '' for c in next(rows, ())]
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        wb.close()
+
+# Yield the rows of the file as DataFrames of at most batch_size rows, indexed by their
+# row number. Blank lines are dropped without shifting the numbering. Unreadable files
+# raise ValueError, possibly after the first batches were yielded.
+def read_batches(stream, fmt, batch_size):
+    try:
+        if fmt == 'csv':
+            reader = pd.read_csv(stream, dtype=str, skipinitialspace=True, chunksize=batch_size)
+        elif fmt == 'ndjson':
+            reader = pd.read_json(stream, lines=True, dtype=False, convert_dates=False, chunksize=batch_size)
+        else:
+            reader = _xlsx_batches(stream, batch_size)
+
+        first_row = 1
+        for frame in reader:
+            frame.columns = [str(c).strip() for c in frame.columns]
+            frame.index = pd.RangeIndex(first_row, first_row + len(frame))
+            first_row += len(frame)
+            yield frame.dropna(how='all')
+    except pd.errors.EmptyDataError:
+        return
+    except (ValueError, zipfile.BadZipFile, InvalidFileException) as e:
+        raise ValueError(f"Could not read the {fmt} file: {e}")
+
+def _column(frame, name):
+    if name in frame:
+        return frame[name]
+    return pd.Series(None, index=frame.index, dtype=object)
+
+def _text(frame, name):
+    return _column(frame, name).astype('string').str.strip().replace('', pd.NA)
+
+def _number(frame, name):
+    return pd.to_numeric(_column(frame, name), errors='coerce')
+
+# Combine (message, failed mask) checks into the valid mask and the per-row report
+def _report(checks):
+    failed = pd.DataFrame({message: mask.fillna(True).astype(bool) for message, mask in checks})
+    invalid = failed.any(axis=1)
+    messages = failed.columns.to_numpy()
+    report = [
+        {"row": int(row), "errors": list(messages[flags])}
+        for row, flags in zip(failed.index[invalid], failed[invalid].to_numpy())
+    ]
+    return ~invalid, report
+
+def _external_id_checks(external_id, upsert):
+    checks = [("Duplicate 'external_id' in file", external_id.notna() & external_id.duplicated(keep=False))]
+    if upsert:
+        checks.append(("Missing 'external_id' (required in upsert mode)", external_id.isna()))
+    return checks
+
+# Depense rows: date, montant, description, centre_id and an optional external_id.
+# Dates are stored like parse_depense_date does: midnight UTC with annee and trimester.
+def validate_depenses(frame, centre_ids, upsert=False):
+    dates = pd.to_datetime(_text(frame, 'date'), errors='coerce', utc=True, format='ISO8601')
+    dates = dates.dt.tz_convert(None).dt.normalize()
+    montant = _number(frame, 'montant')
+    description = _text(frame, 'description')
+    centre_id = _text(frame, 'centre_id')
+    external_id = _text(frame, 'external_id')
+
+    valid, report = _report([
+        ("Invalid or missing 'date', expected YYYY-MM-DD", dates.isna()),
+        ("Invalid or missing 'montant'", montant.isna() | (montant == 0)),
+        ("Missing 'description'", description.isna()),
+        ("Unknown 'centre_id'", ~centre_id.isin(centre_ids)),
+    ] + _external_id_checks(external_id, upsert))
+
+    rows = pd.DataFrame({
+        'date': dates,
+        'annee': dates.dt.year,
+        'trimester': (dates.dt.month - 1) // 3 + 1,
+        'montant': montant.astype(float),
+        'description': description,
+        'centre_id': centre_id,
+        'external_id': external_id,
+    })[valid]
+    return rows.astype({'annee': int, 'trimester': int}), report
+
+# Budget rows: centre_id, annee, trimester, montant and an optional external_id
+def validate_budgets(frame, centre_ids, upsert=False):
+    centre_id = _text(frame, 'centre_id')
+    annee = _number(frame, 'annee')
+    trimester = _number(frame, 'trimester')
+    montant = _number(frame, 'montant')
+    external_id = _text(frame, 'external_id')
+
+    valid, report = _report([
+        ("Unknown 'centre_id'", ~centre_id.isin(centre_ids)),
+        ("Invalid or missing 'annee'", annee.isna() | (annee % 1 != 0) | (annee <= 0)),
+        ("'trimester' must be between 1 and 4", ~trimester.isin([1, 2, 3, 4])),
+        ("Invalid or missing 'montant'", montant.isna() | (montant == 0)),
+    ] + _external_id_checks(external_id, upsert))
+
+    rows = pd.DataFrame({
+        'centre_id': centre_id,
+        'annee': annee,
+        'trimester': trimester,
+        'montant': montant.astype(float),
+        'external_id': external_id,
+    })[valid]
+    return rows.astype({'annee': int, 'trimester': int}), report
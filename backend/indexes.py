@@ -0,0 +1,108 @@
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+# Indexes required by the hot queries of the API, created idempotently at startup.
+# create_index is a no-op when an index with the same keys and options exists.
+
+# Ids given by the bulk imports, unique so re-running an import cannot duplicate records
+EXTERNAL_ID_INDEX = {
+    'unique': True,
+    'name': 'external_id_unique',
+    'partialFilterExpression': {'external_id': {'$exists': True}}
+}
+
+INDEXES = {
+    'users': [
+        ([('username', ASCENDING)], {'unique': True, 'name': 'username_unique'}),
+    ],
+    'depenses': [
+        ([('date', DESCENDING), ('_id', DESCENDING)], {'name': 'date_id'}),
+        ([('centre_id', ASCENDING), ('date', DESCENDING)], {'name': 'centre_date'}),
+        ([('created_by', ASCENDING), ('date', DESCENDING)], {'name': 'created_by_date'}),
+        ([('annee', ASCENDING), ('trimester', ASCENDING)], {'name': 'period'}),
+        ([('centre_id', ASCENDING), ('annee', ASCENDING), ('trimester', ASCENDING)], {'name': 'centre_period'}),
+        ([('external_id', ASCENDING)], EXTERNAL_ID_INDEX),
+    ],
+    'budgets': [
+        ([('centre_id', ASCENDING), ('annee', ASCENDING), ('trimester', ASCENDING)], {'name': 'centre_period'}),
+        ([('external_id', ASCENDING)], EXTERNAL_ID_INDEX),
+    ],
+    'depense_rollups': [
+        ([('centre_id', ASCENDING), ('annee', ASCENDING), ('trimester', ASCENDING)], {'unique': True, 'name': 'centre_period_unique'}),
+    ],
+    'export_jobs': [
+        ([('fingerprint', ASCENDING), ('status', ASCENDING)], {'name': 'fingerprint_status'}),
+    ],
+    'budget_status': [
+        ([('centre_id', ASCENDING), ('annee', ASCENDING), ('trimester', ASCENDING)], {'unique': True, 'name': 'centre_period_unique'}),
+        ([('level', ASCENDING)], {'name': 'level'}),
+    ],
+    'budget_alerts': [
+        ([('centre_id', ASCENDING), ('created_at', DESCENDING)], {'name': 'centre_created_at'}),
+        ([('created_at', DESCENDING)], {'name': 'created_at'}),
+    ],
+    # Login rate limit windows, removed by MongoDB once expired
+    'login_attempts': [
+        ([('expires_at', ASCENDING)], {'expireAfterSeconds': 0, 'name': 'expires_at_ttl'}),
+    ],
+}
+
+# (name, collection, filter, sort) of the queries run on every request or report.
+# The values are placeholders: only the shape of the query matters to the planner.
+HOT_QUERIES = [
+    ('login / role check', 'users', {'username': ''}, None),
+    ('depenses listing', 'depenses', {}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    ('depenses by centre', 'depenses', {'centre_id': ObjectId()}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    ('depenses by author', 'depenses', {'created_by': ''}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    ('depenses of a period', 'depenses', {'annee': 2024, 'trimester': 1}, None),
+    ('depenses of a centre and period', 'depenses', {'centre_id': ObjectId(), 'annee': 2024, 'trimester': 1}, None),
+    ('depenses by date range', 'depenses', {'date': {'$gte': datetime(2024, 1, 1), '$lte': datetime(2024, 12, 31)}}, None),
+    ('import upsert', 'depenses', {'external_id': {'$in': ['']}}, None),
+    ('export detail by centres', 'depenses', {'centre_id': {'$in': [ObjectId()]}, 'date': {'$gte': datetime(2024, 1, 1)}}, [('centre_id', DESCENDING), ('date', ASCENDING)]),
+    ('budget of a period', 'budgets', {'centre_id': ObjectId(), 'annee': 2024, 'trimester': 1}, None),
+    ('rollups of a centre', 'depense_rollups', {'centre_id': ObjectId()}, None),
+    ('rollup bucket', 'depense_rollups', {'centre_id': ObjectId(), 'annee': 2024, 'trimester': 1}, None),
+    ('budget status of a centre', 'budget_status', {'centre_id': ObjectId()}, [('annee', DESCENDING), ('trimester', DESCENDING)]),
+    ('budget alerts of a centre', 'budget_alerts', {'centre_id': ObjectId()}, [('created_at', DESCENDING)]),
+    ('pending export job', 'export_jobs', {'fingerprint': '', 'status': {'$in': ['queued', 'running']}}, None),
+]
+
+# Create the missing indexes. Failures (e.g. duplicate usernames blocking the unique
+# index) are returned instead of raised so the app can still start.
+def ensure_indexes(db):
+    errors = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                errors.append(f"{collection}.{options['name']}: {e}")
+    return errors
+
+def _plan_stages(plan):
+    stages = [plan.get('stage')]
+    for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+        if child:
+            stages += _plan_stages(child)
+    return stages
+
+# Run explain() on every hot query and report the stages of the winning plan
+def explain_hot_queries(db):
+    report = []
+    for name, collection, query, sort in HOT_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()['queryPlanner']['winningPlan']
+        # Servers using the slot-based engine nest the classic plan under 'queryPlan'
+        stages = _plan_stages(winning_plan.get('queryPlan', winning_plan))
+        report.append({
+            'query': name,
+            'collection': collection,
+            'stages': stages,
+            'collscan': 'COLLSCAN' in stages
+        })
+    return report
@@ -0,0 +1,197 @@
+import bisect
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+# In-process metrics rendered in the Prometheus text format at /metrics: request
+# latencies, MongoDB commands (through a pymongo CommandListener) and named timing
+# spans around the pandas / numpy / openpyxl stages. Each worker process keeps its
+# own values, the scraper sums them.
+#
+# Work done while handling a request is also accumulated in a RequestStats bound to
+# the current context, for the Server-Timing header and the ?profile=1 summary.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+METRIC_HELP = {
+    'pme_http_request_duration_seconds': ('histogram', 'Time to handle a request, by route'),
+    'pme_http_request_mongo_seconds': ('histogram', 'Time spent in MongoDB commands per request, by route'),
+    'pme_mongo_command_duration_seconds': ('histogram', 'Duration of MongoDB commands, by command'),
+    'pme_mongo_command_failures_total': ('counter', 'Failed MongoDB commands, by command'),
+    'pme_mongo_documents_returned_total': ('counter', 'Documents returned by MongoDB cursors, by route'),
+    'pme_span_duration_seconds': ('histogram', 'Duration of named processing stages'),
+    'pme_cache_hits': ('gauge', 'Hits of the in-process caches since the worker started'),
+    'pme_cache_misses': ('gauge', 'Misses of the in-process caches since the worker started'),
+    'pme_cache_size': ('gauge', 'Entries in the in-process caches'),
+}
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[name, _label_key(labels)] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[name, _label_key(labels)] = value
+
+    def render(self):
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                _, help_text = METRIC_HELP.get(name, (kind, name))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                header(name, 'counter')
+                lines.append(f"{name}{_labels(labels)} {value:g}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                header(name, 'gauge')
+                lines.append(f"{name}{_labels(labels)} {value:g}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                header(name, 'histogram')
+                cumulative = 0
+                bounds = [f'{bound:g}' for bound in histogram.buckets] + ['+Inf']
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum:g}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+metrics = Metrics()
+
+
+class RequestStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self.mongo_documents = 0
+        self.spans = defaultdict(float)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def summary(self):
+        return {
+            "elapsed_ms": self.elapsed() * 1000,
+            "mongo": {
+                "commands": self.mongo_commands,
+                "time_ms": self.mongo_seconds * 1000,
+                "documents": self.mongo_documents
+            },
+            "spans_ms": {name: seconds * 1000 for name, seconds in self.spans.items()}
+        }
+
+    # Server-Timing header value, shown by the browser devtools
+    def server_timing(self):
+        entries = [f'mongo;dur={self.mongo_seconds * 1000:.1f};desc="{self.mongo_commands} commands, {self.mongo_documents} docs"']
+        entries += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.spans.items()]
+        entries.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(entries)
+
+
+_current_stats = contextvars.ContextVar('request_stats', default=None)
+
+def begin_request():
+    stats = RequestStats()
+    _current_stats.set(stats)
+    return stats
+
+def end_request():
+    stats = _current_stats.get()
+    _current_stats.set(None)
+    return stats
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe('pme_span_duration_seconds', elapsed, span=name)
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.spans[name] += elapsed
+
+
+def _returned_documents(reply):
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', ())))
+    return 0
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    # Listeners are called synchronously in the thread running the command, so the
+    # request context is the one of the request that issued it
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        metrics.observe('pme_mongo_command_duration_seconds', seconds, command=event.command_name)
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.mongo_commands += 1
+            stats.mongo_seconds += seconds
+            stats.mongo_documents += _returned_documents(event.reply)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1e6
+        metrics.observe('pme_mongo_command_duration_seconds', seconds, command=event.command_name)
+        metrics.inc('pme_mongo_command_failures_total', command=event.command_name)
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.mongo_commands += 1
+            stats.mongo_seconds += seconds
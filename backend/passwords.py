@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+# bcrypt hashing off the request threads. Hashes run in a small process pool per worker,
+# so a burst of logins uses at most PASSWORD_WORKERS cores instead of one per request
+# thread, and at most PASSWORD_MAX_PENDING hashes wait for it: past that, callers get
+# PasswordHasherBusy after PASSWORD_QUEUE_TIMEOUT seconds instead of piling up.
+#
+# BCRYPT_ROUNDS is the work factor of new hashes. Hashes of another cost still verify and
+# are replaced at the next successful login (see needs_rehash).
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", 2))
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", PASSWORD_WORKERS * 8 or 1))
+PASSWORD_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_QUEUE_TIMEOUT", 5))
+
+_COST = re.compile(rb'^\$2[abxy]?\$(\d\d)\$')
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+class PasswordHasher:
+    # With workers=0 hashes run inline in the calling thread (development, CLI commands)
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=PASSWORD_WORKERS, max_pending=PASSWORD_MAX_PENDING, queue_timeout=PASSWORD_QUEUE_TIMEOUT):
+        self.rounds = rounds
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        # A pool inherited through fork (gunicorn --preload) belongs to the parent
+        os.register_at_fork(after_in_child=self._forget_executor)
+
+    def _forget_executor(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    # The pool is started on first use, in the process that uses it. forkserver children
+    # start from a clean interpreter rather than a copy of the threaded worker.
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('forkserver')
+                )
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHasherBusy("Too many password hashes waiting")
+        try:
+            return self._pool().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password.encode('utf-8'), self.rounds)
+
+    def check(self, password, hashed):
+        return self._run(_check, password.encode('utf-8'), hashed)
+
+    # True when hashed was made with another work factor than the current one
+    def needs_rehash(self, hashed):
+        match = _COST.match(hashed)
+        return match is None or int(match.group(1)) != self.rounds
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+passwords = PasswordHasher()
@@ -0,0 +1,42 @@
+import itertools
+
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment
+from openpyxl.utils import get_column_letter
+
+# Columns and writer of the XLSX export sheets. Kept free of pandas, which the export
+# doesn't need.
+
+VARIANCE_COLUMNS = ['Centre', 'Trimestre', 'Année', 'Montant Budget', 'Réel', 'Écart', "Taux d'écart", 'Interprétation']
+CONSOLIDATED_COLUMNS = ['Centre', 'Année', 'Montant Budget', 'Réel', 'Écart', "Taux d'écart", 'Interprétation']
+DEPENSES_SUMMARY_COLUMNS = ['Trimestre', 'Centre', 'Nature de dépense', 'Date dépense', 'Réelle (MAD)']
+
+WIDTH_SAMPLE_ROWS = 1000
+
+# Write rows (sequences in the order of columns) to a write-only worksheet. Column widths
+# have to be set before the first row is written, so they are estimated from the first
+# sample_rows rows.
+def write_rows(ws, columns, rows, sample_rows=WIDTH_SAMPLE_ROWS):
+    rows = iter(rows)
+    buffered = list(itertools.islice(rows, sample_rows))
+
+    widths = [len(str(c)) for c in columns]
+    for row in buffered:
+        for i, value in enumerate(row):
+            widths[i] = max(widths[i], len(str(value)))
+    for i, width in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = width + 2
+
+    header = []
+    for column in columns:
+        cell = WriteOnlyCell(ws, value=column)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center')
+        header.append(cell)
+    ws.append(header)
+
+    count = 0
+    for row in itertools.chain(buffered, rows):
+        ws.append(list(row))
+        count += 1
+    return count
@@ -0,0 +1,31 @@
+import orjson
+from bson import json_util
+from bson.objectid import ObjectId
+
+# JSON serializations of the API responses, selected by API version:
+#   1 (default)  bson Extended JSON, what the API has always returned:
+#                {"_id": {"$oid": "..."}, "date": {"$date": "..."}}
+#   2            compact JSON: ObjectIds as plain strings, datetimes as ISO 8601 UTC
+#                strings ("2024-01-10T00:00:00Z"), encoded by orjson (C accelerated)
+
+API_VERSIONS = ('1', '2')
+DEFAULT_API_VERSION = '1'
+
+COMPACT_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_SERIALIZE_NUMPY
+
+def _compact_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps_compact(data):
+    # Cursors and other iterables are materialized, orjson only takes lists
+    if data is not None and not isinstance(data, (dict, list, tuple, str, int, float)):
+        data = list(data)
+    return orjson.dumps(data, default=_compact_default, option=COMPACT_OPTIONS)
+
+def dumps_extended(data):
+    return json_util.dumps(data).encode('utf-8')
+
+def dumps(data, version=DEFAULT_API_VERSION):
+    return dumps_compact(data) if version == '2' else dumps_extended(data)
@@ -0,0 +1,241 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from bson.objectid import ObjectId
+
+# Columnar snapshot of MongoDB collections in Parquet files on local disk, read by the
+# analytics instead of pulling every document through pymongo.
+#
+# Each collection is written in partitions, one directory per value of its partition
+# column (depenses/g1/annee=2024/part-000003.parquet). Refreshes are incremental: only
+# the documents with an _id above the collection's watermark are read, and written as
+# new part files. Edits and deletes don't show in _id, so the caller gives a rewrite
+# counter per collection; when it moved (or the document count below the watermark no
+# longer matches) the collection is written again into a new generation directory.
+#
+# manifest.json lists the files of every collection and is replaced atomically, so
+# readers always get a complete snapshot. Files dropped by a refresh are deleted by the
+# next one, readers of the previous manifest can still open them meanwhile.
+
+MANIFEST = 'manifest.json'
+LOCK_FILE = '.lock'
+
+# Ids are stored as hex strings, dates as midnight UTC like in MongoDB
+SCHEMAS = {
+    'depenses': pa.schema([
+        ('_id', pa.string()),
+        ('centre_id', pa.string()),
+        ('date', pa.timestamp('ms')),
+        ('annee', pa.int32()),
+        ('trimester', pa.int8()),
+        ('montant', pa.float64()),
+        ('description', pa.string()),
+        ('created_by', pa.string()),
+    ]),
+    'budgets': pa.schema([
+        ('_id', pa.string()),
+        ('centre_id', pa.string()),
+        ('annee', pa.int32()),
+        ('trimester', pa.int8()),
+        ('montant', pa.float64()),
+    ]),
+}
+PARTITION_BY = 'annee'
+
+
+class SnapshotBusy(Exception):
+    pass
+
+
+# What a reader got from the manifest: the files of one snapshot, hashable by id so it
+# can be part of cache keys
+class SnapshotView:
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.id = manifest['id']
+        self.taken_at = manifest['taken_at']
+        self.versions = manifest['versions']
+        self.collections = manifest['collections']
+
+    def __eq__(self, other):
+        return isinstance(other, SnapshotView) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def age(self):
+        return time.time() - self.taken_at
+
+    def files(self, name):
+        partitions = self.collections.get(name, {}).get('files', {})
+        return [os.path.join(self.directory, f) for files in partitions.values() for f in files]
+
+    # Memory-mapped read; filters are pushed down to the row group statistics
+    def read(self, name, columns=None, filters=None):
+        schema = SCHEMAS[name]
+        files = self.files(name)
+        if not files:
+            table = schema.empty_table()
+            return table.select(columns) if columns else table
+        return pq.read_table(files, schema=schema, columns=columns, filters=filters or None, memory_map=True)
+
+
+class ParquetSnapshot:
+    def __init__(self, directory, batch_size=100_000, max_parts=16):
+        self.directory = directory
+        self.batch_size = batch_size
+        # Partitions with more part files are compacted into one
+        self.max_parts = max_parts
+        self._view = None
+        self._mtime = None
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def _read_manifest(self):
+        try:
+            with open(self._path(MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    # The current snapshot, None before the first refresh. Parsed again only when the
+    # manifest file changed.
+    def view(self):
+        try:
+            mtime = os.stat(self._path(MANIFEST)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self._mtime:
+            manifest = self._read_manifest()
+            self._view = SnapshotView(self.directory, manifest) if manifest else None
+            self._mtime = mtime
+        return self._view
+
+    @contextmanager
+    def _lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(LOCK_FILE), 'w') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise SnapshotBusy(f"Another snapshot of {self.directory} is running")
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # sources: {name: (collection, to_row, rewrites)} where to_row turns a document into
+    # a dict of the columns of SCHEMAS[name] (None skips it) and rewrites is the counter
+    # of edits and deletes of the collection. Documents newer than lag seconds are left for
+    # the next refresh, since ObjectIds from several clients are only roughly ordered.
+    # versions are the data versions the snapshot is up to date with, or None when some
+    # documents were left out. Returns per-collection stats.
+    def refresh(self, sources, versions, lag=60, full=False):
+        with self._lock():
+            previous = self._read_manifest() or {'collections': {}, 'garbage': []}
+            for path in previous.get('garbage', []):
+                target = self._path(path)
+                if os.path.isdir(target):
+                    shutil.rmtree(target, ignore_errors=True)
+                elif os.path.exists(target):
+                    os.remove(target)
+
+            cutoff = time.time() - lag
+            upper = ObjectId.from_datetime(datetime.fromtimestamp(cutoff, tz=timezone.utc))
+            collections, garbage, stats = {}, [], {}
+            complete = True
+            for name, (collection, to_row, rewrites) in sources.items():
+                state = previous['collections'].get(name)
+                rebuild = full or state is None or state['rewrites'] != rewrites
+                if not rebuild:
+                    state, read = self._append(name, collection, to_row, state, upper)
+                    # Late inserts below the old watermark or unnoticed deletes
+                    rebuild = collection.count_documents({'_id': {'$lt': upper}}) != state['documents']
+                if rebuild:
+                    generation = 1
+                    if previous['collections'].get(name):
+                        generation += previous['collections'][name]['generation']
+                        garbage.append(os.path.join(name, f"g{generation - 1}"))
+                    # Left over by an interrupted refresh
+                    shutil.rmtree(self._path(name, f"g{generation}"), ignore_errors=True)
+                    state = {'generation': generation, 'watermark': None, 'documents': 0, 'rewrites': rewrites,
+                             'next_part': 0, 'files': {}}
+                    state, read = self._append(name, collection, to_row, state, upper)
+                garbage += self._compact(name, state)
+                collections[name] = state
+                stats[name] = {'documents': state['documents'], 'read': read, 'rebuilt': rebuild}
+                if collection.find_one({'_id': {'$gte': upper}}, {'_id': 1}) is not None:
+                    complete = False
+
+            manifest = {
+                'id': uuid.uuid4().hex,
+                'taken_at': cutoff,
+                'versions': versions if complete else None,
+                'collections': collections,
+                'garbage': sorted(set(garbage))
+            }
+            tmp_path = self._path(f"{MANIFEST}.tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self._path(MANIFEST))
+            return stats
+
+    def _write_part(self, name, state, partition, table):
+        directory = os.path.join(name, f"g{state['generation']}", partition)
+        os.makedirs(self._path(directory), exist_ok=True)
+        path = os.path.join(directory, f"part-{state['next_part']:06d}.parquet")
+        state['next_part'] += 1
+        # Sorted so the row group statistics skip the other centres
+        table = table.sort_by([('centre_id', 'ascending')])
+        pq.write_table(table, self._path(path), compression='zstd')
+        state['files'].setdefault(partition, []).append(path)
+
+    # Write the documents between the watermark and upper; returns how many were read
+    def _append(self, name, collection, to_row, state, upper):
+        query = {'_id': {'$lt': upper}}
+        if state['watermark']:
+            query['_id']['$gt'] = ObjectId(state['watermark'])
+        read = 0
+        rows = []
+
+        def flush():
+            table = pa.Table.from_pylist(rows, schema=SCHEMAS[name])
+            for value in table.column(PARTITION_BY).unique().to_pylist():
+                part = table.filter(pc.equal(table[PARTITION_BY], value))
+                self._write_part(name, state, f"{PARTITION_BY}={value}", part)
+            rows.clear()
+
+        for doc in collection.find(query).sort('_id', 1).batch_size(10_000):
+            read += 1
+            state['watermark'] = str(doc['_id'])
+            row = to_row(doc)
+            if row is not None:
+                rows.append(row)
+            if len(rows) == self.batch_size:
+                flush()
+        if rows:
+            flush()
+        state['documents'] += read
+        return state, read
+
+    # Merge the part files of partitions past max_parts; returns the files replaced
+    def _compact(self, name, state):
+        replaced = []
+        for partition, files in list(state['files'].items()):
+            if len(files) <= self.max_parts:
+                continue
+            table = pq.read_table([self._path(f) for f in files], schema=SCHEMAS[name])
+            state['files'][partition] = []
+            self._write_part(name, state, partition, table)
+            replaced += files
+        return replaced
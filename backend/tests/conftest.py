@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The backend modules (app, forecasting, snapshot...) are imported as top-level modules,
+# as gunicorn and the benchmarks do, whichever directory pytest runs from
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
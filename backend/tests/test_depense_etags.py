@@ -0,0 +1,74 @@
+"""Optimistic locking of depenses (If-Match / If-None-Match) through Flask-Compress.
+
+Runs against a MongoDB server, TEST_MONGO_URI (mongodb://localhost:27017/pme_test by
+default), and is skipped when none answers. The database is dropped afterwards.
+"""
+import os
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+TEST_MONGO_URI = os.getenv('TEST_MONGO_URI', 'mongodb://localhost:27017/pme_test')
+
+# Long enough for Flask-Compress, which leaves bodies under 500 bytes alone
+DESCRIPTION = 'Fournitures de bureau ' * 40
+
+
+@pytest.fixture(scope='module')
+def api():
+    try:
+        MongoClient(TEST_MONGO_URI, serverSelectionTimeoutMS=1000).admin.command('ping')
+    except PyMongoError:
+        pytest.skip(f"No MongoDB server at {TEST_MONGO_URI}")
+    os.environ['MONGO_URI'] = TEST_MONGO_URI
+    os.environ['PASSWORD_WORKERS'] = '0'
+    os.environ['BCRYPT_ROUNDS'] = '4'
+    import app as api
+    yield api
+    api.mongo.cx.drop_database(api.mongo.db.name)
+
+
+@pytest.fixture
+def client(api):
+    api.mongo.db.users.delete_many({'username': 'etag-test'})
+    api.mongo.db.users.insert_one({'username': 'etag-test', 'password': api.passwords.hash('etag-test'), 'role': 'assistant'})
+    client = api.app.test_client()
+    token = client.post('/api/login', json={'username': 'etag-test', 'password': 'etag-test'}).get_json()['access_token']
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    client.environ_base['HTTP_ACCEPT_ENCODING'] = 'gzip'
+    return client
+
+
+@pytest.fixture
+def depense(api, client):
+    centre_id = api.mongo.db.centres.insert_one({'nom': 'ETag test'}).inserted_id
+    body = {'date': '2024-02-01', 'montant': 100, 'description': DESCRIPTION, 'centre_id': str(centre_id)}
+    assert client.post('/depenses', json=body).status_code == 201
+    depense = api.mongo.db.depenses.find_one({'centre_id': centre_id})
+    return str(depense['_id']), body
+
+
+def test_compressed_etag_round_trip(client, depense):
+    id, body = depense
+    response = client.get(f'/depenses/{id}')
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    etag = response.headers['ETag']
+    assert etag == '"1:gzip"'
+
+    assert client.get(f'/depenses/{id}', headers={'If-None-Match': etag}).status_code == 304
+
+    response = client.put(f'/depenses/{id}', json={**body, 'montant': 150}, headers={'If-Match': etag})
+    assert response.status_code == 200
+
+    # The version read first is now stale
+    assert client.put(f'/depenses/{id}', json={**body, 'montant': 175}, headers={'If-Match': etag}).status_code == 412
+    assert client.get(f'/depenses/{id}', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_compressed_etag_delete(client, depense):
+    id, _ = depense
+    etag = client.get(f'/depenses/{id}').headers['ETag']
+    assert client.delete(f'/depenses/{id}', headers={'If-Match': '"7:gzip"'}).status_code == 412
+    assert client.delete(f'/depenses/{id}', headers={'If-Match': etag}).status_code == 200
@@ -0,0 +1,130 @@
+"""Forecasting models and their rolling-origin backtest (forecasting.py), without MongoDB.
+
+The batched backtest_forecasts of every model must give, at each origin, what fit on
+the history before it and predict would give.
+"""
+import numpy as np
+import pytest
+from bson.objectid import ObjectId
+
+from forecasting import (
+    MODELS, SEASON_LENGTH, HoltWinters, LinearTrend, make_model, period_index, quarterly_matrix,
+    r2_score, rolling_origin_backtest,
+)
+
+
+def seasonal_series(n_centres, n_periods, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_periods)
+    season = np.array([0.0, 300.0, -200.0, 500.0])
+    trend = rng.uniform(10, 50, (n_centres, 1)) * t
+    return 1000 + trend + season[t % SEASON_LENGTH] + rng.normal(0, 40, (n_centres, n_periods))
+
+
+def reference_forecasts(name, periods, Y, observed):
+    forecasts = np.full(Y.shape, np.nan)
+    for b in range(Y.shape[0]):
+        for t in range(1, Y.shape[1]):
+            history = observed[b, :t]
+            if history.sum() < make_model(name).min_periods:
+                continue
+            model = make_model(name).fit(periods[:t][history], Y[b, :t][history])
+            forecasts[b, t] = model.predict(periods[t:t + 1])[0]
+    return forecasts
+
+
+def test_period_index():
+    assert period_index(2024, 1) == 2024 * 4
+    assert period_index(2024, 4) + 1 == period_index(2025, 1)
+
+
+def test_quarterly_matrix_lays_out_rollups_on_a_common_grid():
+    a, b = ObjectId(), ObjectId()
+    rollups = [
+        {'centre_id': a, 'annee': 2023, 'trimester': 4, 'total': 10.0},
+        {'centre_id': a, 'annee': 2024, 'trimester': 2, 'total': 30.0},
+        {'centre_id': b, 'annee': 2024, 'trimester': 1, 'total': 20.0},
+    ]
+    centre_ids, periods, Y, observed = quarterly_matrix(rollups)
+
+    assert centre_ids == sorted([str(a), str(b)])
+    assert list(periods) == [period_index(2023, 4), period_index(2024, 1), period_index(2024, 2)]
+    row_a = centre_ids.index(str(a))
+    assert list(Y[row_a]) == [10.0, 0.0, 30.0]
+    assert list(observed[row_a]) == [True, False, True]
+    assert list(observed[1 - row_a]) == [False, True, False]
+
+
+def test_quarterly_matrix_without_rollups():
+    centre_ids, periods, Y, observed = quarterly_matrix([])
+    assert centre_ids == [] and len(periods) == 0 and Y.shape == (0, 0)
+
+
+@pytest.mark.parametrize('name', ['linear', 'seasonal', 'robust'])
+def test_backtest_matches_fitting_each_origin(name):
+    Y = seasonal_series(3, 14)
+    observed = np.ones(Y.shape, dtype=bool)
+    # Gaps in the history are left out of the fit
+    observed[0, [2, 7]] = False
+    observed[2, :3] = False
+    Y[~observed] = 0.0
+    periods = np.arange(period_index(2020, 1), period_index(2020, 1) + Y.shape[1])
+
+    forecasts = make_model(name).backtest_forecasts(periods, Y, observed)
+    expected = reference_forecasts(name, periods, Y, observed)
+
+    np.testing.assert_array_equal(np.isnan(forecasts), np.isnan(expected))
+    np.testing.assert_allclose(forecasts, expected, rtol=1e-6, atol=1e-6)
+
+
+def test_holt_winters_backtest_matches_fitting_each_origin():
+    Y = seasonal_series(2, 12, seed=1)
+    observed = np.ones(Y.shape, dtype=bool)
+    periods = np.arange(period_index(2021, 1), period_index(2021, 1) + Y.shape[1])
+
+    forecasts = HoltWinters().backtest_forecasts(periods, Y, observed)
+
+    assert np.isnan(forecasts[:, :SEASON_LENGTH]).all()
+    for b in range(Y.shape[0]):
+        for t in range(SEASON_LENGTH, Y.shape[1]):
+            model = HoltWinters().fit(periods[:t], Y[b, :t])
+            assert forecasts[b, t] == pytest.approx(model.predict(periods[t:t + 1])[0])
+
+
+def test_seasonal_trend_recovers_an_exact_series():
+    periods = np.arange(period_index(2020, 1), period_index(2020, 1) + 12)
+    y = 100.0 + 5 * np.arange(12) + np.array([0.0, 40.0, -10.0, 25.0])[np.arange(12) % 4]
+    model = make_model('seasonal').fit(periods, y)
+
+    assert r2_score(y, model.fitted_) == pytest.approx(1.0)
+    assert model.predict(periods[-1:] + 1)[0] == pytest.approx(100.0 + 5 * 12)
+
+
+def test_rolling_origin_backtest_of_a_straight_line():
+    Y = np.array([[100.0 + 10 * t for t in range(8)], [50.0] * 8])
+    observed = np.ones(Y.shape, dtype=bool)
+    observed[1, 5] = False
+    Y[1, 5] = 0.0
+    periods = np.arange(period_index(2020, 1), period_index(2020, 1) + 8)
+
+    result = rolling_origin_backtest(LinearTrend(), periods, Y, observed)
+
+    assert result['mae'] == pytest.approx(0.0, abs=1e-6)
+    assert result['mape'] == pytest.approx(0.0, abs=1e-6)
+    # Every observed quarter after the first two of each centre is forecast
+    assert list(result['per_centre_forecasts']) == [6, 5]
+    assert result['forecasts'] == 11
+
+
+def test_r2_score_ignores_missing_fits():
+    y = np.array([1.0, 2.0, 3.0, 4.0])
+    assert r2_score(y, np.array([np.nan, 2.0, 3.0, 4.0])) == pytest.approx(1.0)
+    assert r2_score(y, np.full(4, np.nan)) == 0.0
+    # A constant series is perfectly fitted by itself only
+    assert r2_score(np.full(3, 5.0), np.full(3, 5.0)) == 1.0
+    assert r2_score(np.full(3, 5.0), np.array([4.0, 5.0, 6.0])) == 0.0
+
+
+def test_every_model_is_registered():
+    for name, cls in MODELS.items():
+        assert isinstance(make_model(name), cls)
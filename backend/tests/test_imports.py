@@ -0,0 +1,147 @@
+"""Parsing and validation of the bulk imports (imports.py), without MongoDB."""
+import io
+import json
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from imports import detect_format, read_batches, validate_budgets, validate_depenses
+
+CENTRES = ['64b000000000000000000001', '64b000000000000000000002']
+
+
+def frames(data, fmt, batch_size=2):
+    return list(read_batches(io.BytesIO(data), fmt, batch_size))
+
+
+def test_detect_format_prefers_the_extension():
+    assert detect_format('ledger.CSV', 'application/octet-stream') == 'csv'
+    assert detect_format('ledger.jsonl', None) == 'ndjson'
+    assert detect_format(None, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet') == 'xlsx'
+    assert detect_format('ledger.txt', 'text/plain') is None
+
+
+def test_csv_batches_keep_the_file_row_numbers():
+    data = b"date, montant,description\n2024-01-05,10,a\n\n2024-02-05,20,b\n2024-03-05,30,c\n"
+    batches = frames(data, 'csv')
+
+    assert [len(f) for f in batches] == [2, 1]
+    assert list(batches[0].columns) == ['date', 'montant', 'description']
+    # Blank lines are skipped by the CSV reader, rows are numbered from the first record
+    assert list(batches[0].index) == [1, 2]
+    assert batches[1].loc[3, 'description'] == 'c'
+    # Values are kept as text for the validation
+    assert batches[0].loc[1, 'montant'] == '10'
+
+
+def test_ndjson_batches():
+    lines = [{'centre_id': CENTRES[0], 'annee': 2024, 'trimester': t, 'montant': 100} for t in (1, 2, 3)]
+    data = '\n'.join(json.dumps(line) for line in lines).encode()
+    batches = frames(data, 'ndjson')
+
+    assert [list(f.index) for f in batches] == [[1, 2], [3]]
+    assert batches[1].loc[3, 'trimester'] == 3
+
+
+def test_xlsx_batches_drop_blank_rows_without_renumbering():
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['date', 'montant', 'description', 'centre_id'])
+    ws.append(['2024-01-05', 10, 'a', CENTRES[0]])
+    ws.append([None, None, None, None])
+    ws.append(['2024-02-05', 20, 'b', CENTRES[1]])
+    stream = io.BytesIO()
+    wb.save(stream)
+
+    batches = frames(stream.getvalue(), 'xlsx', batch_size=10)
+
+    assert len(batches) == 1
+    assert list(batches[0].index) == [1, 3]
+
+
+def test_unreadable_files_raise_value_error():
+    with pytest.raises(ValueError, match='Could not read the xlsx file'):
+        frames(b'not a zip', 'xlsx')
+    assert frames(b'', 'csv') == []
+
+
+def test_validate_depenses_types_valid_rows_and_reports_the_others():
+    frame = pd.DataFrame({
+        'date': ['2024-02-29', '2024-13-01', '2023-11-30T15:00:00Z', '2024-05-01'],
+        'montant': ['12.5', '10', '0', 'abc'],
+        'description': [' Fournitures ', 'x', 'y', ''],
+        'centre_id': [CENTRES[0], CENTRES[1], 'unknown', CENTRES[0]],
+    }, index=[1, 2, 3, 4])
+
+    rows, report = validate_depenses(frame, CENTRES)
+
+    assert list(rows.index) == [1]
+    row = rows.loc[1]
+    assert row['date'] == pd.Timestamp('2024-02-29')
+    assert (row['annee'], row['trimester'], row['montant']) == (2024, 1, 12.5)
+    assert row['description'] == 'Fournitures'
+    assert report == [
+        {'row': 2, 'errors': ["Invalid or missing 'date', expected YYYY-MM-DD"]},
+        {'row': 3, 'errors': ["Invalid or missing 'montant'", "Unknown 'centre_id'"]},
+        {'row': 4, 'errors': ["Invalid or missing 'montant'", "Missing 'description'"]},
+    ]
+
+
+def test_validate_depenses_dates_are_midnight_utc():
+    frame = pd.DataFrame({'date': ['2024-06-30T23:30:00+02:00'], 'montant': ['5'], 'description': ['x'],
+                          'centre_id': [CENTRES[0]]}, index=[1])
+    rows, report = validate_depenses(frame, CENTRES)
+    assert report == []
+    assert rows.loc[1, 'date'] == pd.Timestamp('2024-06-30')
+    assert rows.loc[1, 'trimester'] == 2
+
+
+def test_external_ids_in_upsert_mode():
+    frame = pd.DataFrame({
+        'centre_id': [CENTRES[0]] * 4,
+        'annee': ['2024'] * 4,
+        'trimester': ['1', '2', '3', '4'],
+        'montant': ['100'] * 4,
+        'external_id': ['b-1', 'b-1', None, 'b-2'],
+    }, index=[1, 2, 3, 4])
+
+    rows, report = validate_budgets(frame, CENTRES, upsert=True)
+
+    assert list(rows['external_id']) == ['b-2']
+    assert report == [
+        {'row': 1, 'errors': ["Duplicate 'external_id' in file"]},
+        {'row': 2, 'errors': ["Duplicate 'external_id' in file"]},
+        {'row': 3, 'errors': ["Missing 'external_id' (required in upsert mode)"]},
+    ]
+    # Without upsert the external_id is optional
+    _, report = validate_budgets(frame.drop(index=[1, 2]), CENTRES)
+    assert report == []
+
+
+def test_validate_budgets_checks_the_period():
+    frame = pd.DataFrame({
+        'centre_id': [CENTRES[1]] * 4,
+        'annee': ['2024', '2024.5', '2024', '2025'],
+        'trimester': ['4', '1', '5', '2.0'],
+        'montant': ['1000', '1000', '1000', '-50'],
+    }, index=[1, 2, 3, 4])
+
+    rows, report = validate_budgets(frame, CENTRES)
+
+    assert list(rows.index) == [1, 4]
+    assert rows.dtypes['annee'] == int and rows.loc[4, 'trimester'] == 2
+    # Negative amounts (credit notes) are accepted, only 0 is refused
+    assert rows.loc[4, 'montant'] == -50.0
+    assert report == [
+        {'row': 2, 'errors': ["Invalid or missing 'annee'"]},
+        {'row': 3, 'errors': ["'trimester' must be between 1 and 4"]},
+    ]
+
+
+def test_missing_columns_fail_every_row():
+    rows, report = validate_budgets(pd.DataFrame({'centre_id': [CENTRES[0]]}, index=[7]), CENTRES)
+    assert rows.empty
+    assert report == [{'row': 7, 'errors': [
+        "Invalid or missing 'annee'", "'trimester' must be between 1 and 4", "Invalid or missing 'montant'"
+    ]}]
@@ -0,0 +1,71 @@
+"""Query string helpers of the depense listing (app.py): filters, projection and cursors.
+
+Importing app doesn't contact MongoDB, so these run without a server.
+"""
+import os
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+from werkzeug.http import parse_etags
+
+os.environ.setdefault('MONGO_URI', os.getenv('TEST_MONGO_URI', 'mongodb://localhost:27017/pme_test'))
+os.environ.setdefault('PASSWORD_WORKERS', '0')
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+import app as api  # noqa: E402
+
+
+@pytest.mark.parametrize('date', [datetime(2024, 3, 31), '2024-03-31', None])
+def test_cursor_round_trip(date):
+    doc = {'_id': ObjectId(), 'date': date}
+    cursor = api.encode_cursor(doc)
+
+    assert cursor.isascii() and '/' not in cursor and '+' not in cursor
+    assert api.decode_cursor(cursor) == (date, doc['_id'])
+
+
+@pytest.mark.parametrize('cursor', ['', 'not a cursor', 'bm90IGpzb24=', 'éé'])
+def test_invalid_cursors_raise_value_error(cursor):
+    with pytest.raises(ValueError, match="Invalid 'cursor'"):
+        api.decode_cursor(cursor)
+
+
+def test_parse_depense_date_keeps_the_utc_day():
+    assert api.parse_depense_date('2024-05-17') == datetime(2024, 5, 17)
+    assert api.parse_depense_date('2024-05-17T23:30:00-02:00') == datetime(2024, 5, 18)
+    assert api.parse_depense_date(datetime(2024, 5, 17, 13, 45)) == datetime(2024, 5, 17)
+    with pytest.raises(ValueError, match="Invalid date '17/05/2024'"):
+        api.parse_depense_date('17/05/2024')
+
+
+def test_build_depense_query():
+    centre_id = str(ObjectId())
+    query = api.build_depense_query({'centre_id': centre_id, 'annee': '2024', 'trimester': '2',
+                                     'created_by': 'alice', 'date_from': '2024-04-01', 'date_to': '2024-05-31Z'})
+    assert query == {
+        'centre_id': ObjectId(centre_id), 'annee': 2024, 'trimester': 2, 'created_by': 'alice',
+        'date': {'$gte': datetime(2024, 4, 1), '$lte': datetime(2024, 5, 31)},
+    }
+    assert api.build_depense_query({}) == {}
+
+
+@pytest.mark.parametrize('args, message', [
+    ({'centre_id': 'abc'}, "Invalid 'centre_id'"),
+    ({'annee': '2024a'}, "Invalid trimester or annee format"),
+    ({'trimester': '5'}, "'trimester' must be between 1 and 4"),
+])
+def test_build_period_query_errors(args, message):
+    with pytest.raises(ValueError, match=message):
+        api.build_period_query(args)
+
+
+def test_build_depense_projection_always_returns_the_sort_key():
+    assert api.build_depense_projection({}) is None
+    assert api.build_depense_projection({'fields': 'montant, _id'}) == {'montant': 1, '_id': 1, 'date': 1}
+    with pytest.raises(ValueError, match='Unknown fields: password'):
+        api.build_depense_projection({'fields': 'montant,password'})
+
+
+def test_etag_versions_accepts_compressed_etags():
+    assert api.etag_versions(parse_etags('"3", "4:gzip", "x", W/"5"')) == {3, 4}
+    assert api.etag_versions(parse_etags('W/"5"'), include_weak=True) == {5}
@@ -0,0 +1,174 @@
+"""Incremental refreshes of the Parquet snapshot (snapshot.py), without MongoDB.
+
+The collections are in-memory lists behind the few pymongo calls refresh makes.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson.objectid import ObjectId
+
+from snapshot import ParquetSnapshot, SnapshotBusy
+
+# Ids from an hour ago, in insertion order, so they are all below the refresh cutoff
+BASE_TIME = int((datetime.now(timezone.utc) - timedelta(hours=1)).timestamp())
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs.sort(key=lambda d: d[key], reverse=direction < 0)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class Collection:
+    # The _id range queries of ParquetSnapshot.refresh on a list of documents
+
+    def __init__(self):
+        self.docs = []
+        self.next_id = 0
+
+    def insert(self, doc, age=None):
+        self.next_id += 1
+        created = BASE_TIME if age is None else int((datetime.now(timezone.utc) - timedelta(seconds=age)).timestamp())
+        doc['_id'] = ObjectId(f"{created:08x}{self.next_id:016x}")
+        self.docs.append(doc)
+        return doc
+
+    def _matches(self, query):
+        bounds = query.get('_id', {})
+        checks = {'$lt': lambda a, b: a < b, '$gt': lambda a, b: a > b, '$gte': lambda a, b: a >= b}
+        return [d for d in self.docs if all(checks[op](d['_id'], value) for op, value in bounds.items())]
+
+    def find(self, query, projection=None):
+        return Cursor(self._matches(query))
+
+    def find_one(self, query, projection=None):
+        docs = self._matches(query)
+        return docs[0] if docs else None
+
+    def count_documents(self, query):
+        return len(self._matches(query))
+
+
+def budget_row(doc):
+    return {'_id': str(doc['_id']), 'centre_id': str(doc['centre_id']), 'annee': doc['annee'],
+            'trimester': doc['trimester'], 'montant': doc['montant']}
+
+
+@pytest.fixture
+def budgets():
+    collection = Collection()
+    centre_id = ObjectId()
+    for annee in (2023, 2024):
+        for trimester in (1, 2, 3, 4):
+            collection.insert({'centre_id': centre_id, 'annee': annee, 'trimester': trimester, 'montant': 100.0})
+    return collection
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    return ParquetSnapshot(str(tmp_path), batch_size=3)
+
+
+def refresh(snapshot, budgets, rewrites=0, versions=None, **kwargs):
+    return snapshot.refresh({'budgets': (budgets, budget_row, rewrites)}, versions or {'budgets': 1}, **kwargs)['budgets']
+
+
+def montants(snapshot):
+    return sorted(snapshot.view().read('budgets', columns=['montant']).column('montant').to_pylist())
+
+
+def test_first_refresh_writes_every_document_by_partition(snapshot, budgets):
+    assert snapshot.view() is None
+    stats = refresh(snapshot, budgets)
+
+    assert stats == {'documents': 8, 'read': 8, 'rebuilt': True}
+    view = snapshot.view()
+    assert view.versions == {'budgets': 1}
+    assert sorted(view.collections['budgets']['files']) == ['annee=2023', 'annee=2024']
+    assert view.read('budgets').num_rows == 8
+    filtered = view.read('budgets', filters=[('annee', '==', 2024), ('trimester', '>=', 3)])
+    assert sorted(filtered.column('trimester').to_pylist()) == [3, 4]
+
+
+def test_later_refreshes_only_append_new_documents(snapshot, budgets):
+    refresh(snapshot, budgets)
+    first = snapshot.view()
+    budgets.insert({'centre_id': ObjectId(), 'annee': 2024, 'trimester': 1, 'montant': 50.0})
+
+    stats = refresh(snapshot, budgets, versions={'budgets': 2})
+
+    assert stats == {'documents': 9, 'read': 1, 'rebuilt': False}
+    view = snapshot.view()
+    assert view != first
+    assert view.versions == {'budgets': 2}
+    assert len(view.files('budgets')) == len(first.files('budgets')) + 1
+    assert montants(snapshot) == [50.0] + [100.0] * 8
+
+
+def test_rewrites_rebuild_into_a_new_generation(snapshot, budgets, tmp_path):
+    refresh(snapshot, budgets)
+    budgets.docs[0]['montant'] = 10.0
+
+    stats = refresh(snapshot, budgets, rewrites=1)
+
+    assert stats['rebuilt'] and stats['read'] == 8
+    assert montants(snapshot) == [10.0] + [100.0] * 7
+    assert snapshot.view().collections['budgets']['generation'] == 2
+    # The previous generation stays for readers of the old manifest until the next refresh
+    assert os.path.isdir(tmp_path / 'budgets' / 'g1')
+    refresh(snapshot, budgets, rewrites=1)
+    assert not os.path.exists(tmp_path / 'budgets' / 'g1')
+
+
+def test_deletes_without_a_rewrite_are_caught_by_the_count(snapshot, budgets):
+    refresh(snapshot, budgets)
+    del budgets.docs[3]
+
+    stats = refresh(snapshot, budgets)
+
+    assert stats == {'documents': 7, 'read': 7, 'rebuilt': True}
+    assert snapshot.view().read('budgets').num_rows == 7
+
+
+def test_recent_documents_wait_for_the_next_refresh(snapshot, budgets):
+    budgets.insert({'centre_id': ObjectId(), 'annee': 2024, 'trimester': 2, 'montant': 1.0}, age=0)
+
+    stats = refresh(snapshot, budgets, lag=60)
+
+    assert stats['documents'] == 8
+    # Documents were left out, so the snapshot doesn't claim to match the data versions
+    assert snapshot.view().versions is None
+
+
+def test_partitions_with_many_parts_are_compacted(tmp_path, budgets):
+    snapshot = ParquetSnapshot(str(tmp_path), batch_size=3, max_parts=2)
+    refresh(snapshot, budgets)
+    for montant in (1.0, 2.0, 3.0):
+        budgets.insert({'centre_id': ObjectId(), 'annee': 2024, 'trimester': 1, 'montant': montant})
+        refresh(snapshot, budgets)
+
+    files = snapshot.view().collections['budgets']['files']
+    assert all(len(parts) <= 2 for parts in files.values())
+    assert montants(snapshot) == [1.0, 2.0, 3.0] + [100.0] * 8
+
+
+def test_concurrent_refreshes_are_refused(snapshot, budgets):
+    with snapshot._lock():
+        with pytest.raises(SnapshotBusy):
+            refresh(snapshot, budgets)
+
+
+def test_empty_collection_reads_as_an_empty_table(snapshot):
+    refresh(snapshot, Collection())
+    table = snapshot.view().read('budgets', columns=['montant'])
+    assert table.num_rows == 0 and table.column_names == ['montant']
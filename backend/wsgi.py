@@ -0,0 +1,8 @@
+from app import app  # noqa: F401
+
+# Production entry point, served by gunicorn with the settings of gunicorn.conf.py:
+#
+#     gunicorn -c gunicorn.conf.py wsgi:app
+#
+# gunicorn.conf.py runs `flask --app app init-db` (initial admin, indexes) once before
+# starting the workers. Run it yourself when serving the app another way.
@@ -8,6 +8,7 @@ const Prediction = () => {
     const [centreId, setCentreId] = useState('');
     const [trimester, setTrimester] = useState('');
     const [annee, setAnnee] = useState('');
+    const [model, setModel] = useState('linear');
     const [prediction, setPrediction] = useState(null);
     const [precision, setPrecision] = useState(null);
     const [error, setError] = useState('');
@@ -34,7 +35,7 @@ const Prediction = () => {
         setError('');
         setLoading(true);
         try {
-            const response = await getPrediction(centreId, trimester, annee);
+            const response = await getPrediction(centreId, trimester, annee, model);
             setPrediction(response.data.prediction);
             setPrecision(response.data.r2_score);
         } catch (err) {
@@ -70,6 +71,12 @@ const Prediction = () => {
                         <option key={y} value={y}>{y}</option>
                     ))}
                 </select>
+                <select value={model} onChange={(e) => setModel(e.target.value)}>
+                    <option value="linear">Tendance linéaire</option>
+                    <option value="seasonal">Tendance + saisonnalité</option>
+                    <option value="holt_winters">Holt-Winters</option>
+                    <option value="robust">Tendance robuste (Theil-Sen)</option>
+                </select>
                 <button onClick={handleGetPrediction} disabled={loading}>
                     {loading ? 'Chargement...' : 'Obtenir la Prédiction'}
                 </button>
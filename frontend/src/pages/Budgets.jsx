@@ -1,14 +1,14 @@
 import React, { useState, useEffect, useContext } from 'react';
 import { getBudgets, addBudget, updateBudget, deleteBudget } from '../services/budgetService';
 import { getCentres } from '../services/centreService';
-import { getDepenses } from '../services/depenseService';
+import { getVariance } from '../services/analyticsService';
 import { AuthContext } from '../context/AuthContext';
 import './Budgets.css';
 
 const Budgets = () => {
     const [budgets, setBudgets] = useState([]);
     const [centres, setCentres] = useState([]);
-    const [depenses, setDepenses] = useState([]);
+    const [reels, setReels] = useState({});
     const [centreId, setCentreId] = useState('');
     const [trimester, setTrimester] = useState('');
     const [annee, setAnnee] = useState('');
@@ -22,13 +22,17 @@ const Budgets = () => {
 
     useEffect(() => {
         fetchBudgets();
-        fetchCentres();
-        fetchDepenses();
+        fetchReels();
     }, []);
 
+    // The budgets come with their centre (expand=centre), the list is only needed by the form
+    useEffect(() => {
+        if (isAdmin) fetchCentres();
+    }, [isAdmin]);
+
     const fetchBudgets = async () => {
         try {
-            const response = await getBudgets();
+            const response = await getBudgets({ expand: 'centre' });
             setBudgets(response.data);
         } catch (err) {
             setError('Échec de la récupération des budgets.');
@@ -44,10 +48,17 @@ const Budgets = () => {
         }
     };
 
-    const fetchDepenses = async () => {
+    const periodKey = (centreId, annee, trimester) => `${centreId}-${annee}-${trimester}`;
+
+    // Actuals of the budgeted periods, summed by the API rather than from every depense
+    const fetchReels = async () => {
         try {
-            const response = await getDepenses();
-            setDepenses(response.data);
+            const response = await getVariance();
+            const byPeriod = {};
+            response.data.forEach(v => {
+                byPeriod[periodKey(v.centre_id.$oid, v.annee, v.trimester)] = v.reel;
+            });
+            setReels(byPeriod);
         } catch (err) {
             setError('Échec de la récupération des dépenses.');
         }
@@ -82,6 +93,7 @@ const Budgets = () => {
             }
             clearForm();
             fetchBudgets();
+            fetchReels();
         } catch (err) {
             setError('Échec de l\'enregistrement du budget.');
         }
@@ -108,29 +120,14 @@ const Budgets = () => {
             await deleteBudget(id);
             setSuccess('Budget supprimé avec succès.');
             fetchBudgets();
+            fetchReels();
         } catch (err) {
             setError('Échec de la suppression du budget.');
         }
     };
-    const getCentreName = (id) => {
-        const centre = centres.find(c => c._id.$oid === id);
-        return centre ? centre.nom : '';
-    };
-
     const calculateReel = (budget) => {
         const { centre_id, trimester, annee } = budget;
-        const total = depenses
-            .filter(d => {
-                const depenseDate = new Date(d.date);
-                const depenseTrimester = Math.floor((depenseDate.getMonth()) / 3) + 1; // Corrected trimester calculation
-                return (
-                    d.centre_id.$oid === centre_id.$oid &&
-                    depenseTrimester === trimester &&
-                    depenseDate.getFullYear() === annee
-                );
-            })
-            .reduce((acc, d) => acc + parseFloat(d.montant), 0);
-        return total.toLocaleString('fr-FR', { minimumFractionDigits: 2, maximumFractionDigits: 2 }) + ' MAD';
+        return reels[periodKey(centre_id.$oid, annee, trimester)] || 0;
     };
 
     const currentYear = new Date().getFullYear();
@@ -202,7 +199,7 @@ const Budgets = () => {
                     </thead>
                     <tbody>
                         {budgets.map((b) => {
-                            const reelValue = parseFloat(calculateReel(b).replace(' MAD', '').replace(/\s/g, '').replace(',', '.')); // Remove spaces and replace comma with dot
+                            const reelValue = calculateReel(b);
                             const montantValue = parseFloat(b.montant);
                             const ecart = reelValue - montantValue;
                             const tauxEcart = (montantValue !== 0) ? (ecart / montantValue) * 100 : 0; // Avoid division by zero
@@ -222,7 +219,7 @@ const Budgets = () => {
 
                             return (
                                 <tr key={b._id.$oid}>
-                                    <td>{getCentreName(b.centre_id.$oid)}</td>
+                                    <td>{b.centre?.nom || ''}</td>
                                     <td>{b.trimester}</td>
                                     <td>{b.annee}</td>
                                     <td>{montantValue.toLocaleString('fr-FR', { minimumFractionDigits: 2, maximumFractionDigits: 2 })} MAD</td>
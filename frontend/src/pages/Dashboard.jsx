@@ -1,8 +1,6 @@
 // Dashboard.jsx
 import React, { useState, useEffect, useContext, useRef } from 'react';
-import { getDepenses } from '../services/depenseService';
-import { getCentres } from '../services/centreService';
-import { getBudgets } from '../services/budgetService';
+import { getAnalytics } from '../services/analyticsService';
 import { 
   BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer, 
   PieChart, Pie, Cell, AreaChart, Area
@@ -11,7 +9,7 @@ import {
   FaChartBar, FaChartPie, FaChartLine, FaMoneyBillWave, FaBuilding, 
   FaArrowUp, FaArrowDown, FaCalendarAlt, FaDownload, FaTag, FaChevronDown
 } from 'react-icons/fa';
-import { format, subYears, eachMonthOfInterval, startOfMonth } from 'date-fns';
+import { format, parseISO } from 'date-fns';
 import { fr } from 'date-fns/locale';
 import './Dashboard.css';
 import Prediction from '../components/Prediction';
@@ -22,9 +20,7 @@ import { AuthContext } from '../context/AuthContext';
 const COLORS = ['#42A5F5', '#66BB6A', '#FFA726', '#EF5350', '#AB47BC', '#7E57C2', '#26A69A', '#FFCA28', '#5C6BC0', '#29B6F6', '#FFEE58', '#FF7043'];
 
 export default function Dashboard() {
-  const [allDepenses, setAllDepenses] = useState([]); // Store all depenses for filtering
-  const [allCentres, setAllCentres] = useState([]); // Store all centres
-  const [allBudgets, setAllBudgets] = useState([]); // Store all budgets
+  const [allCentres, setAllCentres] = useState([]); // Centres for the filter dropdowns
 
   const [barData, setBarData] = useState([]);
   const [pieData, setPieData] = useState([]);
@@ -71,9 +67,22 @@ export default function Dashboard() {
     };
   }, [dropdownRef]);
 
+  const [exportProgress, setExportProgress] = useState(null);
+
   const handleExport = async () => {
     try {
-      const response = await api.get('/api/export/budgets', {
+      // The report is built by a background job on the server; poll until it is ready
+      let { data: job } = await api.post('/api/export/budgets/jobs');
+      while (job.status === 'queued' || job.status === 'running') {
+        setExportProgress(job.progress);
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        ({ data: job } = await api.get(`/api/export/budgets/jobs/${job.job_id}`));
+      }
+      if (job.status !== 'done') {
+        throw new Error(job.error || 'Export failed');
+      }
+
+      const response = await api.get(`/api/export/budgets/jobs/${job.job_id}/file`, {
         responseType: 'blob' // Important: Set responseType to 'blob' for binary data
       });
       const url = window.URL.createObjectURL(new Blob([response.data]));
@@ -87,115 +96,53 @@ export default function Dashboard() {
     } catch (error) {
       console.error('Error exporting budgets:', error);
       alert('Failed to export budgets. Please try again.');
+    } finally {
+      setExportProgress(null);
     }
   };
 
-  const processData = (depenses, centres, budgets) => {
-    // Apply global filters
-    const filteredBudgets = budgets.filter(b => {
-      const matchesYear = selectedGlobalTotalYear === 'all' || b.annee.toString() === selectedGlobalTotalYear;
-      const matchesCentre = selectedGlobalTotalCentre === 'all' || b.centre_id.$oid === selectedGlobalTotalCentre;
-      const matchesTrimester = selectedGlobalTotalTrimester === 'all' || b.trimester.toString() === selectedGlobalTotalTrimester;
-      return matchesYear && matchesCentre && matchesTrimester;
-    });
-
-    const filteredDepenses = depenses.filter(d => {
-      const depenseYear = new Date(d.date).getFullYear();
-      const depenseTrimester = Math.floor((new Date(d.date).getMonth()) / 3) + 1;
-      const matchesYear = selectedGlobalTotalYear === 'all' || depenseYear.toString() === selectedGlobalTotalYear;
-      const matchesCentre = selectedGlobalTotalCentre === 'all' || d.centre_id.$oid === selectedGlobalTotalCentre;
-      const matchesTrimester = selectedGlobalTotalTrimester === 'all' || depenseTrimester.toString() === selectedGlobalTotalTrimester;
-      return matchesYear && matchesCentre && matchesTrimester;
-    });
-
-    // Total Depenses (Actual)
-    const totalActualOverall = filteredDepenses.reduce((acc, d) => acc + parseFloat(d.montant), 0);
-    const numExpenses = filteredDepenses.length;
-
-    // Total Budgets
-    const totalBudgetOverall = filteredBudgets.reduce((acc, b) => acc + parseFloat(b.montant), 0);
-    const numBudgets = filteredBudgets.length;
-
-    // Global Variance
-    const globalVariance = totalActualOverall - totalBudgetOverall;
-
-    // Annual Budget by Centre (grouped by year)
-    const annualBudgetByCentre = {};
-    budgets.forEach(b => { // Use allBudgets for this section, not filtered ones
-      const centreName = centres.find(c => c._id.$oid === b.centre_id.$oid)?.nom || 'N/A';
-      if (!annualBudgetByCentre[centreName]) {
-        annualBudgetByCentre[centreName] = {};
-      }
-      if (!annualBudgetByCentre[centreName][b.annee]) {
-        annualBudgetByCentre[centreName][b.annee] = 0;
-      }
-      annualBudgetByCentre[centreName][b.annee] += parseFloat(b.montant);
-    });
-
-    // Average Budget per Trimester (no longer needed for display)
-    const avgBudgetPerTrimester = numBudgets > 0 ? totalBudgetOverall / numBudgets : 0;
+  const processData = (analytics) => {
+    // Totals and series are aggregated server-side by /api/analytics
+    const coloredByCentre = analytics.by_centre.map((item, index) => ({
+      ...item,
+      color: COLORS[index % COLORS.length]
+    }));
+    setBarData(coloredByCentre);
 
-    // Bar Chart Data (Expenses by Centre)
-    const barChartData = centres.map((centre, index) => {
-      const total = depenses
-        .filter((depense) => depense.centre_id.$oid === centre._id.$oid)
-        .reduce((acc, depense) => acc + parseFloat(depense.montant), 0);
-      return {
-        name: centre.nom,
-        total,
-        color: COLORS[index % COLORS.length],
-        count: depenses.filter(d => d.centre_id.$oid === centre._id.$oid).length
-      };
-    }).filter(item => item.total > 0);
-
-    const sortedBarData = [...barChartData].sort((a, b) => b.total - a.total);
-    setBarData(sortedBarData);
-    
     // Pie Chart Data (Top 6 Centres by Expense)
-    setPieData(sortedBarData.slice(0, 6));
-    
-    // Trend Data
-    const filteredDepensesForTrend = selectedTrendCentre === 'all'
-      ? depenses
-      : depenses.filter(d => d.centre_id.$oid === selectedTrendCentre);
+    setPieData(coloredByCentre.slice(0, 6));
+
+    setTrendData(analytics.trend.map(point => ({
+      month: format(parseISO(point.month), 'MMM yy', { locale: fr }),
+      amount: point.amount
+    })));
 
-    const trend = generateTrendData(filteredDepensesForTrend, timeRange);
-    setTrendData(trend);
-    
-    // Recent Depenses
-    const recentDepenses = depenses
-      .sort((a, b) => new Date(b.date) - new Date(a.date))
-      .slice(0, 5)
-      .map(depense => ({
-        ...depense,
-        centreName: centres.find(c => c._id.$oid === depense.centre_id.$oid)?.nom || 'N/A'
-      }));
-      
+    const { totals } = analytics;
     setStats({
-      totalCentres: centres.length,
-      annualBudgetByCentre,
-      totalBudgetOverall,
-      totalActualOverall,
-      globalVariance,
-      numBudgets, // Still useful internally, just not displayed in quickStats directly
-      numExpenses,
-      avgBudgetPerTrimester, // Still useful internally, just not displayed in quickStats directly
-      recentDepenses
+      totalCentres: analytics.centres.length,
+      annualBudgetByCentre: analytics.annual_budget_by_centre,
+      totalBudgetOverall: totals.budget,
+      totalActualOverall: totals.actual,
+      globalVariance: totals.variance,
+      numBudgets: totals.num_budgets,
+      numExpenses: totals.num_expenses,
+      avgBudgetPerTrimester: totals.avg_budget_per_trimester,
+      recentDepenses: analytics.recent_depenses
     });
   };
 
   const fetchDashboardData = async () => {
     setLoading(true);
     try {
-      const [depensesRes, centresRes, budgetsRes] = await Promise.all([
-        getDepenses(),
-        getCentres(),
-        getBudgets()
-      ]);
-      setAllDepenses(depensesRes.data);
-      setAllCentres(centresRes.data);
-      setAllBudgets(budgetsRes.data);
-      processData(depensesRes.data, centresRes.data, budgetsRes.data);
+      const analyticsRes = await getAnalytics({
+        annee: selectedGlobalTotalYear,
+        trimester: selectedGlobalTotalTrimester,
+        centre_id: selectedGlobalTotalCentre,
+        trend_centre_id: selectedTrendCentre,
+        time_range: timeRange
+      });
+      setAllCentres(analyticsRes.data.centres);
+      processData(analyticsRes.data);
     } catch (error) {
       console.error('Error fetching dashboard data:', error);
     } finally {
@@ -203,43 +150,6 @@ export default function Dashboard() {
     }
   };
 
-  const generateTrendData = (depensesToProcess, range) => {
-    const now = new Date();
-    let startDate;
-
-    switch (range) {
-      case 'month':
-        startDate = startOfMonth(subYears(now, 0));
-        break;
-      case 'quarter':
-        startDate = new Date(now.getFullYear(), now.getMonth() - 2, 1);
-        break;
-      case 'year':
-      default:
-        startDate = subYears(now, 1);
-        break;
-    }
-
-    const dateInterval = eachMonthOfInterval({ start: startDate, end: now });
-
-    const aggregatedData = dateInterval.map(monthStart => {
-      const monthEnd = new Date(monthStart.getFullYear(), monthStart.getMonth() + 1, 0);
-      const totalAmount = depensesToProcess
-        .filter(d => {
-          const depenseDate = new Date(d.date);
-          return depenseDate >= monthStart && depenseDate <= monthEnd;
-        })
-        .reduce((sum, d) => sum + parseFloat(d.montant), 0);
-
-      return {
-        month: format(monthStart, 'MMM yy', { locale: fr }),
-        amount: totalAmount,
-      };
-    });
-
-    return aggregatedData;
-  };
-
   const currentYear = new Date().getFullYear();
   const years = Array.from({ length: 6 }, (_, i) => currentYear - i);
 
@@ -313,9 +223,9 @@ export default function Dashboard() {
               <option value="quarter">Ce trimestre</option>
               <option value="year">Cette année</option>
             </select>
-            <button onClick={handleExport} className="btn btn-primary">
+            <button onClick={handleExport} className="btn btn-primary" disabled={exportProgress !== null}>
               <FaDownload />
-              Exporter
+              {exportProgress !== null ? `Export ${Math.round(exportProgress * 100)}%` : 'Exporter'}
             </button>
           </div>
         </div>
@@ -400,7 +310,7 @@ export default function Dashboard() {
                 >
                   <option value="all">Tous les centres</option>
                   {allCentres.map(centre => (
-                    <option key={centre._id.$oid} value={centre._id.$oid}>{centre.nom}</option>
+                    <option key={centre._id} value={centre._id}>{centre.nom}</option>
                   ))}
                 </select>
               </div>
@@ -533,7 +443,7 @@ export default function Dashboard() {
                 >
                   <option value="all">Tous les centres</option>
                   {allCentres.map(centre => (
-                    <option key={centre._id.$oid} value={centre._id.$oid}>{centre.nom}</option>
+                    <option key={centre._id} value={centre._id}>{centre.nom}</option>
                   ))}
                 </select>
                 {['month', 'quarter', 'year'].map((period) => (
@@ -610,11 +520,11 @@ export default function Dashboard() {
                 </thead>
                 <tbody>
                   {stats.recentDepenses.map((depense) => (
-                    <tr key={depense._id.$oid}>
+                    <tr key={depense._id}>
                       <td className="font-medium">{depense.description}</td>
                       <td>
                         <span className="badge-primary badge">
-                          {depense.centreName}
+                          {depense.centre_name}
                         </span>
                       </td>
                       <td className="font-bold text-green-600">
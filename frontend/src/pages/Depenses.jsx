@@ -11,6 +11,9 @@ import { fr } from 'date-fns/locale';
 import './Depenses.css';
 import { AuthContext } from '../context/AuthContext';
 
+// Depenses loaded per request, the next ones come with the cursor of the last page
+const PAGE_SIZE = 50;
+
 export default function Depenses() {
   const [depenses, setDepenses] = useState([]);
   const [centres, setCentres] = useState([]);
@@ -18,8 +21,8 @@ export default function Depenses() {
   const [selectedCentre, setSelectedCentre] = useState('all');
   const [sortOrder, setSortOrder] = useState('desc');
   const [dateRange, setDateRange] = useState({ start: '', end: '' });
-  const [currentPage, setCurrentPage] = useState(1);
-  const itemsPerPage = 9;
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   // Form states
   const [date, setDate] = useState('');
@@ -28,23 +31,45 @@ export default function Depenses() {
   const [centreId, setCentreId] = useState('');
   const [editing, setEditing] = useState(false);
   const [currentId, setCurrentId] = useState(null);
+  const [currentVersion, setCurrentVersion] = useState(undefined);
   const [isModalOpen, setIsModalOpen] = useState(false);
   const [loading, setLoading] = useState(true);
   const { user } = useContext(AuthContext);
 
+  // The centre and the dates are filtered by the API, a change starts again from the first page
   useEffect(() => {
     fetchData();
-  }, []);
+  }, [selectedCentre, dateRange]);
 
+  // The depenses come with their centre (expand=centre), the whole list is only loaded
+  // for the centre pickers, when one of them is first used
+  const loadCentres = async () => {
+    if (centres.length > 0) return centres;
+    try {
+      const response = await getCentres();
+      setCentres(response.data);
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching centres:', error);
+      return [];
+    }
+  };
+
+  const depenseParams = (cursor) => {
+    const params = { limit: PAGE_SIZE, expand: 'centre' };
+    if (selectedCentre !== 'all') params.centre_id = selectedCentre;
+    if (dateRange.start) params.date_from = dateRange.start;
+    if (dateRange.end) params.date_to = dateRange.end;
+    if (cursor) params.cursor = cursor;
+    return params;
+  };
+
+  // Only the first load shows the spinner, so the filters keep their focus
   const fetchData = async () => {
-    setLoading(true);
     try {
-      const [depensesRes, centresRes] = await Promise.all([
-        getDepenses(),
-        getCentres()
-      ]);
-      setDepenses(depensesRes.data);
-      setCentres(centresRes.data);
+      const response = await getDepenses(depenseParams());
+      setDepenses(response.data.items);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error fetching data:', error);
     } finally {
@@ -52,16 +77,24 @@ export default function Depenses() {
     }
   };
 
-  // Filter and sort depenses
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await getDepenses(depenseParams(nextCursor));
+      setDepenses(prev => [...prev, ...response.data.items]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error fetching data:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // Search and sort the loaded depenses
   const filteredDepenses = depenses.filter(depense => {
     const searchString = (depense.description || '').toLowerCase();
-    const centreName = (centres.find(c => c._id.$oid === depense.centre_id.$oid)?.nom || '').toLowerCase();
-    const matchesSearch = searchString.includes(searchTerm.toLowerCase()) || centreName.includes(searchTerm.toLowerCase());
-    const matchesCentre = selectedCentre === 'all' || depense.centre_id.$oid === selectedCentre;
-    const matchesDate = (!dateRange.start || new Date(depense.date) >= new Date(dateRange.start)) &&
-                       (!dateRange.end || new Date(depense.date) <= new Date(dateRange.end));
-    
-    return matchesSearch && matchesCentre && matchesDate;
+    const centreName = (depense.centre?.nom || '').toLowerCase();
+    return searchString.includes(searchTerm.toLowerCase()) || centreName.includes(searchTerm.toLowerCase());
   }).sort((a, b) => {
     if (sortOrder === 'asc') {
       return parseFloat(a.montant) - parseFloat(b.montant);
@@ -70,33 +103,34 @@ export default function Depenses() {
     }
   });
 
-  // Pagination
-  const totalPages = Math.ceil(filteredDepenses.length / itemsPerPage);
-  const paginatedDepenses = filteredDepenses.slice(
-    (currentPage - 1) * itemsPerPage,
-    currentPage * itemsPerPage
-  );
-
   const handleSubmit = async (e) => {
     e.preventDefault();
     const data = { date, montant, description, centre_id: centreId };
     
     try {
       if (editing) {
-        await updateDepense(currentId, data);
+        await updateDepense(currentId, data, currentVersion);
       } else {
         await addDepense(data);
       }
       fetchData();
       closeModal();
     } catch (error) {
+      if (error.response?.status === 412) {
+        window.alert('Cette dépense a été modifiée entre-temps. Elle a été rechargée, veuillez réessayer.');
+        fetchData();
+        closeModal();
+        return;
+      }
       console.error('Error saving depense:', error);
     }
   };
 
   const handleEdit = (depense) => {
+    loadCentres();
     setEditing(true);
     setCurrentId(depense._id.$oid);
+    setCurrentVersion(depense.version ?? 0);
     setDate(depense.date);
     setMontant(depense.montant);
     setDescription(depense.description);
@@ -104,24 +138,31 @@ export default function Depenses() {
     setIsModalOpen(true);
   };
 
-  const handleDelete = async (id) => {
+  const handleDelete = async (depense) => {
     if (window.confirm('Êtes-vous sûr de vouloir supprimer cette dépense ?')) {
       try {
-        await deleteDepense(id);
+        await deleteDepense(depense._id.$oid, depense.version ?? 0);
         fetchData();
       } catch (error) {
+        if (error.response?.status === 412) {
+          window.alert('Cette dépense a été modifiée entre-temps. Elle a été rechargée.');
+          fetchData();
+          return;
+        }
         console.error('Error deleting depense:', error);
       }
     }
   };
 
-  const openModal = () => {
+  const openModal = async () => {
+    const centreList = await loadCentres();
     setEditing(false);
     setDate(format(new Date(), 'yyyy-MM-dd'));
     setMontant('');
     setDescription('');
-    setCentreId(centres.length > 0 ? centres[0]._id.$oid : '');
+    setCentreId(centreList.length > 0 ? centreList[0]._id.$oid : '');
     setCurrentId(null);
+    setCurrentVersion(undefined);
     setIsModalOpen(true);
   };
 
@@ -134,7 +175,6 @@ export default function Depenses() {
     setSelectedCentre('all');
     setDateRange({ start: '', end: '' });
     setSortOrder('desc');
-    setCurrentPage(1);
   };
 
   const formatDate = (dateString) => {
@@ -198,6 +238,7 @@ return (
           <select
             value={selectedCentre}
             onChange={(e) => setSelectedCentre(e.target.value)}
+            onFocus={loadCentres}
             className="filter-select"
           >
             <option value="all">Tous les centres</option>
@@ -288,7 +329,7 @@ return (
       <section className="expenses-section">
         <div className="section-header">
           <h2 className="section-title">Dépenses Récentes</h2>
-          <span className="expenses-count">{filteredDepenses.length} dépenses</span>
+          <span className="expenses-count">{filteredDepenses.length} dépenses{nextCursor ? ' chargées' : ''}</span>
         </div>
         
         <div className="expenses-table">
@@ -301,7 +342,7 @@ return (
             <div>Actions</div>
           </div>
           
-          {paginatedDepenses.map((depense) => (
+          {filteredDepenses.map((depense) => (
             <div key={depense._id.$oid} className="table-row">
               <div>
                 {depense.created_by || 'N/A'}
@@ -314,7 +355,7 @@ return (
               </div>
               <div>
                 <span className="row-badge">
-                  {centres.find(c => c._id.$oid === depense.centre_id.$oid)?.nom || 'N/A'}
+                  {depense.centre?.nom || 'N/A'}
                 </span>
               </div>
               <div className="row-date">
@@ -326,7 +367,7 @@ return (
                     <button onClick={() => handleEdit(depense)} className="btn btn-secondary btn-icon">
                       <FaPencilAlt />
                     </button>
-                    <button onClick={() => handleDelete(depense._id.$oid)} className="btn btn-danger btn-icon">
+                    <button onClick={() => handleDelete(depense)} className="btn btn-danger btn-icon">
                       <FaTrash />
                     </button>
                   </>
@@ -338,30 +379,10 @@ return (
       </section>
 
       {/* Pagination */}
-      {totalPages > 1 && (
+      {nextCursor && (
         <div className="pagination">
-          <button
-            onClick={() => setCurrentPage(prev => Math.max(prev - 1, 1))}
-            disabled={currentPage === 1}
-            className="btn btn-secondary"
-          >
-            Précédent
-          </button>
-          {[...Array(totalPages)].map((_, index) => (
-            <button
-              key={index}
-              onClick={() => setCurrentPage(index + 1)}
-              className={`btn ${currentPage === index + 1 ? 'btn-primary' : 'btn-secondary'}`}
-            >
-              {index + 1}
-            </button>
-          ))}
-          <button
-            onClick={() => setCurrentPage(prev => Math.min(prev + 1, totalPages))}
-            disabled={currentPage === totalPages}
-            className="btn btn-secondary"
-          >
-            Suivant
+          <button onClick={loadMore} disabled={loadingMore} className="btn btn-secondary">
+            {loadingMore ? 'Chargement...' : 'Charger plus'}
           </button>
         </div>
       )}
@@ -0,0 +1,10 @@
+import { api } from './api';
+
+export const getAnalytics = (params) => {
+  return api.get('/api/analytics', { params });
+};
+
+// Budget vs actual per (centre_id, annee, trimester); params: centre_id, annee, trimester, overrun
+export const getVariance = (params) => {
+  return api.get('/api/variance', { params });
+};
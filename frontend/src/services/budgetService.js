@@ -1,7 +1,8 @@
 import {api} from './api';
 
-export const getBudgets = () => {
-    return api.get('/api/budgets');
+// params: expand (centre, responsable), format
+export const getBudgets = (params) => {
+    return api.get('/api/budgets', { params });
 };
 
 export const addBudget = (budget) => {
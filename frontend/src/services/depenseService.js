@@ -1,7 +1,8 @@
 import { api } from './api';
 
-export const getDepenses = () => {
-  return api.get('/depenses');
+// params: centre_id, created_by, annee, trimester, date_from, date_to, fields, limit, cursor
+export const getDepenses = (params) => {
+  return api.get('/depenses', { params });
 };
 
 export const getDepense = (id) => {
@@ -12,12 +13,16 @@ export const addDepense = (data) => {
   return api.post('/depenses', data);
 };
 
-export const updateDepense = (id, data) => {
-  return api.put(`/depenses/${id}`, data);
+// version: the depense's version when it was loaded. The API answers 412 if it was
+// modified since, instead of overwriting the other change.
+const ifMatch = (version) => (version === undefined ? {} : { headers: { 'If-Match': `"${version}"` } });
+
+export const updateDepense = (id, data, version) => {
+  return api.put(`/depenses/${id}`, data, ifMatch(version));
 };
 
-export const deleteDepense = (id) => {
-  return api.delete(`/depenses/${id}`);
+export const deleteDepense = (id, version) => {
+  return api.delete(`/depenses/${id}`, ifMatch(version));
 };
 
 export const getPrediction = (centreId) => {
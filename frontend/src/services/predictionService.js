@@ -1,5 +1,15 @@
 import {api} from './api';
 
-export const getPrediction = (centreId, trimester, annee) => {
-    return api.get(`/api/predictions?centre_id=${centreId}&trimester=${trimester}&annee=${annee}`);
+export const getPrediction = (centreId, trimester, annee, model = 'linear') => {
+    return api.get(`/api/predictions?centre_id=${centreId}&trimester=${trimester}&annee=${annee}&model=${model}`);
+};
+
+// models: comma-separated model names, all models when omitted
+export const getBacktest = (models) => {
+    return api.get('/api/predictions/backtest', { params: { models } });
+};
+
+// targets: [{ centre_id, trimester, annee }, ...]
+export const getPredictionsBatch = (targets, model = 'linear') => {
+    return api.post('/api/predictions/batch', { targets, model });
 };